@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+N simulated ports on one asyncio loop (AsyncVedirect) against N blocking
+reader threads (os.read + VedirectDemux, decoding HEX lines the same way
+AsyncVedirect does), fed the 'serial dump-1.txt'
+capture through pipes from a separate feeder process.
+
+python3 bench_async.py -n 1 10 50 -s 10 -d 5
+
+-s is the speed-up over 19200 baud (1920 bytes/s per port).
+CPU time is for the reading process only (all its threads).
+'''
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import threading
+import time
+
+from vedirect_async import AsyncVedirect
+from vedirect_demux import VedirectDemux, ASYNC, REPLY
+from vedirect_hex import decode
+from vedirect_parser import TEXT
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serial dump-1.txt')
+BYTES_PER_SECOND = 1920  # 19200 baud, 10 bits per byte
+TICK = 0.01
+
+
+def feeder(write_fds, stream, rate, duration):
+    '''Write stream to every fd at rate bytes/s each for duration seconds, then close them.'''
+    per_tick = max(1, int(rate * TICK))
+    pos = 0
+    end = time.monotonic() + duration
+    next_tick = time.monotonic()
+    while time.monotonic() < end:
+        chunk = stream[pos:pos + per_tick]
+        pos = (pos + per_tick) % (len(stream) - per_tick)
+        for fd in write_fds:
+            try:
+                os.write(fd, chunk)
+            except BlockingIOError:
+                pass
+        next_tick += TICK
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+    for fd in write_fds:
+        os.close(fd)
+
+
+def start_feeder(n, stream, rate, duration):
+    pipes = [os.pipe() for _ in range(n)]
+    for r, w in pipes:
+        os.set_blocking(w, False)
+    ctx = multiprocessing.get_context('fork')
+    proc = ctx.Process(target=feeder, args=([w for r, w in pipes], stream, rate, duration))
+    proc.start()
+    for r, w in pipes:
+        os.close(w)
+    return proc, [r for r, w in pipes]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_asyncio(read_fds):
+    async def consume(ve, counts, i):
+        await ve.start()
+        async for frame in ve.frames():
+            counts[i] += 1
+
+    async def main():
+        counts = [0] * len(read_fds)
+        ports = [AsyncVedirect(fd) for fd in read_fds]
+        await asyncio.gather(*(consume(ve, counts, i) for i, ve in enumerate(ports)))
+        return sum(counts), sum(ve.reads for ve in ports)
+
+    return asyncio.run(main())
+
+
+def run_threads(read_fds):
+    counts = [0] * len(read_fds)
+    reads = [0] * len(read_fds)
+
+    def reader(i, fd):
+        def on_text(frame):
+            counts[i] += 1
+
+        demux = VedirectDemux(None)
+        demux.subscribe(TEXT, on_text)
+        demux.subscribe(REPLY, decode)
+        demux.subscribe(ASYNC, decode)
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                return
+            reads[i] += 1
+            demux.feed(data)
+
+    threads = [threading.Thread(target=reader, args=(i, fd)) for i, fd in enumerate(read_fds)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts), sum(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio vs threads for many VE.Direct ports')
+    parser.add_argument('-n', '--ports', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('-s', '--speedup', type=float, default=10.0)
+    parser.add_argument('-d', '--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with open(DUMP, 'rb') as f:
+        stream = f.read()
+    rate = BYTES_PER_SECOND * args.speedup
+
+    print(f'{"ports":>6} {"mode":>8} {"frames":>8} {"reads":>8} {"cpu s":>7} {"cpu %":>6} {"us/frame":>9}')
+    for n in args.ports:
+        for mode, run in (('asyncio', run_asyncio), ('threads', run_threads)):
+            proc, read_fds = start_feeder(n, stream, rate, args.duration)
+            start_cpu, start = cpu_time(), time.monotonic()
+            frames, reads = run(read_fds)
+            cpu, wall = cpu_time() - start_cpu, time.monotonic() - start
+            proc.join()
+            for fd in read_fds:
+                os.close(fd)
+            print(f'{n:6d} {mode:>8} {frames:8d} {reads:8d} {cpu:7.3f} {100 * cpu / wall:6.1f} '
+                  f'{1e6 * cpu / max(frames, 1):9.1f}')
+
+
+if __name__ == '__main__':
+    main()
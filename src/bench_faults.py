@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+'''
+Frames lost per corrupt byte: Vedirect.input, VedirectParser and
+ResyncParser on the dump files with faults injected.
+
+The dumps ('serial dump-1.txt', 'serial dump.txt', 'raw serial dump.txt')
+are repeated and corrupted at --rate faults per byte, each fault one of:
+a byte changed, a byte dropped, a random byte inserted or a stray ':'
+inserted. Every parser gets the same corrupted stream in --chunk sized reads.
+
+python3 bench_faults.py -r 50 --rate 0 1e-4 1e-3 1e-2
+
+good:   frames that passed the checksum and match a frame of the clean dump
+wrong:  frames that passed the checksum but are not in the clean dump (1/256
+        of corrupted frames get through any sum based check, ResyncParser
+        also drops those with a malformed line)
+lost:   clean frames - good, per fault
+bad hex: HEX lines handed on that fail their checksum
+'''
+
+import argparse
+import os
+import time
+
+from vedirect import Vedirect
+from vedirect_parser import VedirectParser, ResyncParser, Recovered, TEXT, valid_hex_line
+from vedirect_replay import load_capture
+from vedirect_traffic import inject_faults
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DUMPS = ('serial dump-1.txt', 'serial dump.txt', 'raw serial dump.txt')
+
+
+def frame_key(fields):
+    return tuple(sorted(fields.items()))
+
+
+def run_input(stream, chunk, keys):
+    ve = Vedirect(None, None)
+    frames = []
+    start = time.perf_counter()
+    for byte in stream:
+        packet = ve.input(byte)
+        if packet is not None:
+            frames.append(dict(packet))
+    elapsed = time.perf_counter() - start
+    # input() merges every frame into one dict (keys made up by noise stay
+    # in it) and leaves the last HEX line in front of the first value after
+    # it, compare only the keys of the clean frames
+    frames = [{k: v.rsplit('\n', 1)[-1] for k, v in frame.items() if k in keys} for frame in frames]
+    return frames, 0, 0, elapsed, None
+
+
+def run_parser(parser, stream, chunk):
+    view = memoryview(stream)
+    frames = []
+    lines = []
+    recovered = 0
+    start = time.perf_counter()
+    for i in range(0, len(stream), chunk):
+        for kind, payload in parser.feed(view[i:i + chunk]):
+            if kind != TEXT:
+                lines.append(payload)
+            elif isinstance(payload, Recovered):
+                recovered += 1
+            else:
+                frames.append(payload)
+    elapsed = time.perf_counter() - start
+    bad_hex = sum(1 for line in lines if not valid_hex_line(line))
+    return frames, recovered, bad_hex, elapsed, parser.stats() if hasattr(parser, 'stats') else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=50, help='times the dumps are repeated')
+    parser.add_argument('--rate', type=float, nargs='+', default=[0, 1e-4, 1e-3, 1e-2],
+                        help='faults per byte')
+    parser.add_argument('-c', '--chunk', type=int, default=64, help='bytes per read')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    clean = b''.join(load_capture(os.path.join(ROOT, name)).data for name in DUMPS) * args.repeat
+    reference = VedirectParser().frames(clean)
+    known = {frame_key(frame) for frame in reference}
+    keys = {key for frame in reference for key in frame}
+    print(f'{len(clean)} bytes, {len(reference)} frames clean')
+    print(f'{"rate":>7} {"faults":>7} {"parser":<16} {"good":>6} {"wrong":>6} {"recov":>6} '
+          f'{"bad hex":>8} {"resyncs":>8} {"lost/fault":>11} {"MB/s":>6}')
+
+    for rate in args.rate:
+        stream, faults = inject_faults(clean, rate, args.seed)
+        runs = [
+            ('Vedirect.input', lambda: run_input(stream, args.chunk, keys)),
+            ('VedirectParser', lambda: run_parser(VedirectParser(), stream, args.chunk)),
+            ('ResyncParser', lambda: run_parser(ResyncParser(), stream, args.chunk)),
+            ('  recover=True', lambda: run_parser(ResyncParser(recover=True), stream, args.chunk)),
+        ]
+        for name, run in runs:
+            frames, recovered, bad_hex, elapsed, stats = run()
+            good = sum(1 for frame in frames if frame_key(frame) in known)
+            wrong = len(frames) - good
+            lost = (len(reference) - good) / faults if faults else 0.0
+            resyncs = stats['resyncs'] if stats else ''
+            print(f'{rate:>7g} {faults:>7} {name:<16} {good:>6} {wrong:>6} {recovered:>6} '
+                  f'{bad_hex:>8} {resyncs:>8} {lost:>11.2f} {len(stream) / elapsed / 1e6:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+History day record decoding: the old int.from_bytes dict builder against
+the struct decoder (dict and HistoryDay), the batch iterator and the NumPy
+structured array, for n synthetic 34 byte records.
+
+python3 bench_history_record.py -n 100000
+'''
+
+import argparse
+import random
+import time
+
+from vedirect_hex import (HISTORY_STRUCT, decode_history_record, iter_history_records,
+                          history_array, parse_history_record)
+
+
+def parse_history_record_slices(response):
+    '''parse_history_record before the struct decoder, for comparison.'''
+    return {
+        'Reserved': response[0],
+        'Total Yield (kWh)': int.from_bytes(response[1:5], 'little') / 100.0,
+        'Consumed (kWh)': int.from_bytes(response[5:9], 'little') / 100.0,
+        'Max Battery Voltage (V)': int.from_bytes(response[9:11], 'little') / 100.0,
+        'Min Battery Voltage (V)': int.from_bytes(response[11:13], 'little') / 100.0,
+        'Error Database': response[13],
+        'Error 0 (Most Recent)': response[14],
+        'Error 1': response[15],
+        'Error 2': response[16],
+        'Error 3 (Oldest)': response[17],
+        'Time in Bulk (min)': int.from_bytes(response[18:20], 'little'),
+        'Time in Absorption (min)': int.from_bytes(response[20:22], 'little'),
+        'Time in Float (min)': int.from_bytes(response[22:24], 'little'),
+        'Max Power (W)': int.from_bytes(response[24:28], 'little'),
+        'Max Battery Current (A)': int.from_bytes(response[28:30], 'little') / 10.0,
+        'Max PV Voltage (V)': int.from_bytes(response[30:32], 'little') / 100.0,
+        'Day Sequence': int.from_bytes(response[32:34], 'little'),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='history record decoder benchmark')
+    parser.add_argument('-n', '--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    records = [HISTORY_STRUCT.pack(0, rng.randrange(2000), rng.randrange(500), rng.randrange(1300, 1460),
+                                   rng.randrange(1150, 1300), 0, 0, 0, 0, 0, rng.randrange(600),
+                                   rng.randrange(200), rng.randrange(300), rng.randrange(400),
+                                   rng.randrange(300), rng.randrange(1500, 2200), n % 65536)
+               for n in range(args.records)]
+    blob = b''.join(records)
+
+    old, t_old = timed(lambda: [parse_history_record_slices(r) for r in records])
+    new, t_new = timed(lambda: [parse_history_record(r) for r in records])
+    assert old == new
+    _, t_day = timed(lambda: [decode_history_record(r) for r in records])
+    view = memoryview(blob)
+    _, t_offset = timed(lambda: [decode_history_record(view, o) for o in range(0, len(blob), 34)])
+    days, t_iter = timed(lambda: list(iter_history_records(blob)))
+    assert [d.to_dict() for d in days] == old
+
+    print(f'{args.records} records')
+    for name, elapsed in [('int.from_bytes dict', t_old), ('struct dict', t_new),
+                          ('struct HistoryDay', t_day), ('memoryview offsets', t_offset),
+                          ('iter_history_records', t_iter)]:
+        print(f'{name:>22} {1e9 * elapsed / args.records:8.0f} ns/record  {t_old / elapsed:5.1f}x')
+    try:
+        table, t_numpy = timed(lambda: history_array(blob))
+        assert int(table['day_sequence'][-1]) == days[-1].day_sequence
+        print(f'{"history_array":>22} {1e9 * t_numpy / args.records:8.1f} ns/record  {t_old / t_numpy:5.0f}x')
+    except ImportError:
+        print('numpy not installed, history_array skipped')
+
+
+if __name__ == '__main__':
+    main()
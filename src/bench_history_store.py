@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''
+HistoryStore against CSV for a fleet history: file size, write time and
+load time (open + index) for 10 years x 50 devices of synthetic day records.
+The day sequences wrap at 365 as the devices' do.
+
+python3 bench_history_store.py -y 10 -n 50
+'''
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from history_store import HistoryStore, CSV_HEADER, format_row, day_date
+from vedirect_hex import parse_history_record, HISTORY_STRUCT as DAY, DAY_SEQUENCES
+
+
+def synthetic_records(days, rng):
+    records = []
+    for sequence in range(days):
+        records.append(DAY.pack(0, rng.randrange(2000), rng.randrange(500), rng.randrange(1300, 1460),
+                                rng.randrange(1150, 1300), 0, 0, 0, 0, 0, rng.randrange(600),
+                                rng.randrange(200), rng.randrange(300), rng.randrange(400),
+                                rng.randrange(300), rng.randrange(1500, 2200), sequence % DAY_SEQUENCES))
+    return records
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HistoryStore vs CSV benchmark')
+    parser.add_argument('-y', '--years', type=int, default=10)
+    parser.add_argument('-n', '--devices', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    days = 365 * args.years
+    fleet = {f'HQ{n:04d}TEST': synthetic_records(days, rng) for n in range(args.devices)}
+    # oldest first, fetched all at once
+    fetched = int(time.time())
+    days_back = list(range(days - 1, -1, -1))
+    total = days * args.devices
+    print(f'{args.devices} devices x {days} days = {total} records')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'history.vdh')
+        csv_path = os.path.join(tmp, 'history.csv')
+
+        def write_store():
+            with HistoryStore(store_path) as store:
+                for serial, records in fleet.items():
+                    store.append_many(serial, records, fetched, days_back)
+
+        def write_csv():
+            with open(csv_path, 'w') as f:
+                f.write('Serial,' + CSV_HEADER)
+                for serial, records in fleet.items():
+                    for day, record in zip(days_back, records):
+                        f.write(serial + ',' + format_row(day, '', parse_history_record(record)))
+
+        def load_store():
+            return HistoryStore(store_path)
+
+        def load_csv():
+            rows = {}
+            with open(csv_path, newline='') as f:
+                reader = csv.reader(f)
+                next(reader)
+                for row in reader:
+                    rows[(row[0], int(row[1]))] = row
+            return rows
+
+        _, t_store_write = timed(write_store)
+        _, t_csv_write = timed(write_csv)
+        store, t_store_load = timed(load_store)
+        rows, t_csv_load = timed(load_csv)
+        assert len(store.index) == len(rows) == total
+
+        keys = rng.sample(list(rows), min(1000, len(rows)))
+        today = day_date(fetched, 0)
+        _, t_store_get = timed(lambda: [store.get(serial, None, today - day) for serial, day in keys])
+
+        print(f'{"":>8} {"size MB":>8} {"write s":>8} {"load s":>8}')
+        print(f'{"store":>8} {os.path.getsize(store_path) / 1e6:8.2f} {t_store_write:8.3f} {t_store_load:8.3f}')
+        print(f'{"csv":>8} {os.path.getsize(csv_path) / 1e6:8.2f} {t_csv_write:8.3f} {t_csv_load:8.3f}')
+        print(f'store: {len(keys)} random get() {1e3 * t_store_get:.1f} ms')
+        try:
+            table, t_numpy = timed(store.to_numpy)
+            yields, t_column = timed(lambda: table['record']['yield_total'].sum())
+            print(f'store: to_numpy {1e3 * t_numpy:.2f} ms, total yield column {1e3 * t_column:.1f} ms')
+            del table
+        except ImportError:
+            print('store: numpy not installed, column scan skipped')
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
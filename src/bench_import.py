@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+capture_import.py throughput at 1, 2, 4 and 8 worker processes.
+
+Builds an archive of synthetic captures (the 'serial dump-1.txt' capture
+repeated to --size MB per file, SER# rewritten per device with the frame
+checksums fixed up, mtimes a day apart) in a temporary directory, then
+imports it with each worker count.
+
+python3 bench_import.py -d 4 -f 4 -s 8 -w 1 2 4 8
+'''
+
+import argparse
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from capture_import import find_captures, import_captures, CHUNK_SIZE
+from vedirect_parser import CHECKSUM_MARKER
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serial dump-1.txt')
+SERIAL_FIELD = re.compile(rb'\r\nSER#\t([^\r]*)')
+
+
+def with_serial(data, serial):
+    '''data with every SER# value replaced (same length), checksums adjusted to match.'''
+    out = bytearray(data)
+    pos = 0
+    while True:
+        match = SERIAL_FIELD.search(out, pos)
+        if match is None:
+            return bytes(out)
+        old = match.group(1)
+        new = serial.encode().ljust(len(old), b'0')[:len(old)]
+        out[match.start(1):match.end(1)] = new
+        marker = out.find(CHECKSUM_MARKER, match.end())
+        if marker == -1 or marker + len(CHECKSUM_MARKER) >= len(out):
+            return bytes(out)
+        checksum = marker + len(CHECKSUM_MARKER)
+        out[checksum] = (out[checksum] - sum(new) + sum(old)) & 0xFF
+        pos = checksum
+
+
+def make_archive(root, devices, files, size):
+    with open(DUMP, 'rb') as f:
+        dump = f.read()
+    start = time.time() - devices * files * 86400
+    for d in range(devices):
+        data = with_serial(dump, 'HQ%09d' % d)
+        data = data * max(1, int(size * 1e6 / len(data)))
+        for n in range(files):
+            path = os.path.join(root, 'boat%d' % d, 'capture-%03d.txt' % n)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            mtime = start + (n * devices + d) * 86400
+            os.utime(path, (mtime, mtime))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--devices', type=int, default=4)
+    parser.add_argument('-f', '--files', type=int, default=4, help='captures per device')
+    parser.add_argument('-s', '--size', type=float, default=8, help='MB per capture')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='vedirect-import-')
+    try:
+        make_archive(os.path.join(root, 'captures'), args.devices, args.files, args.size)
+        paths = find_captures(os.path.join(root, 'captures'))
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f'{len(paths)} captures, {size / 1e6:.1f} MB, {os.cpu_count()} CPUs')
+        print(f'{"workers":>8} {"seconds":>8} {"MB/s":>8} {"records/s":>10} {"speedup":>8}')
+        baseline = None
+        for workers in args.workers:
+            output = os.path.join(root, 'out%d' % workers)
+            start = time.perf_counter()
+            counts = import_captures(paths, output, workers, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            records = sum(counts.values())
+            print(f'{workers:>8} {elapsed:>8.2f} {size / elapsed / 1e6:>8.2f} '
+                  f'{records / elapsed:>10.0f} {baseline / elapsed:>7.2f}x')
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+'''
+Host side CPU budget of scripts/serial_vedirect.lua, run in an embedded Lua
+(lupa, Lua 5.3 like ArduPilot) with serial and gcs bindings written in Lua.
+
+The script reads at most --budget bytes (128 in the script) per update(),
+which ArduPilot calls every 200 ms. The harness plays a stream into the
+port's receive buffer at 19200 baud (a TEXT block per second), calls
+update() once per tick and records:
+
+    cpu us      time in update() per tick, p50/p99/max (host CPU, not the FC's)
+    backlog     bytes waiting in the receive buffer after the tick, max and at the end
+    growth      backlog growth in bytes/s (least squares over the ticks),
+                above 0 the script falls behind the port
+    dropped     bytes lost because the --rx-buffer byte receive buffer was full
+    lost        frames the device sent (VedirectParser on the stream, before the
+                replies) that the script never returned
+    match       the script's frames against Vedirect.input on the bytes the
+                script read, frame for frame (its input() is wrapped in a
+                second run)
+
+Streams: the dumps in the repo root, and vedirect_traffic.py traffic
+without history replies of its own, the history GETs written by the script
+are answered by a vedirect_emulator.py DeviceEmulator after --latency
+seconds. Like a real device it sends a reply
+only between TEXT blocks, at the first frame boundary after it is due.
+
+ArduPilot's port:available() returns a uint32_t userdata; the harness gives
+a plain number with a toint() method. port:writestring(nil) raises an error
+as in ArduPilot, --lenient ignores it instead (the script's
+hist_list[count / skip_count % #hist_list] is nil every 31st request).
+
+The lost column also shows that input() adds a ':7' reply to the checksum
+of the TEXT block right after it: the block is dropped unless another HEX
+line (ie ':A') comes in between. match is still 'ok' then, Vedirect.input
+does the same.
+
+python3 bench_lua.py --budget 128 256 512 -d 600
+pip install lupa
+'''
+
+import argparse
+import bisect
+import os
+import time
+
+try:
+    from lupa import lua53 as lupa_runtime
+except ImportError:
+    try:
+        import lupa as lupa_runtime
+    except ImportError:
+        lupa_runtime = None
+
+from vedirect import Vedirect
+from vedirect_emulator import DeviceEmulator
+from vedirect_parser import VedirectParser, BLOCK_START, CHECKSUM_MARKER
+from vedirect_replay import Capture, block_timing, load_capture
+from vedirect_traffic import TrafficDevice
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'scripts', 'serial_vedirect.lua')
+DUMPS = ('serial dump-1.txt', 'serial dump.txt', 'raw serial dump.txt')
+BUDGET_SOURCE = 'math.min(n_bytes, 128)'
+
+# the scripting bindings the script uses, the receive buffer is a Lua
+# string so port:read() costs what it would without the harness
+BINDINGS = '''
+local rx_size, lenient = ...
+local rx, rx_pos = '', 1
+local written, messages = {}, {}
+
+debug.setmetatable(0, {__index = {toint = function(n) return math.floor(n) end}})
+
+local port = {}
+function port:begin(baud) end
+function port:set_flow_control(mode) end
+function port:available() return #rx - rx_pos + 1 end
+function port:read()
+  if rx_pos > #rx then return -1 end
+  local byte = string.byte(rx, rx_pos)
+  rx_pos = rx_pos + 1
+  return byte
+end
+function port:writestring(text)
+  if type(text) ~= 'string' then
+    if lenient then return 0 end
+    error('writestring: string expected, got ' .. type(text))
+  end
+  written[#written + 1] = text
+  return #text
+end
+
+serial = {}
+function serial:find_serial(instance) if instance == 0 then return port end end
+
+gcs = {}
+function gcs:send_text(severity, text) messages[#messages + 1] = text end
+
+print = function(...) end
+
+-- bytes arriving from the device, those that do not fit are lost (returns how many were kept)
+function harness_push(data)
+  rx = string.sub(rx, rx_pos)
+  rx_pos = 1
+  local room = rx_size - #rx
+  if #data > room then data = string.sub(data, 1, room) end
+  rx = rx .. data
+  return #data
+end
+
+function harness_take()
+  local w, m = written, messages
+  written, messages = {}, {}
+  return w, m
+end
+'''
+
+# records a copy of every frame input() returns
+WRAP_INPUT = '''
+frames = {}
+local original = input
+input = function(byte)
+  local packet = original(byte)
+  if packet then
+    local copy = {}
+    for k, v in pairs(packet) do copy[k] = v end
+    frames[#frames + 1] = copy
+  end
+  return packet
+end
+'''
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def capture_of(data, name):
+    starts, times = block_timing(data)
+    return Capture(data, starts, times, name)
+
+
+class FrameBounds:
+    '''Where the TEXT blocks of data start and end, to send replies in between.'''
+
+    def __init__(self, data):
+        self.starts = []
+        self.ends = []
+        n = data.find(BLOCK_START)
+        while n != -1:
+            self.starts.append(n)
+            n = data.find(BLOCK_START, n + 1)
+        n = data.find(CHECKSUM_MARKER)
+        while n != -1:
+            self.ends.append(n + len(CHECKSUM_MARKER) + 1)
+            n = data.find(CHECKSUM_MARKER, n + 1)
+
+    def between(self, n):
+        '''True if the byte sent after the first n is not inside a TEXT block.'''
+        k = bisect.bisect_left(self.starts, n)
+        if k == 0:
+            return True
+        k = bisect.bisect_right(self.ends, self.starts[k - 1])
+        return k < len(self.ends) and self.ends[k] <= n
+
+    def next_gap(self, low, high):
+        '''First n in low..high where a reply can go, None if the line is busy with TEXT.'''
+        if self.between(low):
+            return low
+        k = bisect.bisect_left(self.ends, low)
+        if k < len(self.ends) and self.ends[k] <= high:
+            return self.ends[k]
+        return None
+
+
+def python_frames(data):
+    '''Copies of the dicts Vedirect.input returns for data (the same byte state machine).'''
+    ve = Vedirect(None, None)
+    frames = []
+    for byte in data:
+        packet = ve.input(byte)
+        if packet is not None:
+            frames.append(dict(packet))
+    return frames
+
+
+def lua_table(table):
+    return {key.decode('latin-1'): value.decode('latin-1') for key, value in table.items()}
+
+
+class LuaHarness:
+
+    def __init__(self, source, rx_size=512, lenient=False, check=False):
+        self.lua = lupa_runtime.LuaRuntime(encoding=None, unpack_returned_tuples=True)
+        self.lua.execute(BINDINGS, rx_size, lenient)
+        globals_ = self.lua.globals()
+        self.push = globals_.harness_push
+        self.take = globals_.harness_take
+        self.port_available = self.lua.eval('function() return serial:find_serial(0):available() end')
+        # the script runs update() once as it is loaded
+        returned = self.lua.execute(source)
+        self.update = returned[0] if isinstance(returned, tuple) else returned
+        if check:
+            self.lua.execute(WRAP_INPUT)
+        self.globals = globals_
+
+    def available(self):
+        return self.port_available()
+
+    def frames(self):
+        table = self.globals.frames
+        return [lua_table(table[n]) for n in range(1, len(table) + 1)]
+
+
+def slope(samples, interval):
+    '''Least squares growth of samples taken every interval seconds, per second.'''
+    n = len(samples)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2.0
+    mean_y = sum(samples) / float(n)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(samples))
+    variance = sum((x - mean_x) ** 2 for x in range(n))
+    return covariance / variance / interval
+
+
+def run(source, capture, budget, rx_size, interval, latency, lenient, check, answer, seed):
+    '''
+    One pass of the script over capture, returns the per-tick measurements.
+    answer: reply to the GETs the script writes (DeviceEmulator.respond)
+    '''
+    harness = LuaHarness(source.replace(BUDGET_SOURCE, 'math.min(n_bytes, %d)' % budget),
+                         rx_size, lenient, check)
+    emulator = DeviceEmulator(TrafficDevice(seed=seed)) if answer else None
+    data = capture.data
+    bounds = FrameBounds(data)
+    offered = bytearray()           # every byte that reached the port
+    accepted = bytearray()          # the ones that fitted in the receive buffer
+    replies = []                    # (due, bytes)
+    cpu, backlog = [], []
+    sent = 0
+    t = 0.0
+    end = capture.duration() + interval
+    error = None
+    while t < end:
+        t += interval
+        arrived = capture.sent_by(t)
+        chunk = bytes(data[sent:arrived])
+        due = [reply for reply in replies if reply[0] <= t]
+        if due:
+            gap = bounds.next_gap(max(sent, capture.sent_by(due[0][0])), arrived)
+            if gap is not None:
+                for reply in due:
+                    replies.remove(reply)
+                chunk = chunk[:gap - sent] + b''.join(reply[1] for reply in due) + chunk[gap - sent:]
+        sent = arrived
+        offered += chunk
+        kept = harness.push(chunk)
+        accepted += chunk[:kept]
+        start = time.perf_counter()
+        try:
+            harness.update()
+        except lupa_runtime.LuaError as e:
+            error = '%.1f s: %s' % (t, str(e).splitlines()[0])
+            cpu.append(time.perf_counter() - start)
+            backlog.append(harness.available())
+            break
+        cpu.append(time.perf_counter() - start)
+        backlog.append(harness.available())
+        written, _ = harness.take()
+        if emulator is None:
+            continue
+        for n in range(1, len(written) + 1):
+            for line in written[n].split(b'\n'):
+                if line.strip():
+                    reply = emulator.respond(line)
+                    if reply is not None:
+                        replies.append((t + latency, reply))
+    consumed = len(accepted) - backlog[-1] if backlog else 0
+    result = {
+        'ticks': len(cpu),
+        'seconds': len(cpu) * interval,
+        'offered': len(offered),
+        'dropped': len(offered) - len(accepted),
+        'cpu': sorted(cpu),
+        'backlog_max': max(backlog) if backlog else 0,
+        'backlog_end': backlog[-1] if backlog else 0,
+        'growth': slope(backlog, interval),
+        'consumed': consumed,
+        'reference': len(VedirectParser().frames(data[:sent])),
+        'error': error,
+    }
+    if check:
+        result['frames'] = harness.frames()
+        result['expected'] = python_frames(bytes(accepted[:consumed]))
+    return result
+
+
+def compare_frames(lua_frames, python_frames):
+    ''''ok' when both lists are the same, else where they first differ.'''
+    for n, (a, b) in enumerate(zip(lua_frames, python_frames)):
+        if a != b:
+            keys = sorted(k for k in set(a) | set(b) if a.get(k) != b.get(k))
+            return 'frame %d differs in %s' % (n, ', '.join(keys))
+    if len(lua_frames) != len(python_frames):
+        return '%d frames, vedirect.py %d' % (len(lua_frames), len(python_frames))
+    return 'ok'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-b', '--budget', type=int, nargs='+', default=[128, 256, 384, 512],
+                        help='bytes per update() (128 in the script)')
+    parser.add_argument('-d', '--seconds', type=int, default=600, help='seconds of synthetic traffic')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='times the dumps are played')
+    parser.add_argument('--rx-buffer', type=int, default=512, help='receive buffer of the port in bytes')
+    parser.add_argument('-i', '--interval', type=float, default=0.2, help='seconds between update() calls')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds until a GET is answered')
+    parser.add_argument('--lenient', action='store_true', help='ignore port:writestring(nil)')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if lupa_runtime is None:
+        parser.exit(2, 'bench_lua.py needs lupa (pip install lupa)\n')
+    with open(SCRIPT) as f:
+        source = f.read()
+    if BUDGET_SOURCE not in source:
+        parser.exit(2, "%s: no '%s' to set the budget with\n" % (SCRIPT, BUDGET_SOURCE))
+
+    dumps = b''.join(load_capture(os.path.join(ROOT, name)).data for name in DUMPS)
+    streams = [
+        ('dumps', capture_of(dumps * args.repeat, 'dumps'), False),
+        ('synthetic', capture_of(TrafficDevice(seed=args.seed).stream(args.seconds, history_every=0),
+                                  'synthetic'), True),
+    ]
+    print(f'{args.interval * 1e3:g} ms ticks, {args.rx_buffer} byte receive buffer, '
+          f'line rate {1920 * args.interval:.0f} bytes per tick')
+    print(f'{"stream":<10} {"budget":>6} {"offered":>8} {"dropped":>8} {"p50 us":>7} {"p99 us":>7} '
+          f'{"max us":>7} {"us/B":>5} {"backlog":>8} {"growth":>7} {"frames":>7} {"lost":>5}  match')
+    for name, capture, answer in streams:
+        for budget in args.budget:
+            result = run(source, capture, budget, args.rx_buffer, args.interval, args.latency, args.lenient,
+                         False, answer, args.seed)
+            check = run(source, capture, budget, args.rx_buffer, args.interval, args.latency, args.lenient,
+                        True, answer, args.seed)
+            cpu = result['cpu']
+            frames = len(check['frames'])
+            growth = result['growth']
+            per_byte = sum(cpu) / max(result['consumed'], 1) * 1e6
+            print(f'{name:<10} {budget:>6} {result["offered"]:>8} {result["dropped"]:>8} '
+                  f'{percentile(cpu, 50) * 1e6:>7.0f} {percentile(cpu, 99) * 1e6:>7.0f} {cpu[-1] * 1e6:>7.0f} '
+                  f'{per_byte:>5.2f} {result["backlog_max"]:>8} {growth:>7.1f} {frames:>7} '
+                  f'{check["reference"] - frames:>5}  {compare_frames(check["frames"], check["expected"])}')
+            if result['error']:
+                print(f'{"":<10} script error at {result["error"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+Cost of metrics.py on the hot path: Vedirect.frames() over a SerialReader
+on vedirect_traffic.py traffic (TEXT, :A and :7 lines) in --chunk sized
+reads, plain and with instrument_vedirect(), best of --repeat runs each,
+taken in turn. cpu @19200 is the added cost per read at the rate a
+19200 baud port fills reads of that size (1920 bytes/s), as a share of one
+core. Also the time of one scrape (exposition()) and of one HEX round trip
+observation.
+
+python3 bench_metrics.py -f 5000 -c 16 64 -r 5
+'''
+
+import argparse
+import time
+
+import metrics
+from vedirect import Vedirect
+from vedirect_replay import ReplaySerial, BAUDRATE, BITS_PER_BYTE
+from vedirect_traffic import TrafficDevice
+
+
+def run(data, chunk, instrument):
+    ve = Vedirect(ReplaySerial(data, speed=None, timeout=0), None, block_size=chunk)
+    registry = metrics.Registry()
+    if instrument:
+        metrics.instrument_vedirect(ve, 'bench', registry)
+    frames = 0
+    start = time.perf_counter()
+    while not ve.ser.eof:
+        for _ in ve.frames(ve.reader.read()):
+            frames += 1
+    return time.perf_counter() - start, frames, registry
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-f', '--frames', type=int, default=5000, help='seconds of traffic')
+    parser.add_argument('-c', '--chunk', type=int, nargs='+', default=[16, 64, 4096], help='bytes per read')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = TrafficDevice(seed=1).stream(args.frames)
+    print(f'{len(data)} bytes, {args.frames} frames')
+    print(f'{"chunk":>6} {"off MB/s":>9} {"on MB/s":>8} {"overhead":>9} {"ns/read":>8} {"cpu @19200":>11}')
+    for chunk in args.chunk:
+        best = {False: None, True: None}
+        for _ in range(args.repeat):
+            for instrument in (False, True):
+                elapsed, frames, registry = run(data, chunk, instrument)
+                if best[instrument] is None or elapsed < best[instrument]:
+                    best[instrument] = elapsed
+        reads = -(-len(data) // chunk)
+        per_read = (best[True] - best[False]) / reads
+        reads_per_second = BAUDRATE / BITS_PER_BYTE / chunk
+        print(f'{chunk:>6} {len(data) / best[False] / 1e6:>9.2f} {len(data) / best[True] / 1e6:>8.2f} '
+              f'{(best[True] - best[False]) / best[False]:>+9.1%} {1e9 * per_read:>8.0f} '
+              f'{per_read * reads_per_second:>11.4%}')
+
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.exposition()
+    print(f'scrape: {(time.perf_counter() - start) * 10:.3f} ms, {len(text)} bytes')
+    observe = metrics.roundtrip_observer(registry, 'bench')
+    start = time.perf_counter()
+    for n in range(100000):
+        observe('get', 0x1050 + n % 31, 0.02)
+    print(f'HEX round trip observation: {(time.perf_counter() - start) * 10:.2f} us')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+Throughput benchmark: byte at a time Vedirect.input against the chunked
+VedirectParser, using the recorded 'serial dump-1.txt' capture.
+
+python3 bench_parser.py                 # default 200 repeats of the dump
+python3 bench_parser.py -r 1000 -c 1 64 4096
+'''
+
+import argparse
+import os
+import time
+
+from vedirect import Vedirect
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'serial dump-1.txt')
+
+
+def strip_hex_prefix(packet):
+    # Vedirect.input leaves the last HEX line in front of the first value
+    # that follows it ('PID': ':AA9ED0058025B\n0xA060'), the chunked parser
+    # does not, so compare without it
+    return {k: v if k == 'Get' else v.rsplit('\n', 1)[-1] for k, v in packet.items()}
+
+
+def run_legacy(stream):
+    ve = Vedirect(None, None)
+    frames = []
+    start = time.perf_counter()
+    for byte in stream:
+        packet = ve.input(byte)
+        if packet is not None:
+            frames.append(dict(packet))
+    t = time.perf_counter() - start
+    return [strip_hex_prefix(p) for p in frames], t
+
+
+def run_chunked(stream, chunk_size):
+    ve = Vedirect(None, None)
+    view = memoryview(stream)
+    frames = []
+    start = time.perf_counter()
+    for i in range(0, len(stream), chunk_size):
+        for packet in ve.packets(view[i:i + chunk_size]):
+            frames.append(dict(packet))
+    return frames, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VE.Direct parser throughput benchmark')
+    parser.add_argument('-f', '--file', help='raw capture file', default=DUMP)
+    parser.add_argument('-r', '--repeat', help='times to repeat the capture', type=int, default=200)
+    parser.add_argument('-c', '--chunks', help='chunk sizes for the chunked parser', type=int,
+                        nargs='+', default=[1, 16, 64, 256, 4096])
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        stream = f.read() * args.repeat
+    print(f'{len(stream)} bytes from {args.file}')
+
+    legacy, t = run_legacy(stream)
+    base = len(stream) / t
+    print(f'{"input() per byte":>20}: {len(legacy):6d} frames {t:7.3f} s {base / 1e6:7.2f} MB/s')
+
+    for size in args.chunks:
+        frames, t = run_chunked(stream, size)
+        rate = len(stream) / t
+        same = 'same' if frames == legacy else 'DIFFERENT'
+        print(f'{"chunk " + str(size):>20}: {len(frames):6d} frames {t:7.3f} s {rate / 1e6:7.2f} MB/s '
+              f'x{rate / base:5.1f}  ({same} frames)')
+
+
+if __name__ == '__main__':
+    main()
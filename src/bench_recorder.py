@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''
+CPU cost of capture_recorder.py at 19200 baud: --ports simulated ports, each
+--seconds of vedirect_traffic.py traffic handed to a CaptureRecorder in
+--read sized reads with the times a port would deliver them (a second's
+traffic back to back at the baud rate, one second apart).
+
+cpu is the process time spent in CaptureRecorder.write/close (collecting,
+timestamping, compressing and writing the chunks) as a share of one core
+over the same stretch of real time, for all the ports together.
+
+python3 bench_recorder.py -p 12 -d 3600 -c zlib zstd none
+'''
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from capture_recorder import CaptureRecorder, zstandard
+from vedirect_replay import BITS_PER_BYTE, BAUDRATE
+from vedirect_traffic import TrafficDevice, device_serial
+
+
+def port_reads(data, read_size, start=0.0):
+    '''(bytes, monotonic time) of the reads of data, a TEXT block each second.'''
+    byte_time = BITS_PER_BYTE / BAUDRATE
+    reads = []
+    second = start
+    for block in data.split(b'\r\nPID'):
+        if not reads:
+            t = second
+        else:
+            block = b'\r\nPID' + block
+            second += 1.0
+            t = second
+        for i in range(0, len(block), read_size):
+            piece = block[i:i + read_size]
+            t += len(piece) * byte_time
+            reads.append((piece, t))
+    return reads
+
+
+def run(ports, codec, directory):
+    recorders = [CaptureRecorder(directory, 'ttyUSB%d' % n, codec) for n in range(len(ports))]
+    wall = time.time()
+    start = time.process_time()
+    for recorder, reads in zip(recorders, ports):
+        write = recorder.write
+        for data, t in reads:
+            write(data, t, wall + t)
+        recorder.close()
+    cpu = time.process_time() - start
+    bytes_in = sum(r.bytes_in for r in recorders)
+    bytes_out = sum(r.bytes_out for r in recorders)
+    return cpu, bytes_in, bytes_out, sum(r.chunks for r in recorders)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-p', '--ports', type=int, default=12)
+    parser.add_argument('-d', '--seconds', type=int, default=3600, help='seconds of traffic per port')
+    parser.add_argument('-r', '--read', type=int, default=32, help='bytes per read')
+    parser.add_argument('-c', '--codec', nargs='+', default=['zlib', 'zstd', 'none'])
+    args = parser.parse_args()
+
+    ports = [port_reads(TrafficDevice(device_serial(n), seed=n).stream(args.seconds), args.read)
+             for n in range(args.ports)]
+    reads = sum(len(reads) for reads in ports)
+    print(f'{args.ports} ports x {args.seconds} s, {reads} reads of up to {args.read} bytes')
+    print(f'{"codec":<6} {"cpu s":>7} {"cpu %":>7} {"us/read":>8} {"ratio":>6} {"chunks":>7}')
+    for codec in args.codec:
+        if codec == 'zstd' and zstandard is None:
+            print(f'{codec:<6} (zstandard not installed)')
+            continue
+        directory = tempfile.mkdtemp(prefix='bench-recorder-')
+        try:
+            cpu, bytes_in, bytes_out, chunks = run(ports, codec, directory)
+        finally:
+            shutil.rmtree(directory)
+        print(f'{codec:<6} {cpu:>7.3f} {100 * cpu / args.seconds:>7.3f} {1e6 * cpu / reads:>8.2f} '
+              f'{bytes_in / bytes_out:>6.2f} {chunks:>7}')
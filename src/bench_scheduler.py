@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+HEX request throughput of PollScheduler against one GET every second frame
+(serial_vedirect.lua, vedirect.py's __main__), on a simulated device.
+
+The device plays the TEXT frames of 'serial dump-1.txt' once a second and
+answers GETs of the history registers. A request that arrives while it is
+sending a TEXT block is dropped with probability --drop (and delayed to the
+end of the block otherwise); replies go out one after the other at the baud
+rate, so a burst that overruns the gap corrupts the next TEXT block.
+
+python3 bench_scheduler.py -s 10 -d 60 -b 0.5
+
+-s speeds the device up (baud rate and block period), -d is in device
+seconds, so the run takes d / s seconds per mode.
+'''
+
+import argparse
+import random
+import time
+
+from poll_scheduler import PollScheduler, BAUDRATE, BITS_PER_BYTE
+from vedirect import Vedirect
+from vedirect_hex import (decode, encode, encode_get, register_payload, GET, HISTORY_DAYS,
+                          HISTORY_REGISTER, HISTORY_STRUCT)
+from vedirect_parser import CHECKSUM_MARKER
+from vedirect_replay import Capture, ReplaySerial, block_timing, BLOCK_START
+from bench_async import DUMP
+
+
+def text_capture(path=DUMP):
+    '''The TEXT frames of a capture alone, one a second.'''
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    start = data.find(BLOCK_START)
+    while start != -1:
+        marker = data.find(CHECKSUM_MARKER, start)
+        if marker == -1:
+            break
+        end = marker + len(CHECKSUM_MARKER) + 1
+        frames.append(data[start:end])
+        start = data.find(BLOCK_START, end)
+    stream = b''.join(frames)
+    starts, times = block_timing(stream)
+    # keep the gap after the last block when the device loops
+    starts.append(len(stream))
+    times.append(times[-1] + 1.0)
+    return Capture(stream, starts, times, 'text')
+
+
+class SimulatedDevice(ReplaySerial):
+    '''TEXT blocks from a capture plus GET replies, paced at speed times the baud rate.'''
+
+    def __init__(self, capture, speed=1.0, drop=0.5, latency=0.005, seed=1):
+        super().__init__(capture, speed, timeout=0.05, loop=True)
+        self.drop = drop
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.byte_time = BITS_PER_BYTE / BAUDRATE / speed
+        self.replies = []           # (monotonic time fully sent, bytes), in order
+        self.reply_free = 0.0
+        self.dropped = 0
+        self.delayed = 0
+        # block start and end times within one lap, in device seconds
+        self.blocks = [(t, t + (end - start) * capture.byte_time)
+                       for start, end, t in zip(capture.starts, capture.starts[1:] + [len(capture)],
+                                                capture.times)]
+
+    def block_end(self, now):
+        '''Monotonic end of the TEXT block being sent at now, None between blocks.'''
+        elapsed = (now - self.start) * self.speed
+        laps, offset = divmod(elapsed, self.lap())
+        for start, end in self.blocks:
+            if start <= offset < end:
+                return self.start + (laps * self.lap() + end) / self.speed
+        return None
+
+    def write(self, data):
+        super().write(data)
+        now = time.monotonic()
+        # the requests arrive one after the other at the baud rate
+        for line in bytes(data).split(b'\n'):
+            now += (len(line) + 1) * self.byte_time
+            message = decode(line + b'\n')
+            if message is None or message.command != GET:
+                continue
+            ready = now + self.latency / self.speed
+            busy = self.block_end(now)
+            if busy is not None:
+                if self.random.random() < self.drop:
+                    self.dropped += 1
+                    continue
+                self.delayed += 1
+                ready = max(ready, busy)
+            day = message.register - HISTORY_REGISTER
+            if 0 <= day < HISTORY_DAYS:
+                value = HISTORY_STRUCT.pack(0, 100, 0, 1300, 1200, 0, 0, 0, 0, 0,
+                                            1, 2, 3, 4, 5, 6, 85 - day)
+            else:
+                value = b'\x04\x00'
+            reply = encode(GET, register_payload(message.register, 0, value))
+            start = max(ready, self.reply_free)
+            self.reply_free = start + len(reply) * self.byte_time
+            self.replies.append((self.reply_free, reply))
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        ready = sum(len(reply) for t, reply in self.replies if t <= now)
+        return ready + ReplaySerial.in_waiting.fget(self)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            now = time.monotonic()
+            if self.replies and self.replies[0][0] <= now:
+                t, reply = self.replies.pop(0)
+                if len(reply) > size:
+                    self.replies.insert(0, (t, reply[size:]))
+                return reply[:size]
+            n = min(size, ReplaySerial.in_waiting.fget(self))
+            if n:
+                return self.take(n)
+            if now >= deadline:
+                return b''
+            wake = min(self.time_of(self.pos), deadline)
+            if self.replies:
+                wake = min(wake, self.replies[0][0])
+            time.sleep(max(wake - now, 0.0002))
+
+
+def utilization(ve, duration):
+    '''Share of the device -> host line used, from the bytes read.'''
+    return ve.reader.bytes / duration * ve.ser.byte_time
+
+
+def run_fixed(device, duration, every=2):
+    '''One history GET every second frame, sent as soon as the frame is parsed.'''
+    ve = Vedirect(device, 0.05)
+    requests = [encode_get(HISTORY_REGISTER + day) for day in range(HISTORY_DAYS)]
+    count = sent = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for packet in ve.packets(ve.reader.read()):
+            count += 1
+            if count % every == 0:
+                device.write(requests[count // every % len(requests)])
+                sent += 1
+    counts = ve.demux.stats()['counts']
+    return {'sent': sent, 'answered': counts['reply'], 'frames': counts['text'],
+            'bad_frames': ve.demux.parser.frames_bad, 'utilization': utilization(ve, duration)}
+
+
+def run_scheduled(device, duration, budget, gaps, speed):
+    ve = Vedirect(device, 0.05)
+    scheduler = PollScheduler(ve, budget=budget, guard=0.02 / speed, timeout=0.5 / speed,
+                              baudrate=BAUDRATE * speed, gaps=gaps)
+    scheduler.add_history(HISTORY_DAYS, interval=0.0)     # poll as fast as the line allows
+    frames = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        frames += len(scheduler.poll())
+    stats = scheduler.stats()
+    return {'sent': stats['sent'], 'answered': stats['answered'], 'frames': frames,
+            'bad_frames': ve.demux.parser.frames_bad, 'utilization': utilization(ve, duration)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--speed', type=float, default=10.0)
+    parser.add_argument('-d', '--duration', type=float, default=60.0, help='device seconds per mode')
+    parser.add_argument('-b', '--budget', type=float, default=0.5, help='line utilization budget')
+    parser.add_argument('--drop', type=float, default=0.5,
+                        help='chance a request arriving during a TEXT block is lost')
+    args = parser.parse_args()
+
+    capture = text_capture()
+    wall = args.duration / args.speed
+    modes = [
+        ('1 GET / 2 frames', lambda device: run_fixed(device, wall)),
+        ('scheduler', lambda device: run_scheduled(device, wall, args.budget, True, args.speed)),
+        ('budget, no gaps', lambda device: run_scheduled(device, wall, args.budget, False, args.speed)),
+    ]
+    print(f'{args.duration:.0f} device seconds at {args.speed:g}x, budget {args.budget:.0%}, '
+          f'drop {args.drop:.0%} during TEXT')
+    print(f'{"mode":<18} {"sent":>6} {"answered":>9} {"req/s":>7} {"lost":>6} '
+          f'{"frames":>7} {"bad":>5} {"line":>5} {"vs fixed":>9}')
+    baseline = None
+    for name, run in modes:
+        device = SimulatedDevice(capture, args.speed, args.drop)
+        result = run(device)
+        rate = result['answered'] / args.duration
+        baseline = baseline or rate
+        print(f'{name:<18} {result["sent"]:>6} {result["answered"]:>9} {rate:>7.2f} '
+              f'{device.dropped:>6} {result["frames"]:>7} {result["bad_frames"]:>5} {result["utilization"]:>5.0%} '
+              f'{rate / baseline if baseline else 0:>8.1f}x')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+'''
+Fan-out latency of shared_frame.py: one publisher process writing the
+'serial dump-1.txt' frames at --rate Hz, N reader processes polling the
+sequence counter and reading each new frame.
+
+latency is publish to read (monotonic clock, the same in every process),
+missed counts frames a reader never saw because the next one replaced it
+first, retries the reads that had to be repeated because the slot was being
+written.
+
+python3 bench_shared.py -n 1 10 20 -r 100 -d 5
+'''
+
+import argparse
+import multiprocessing
+import time
+
+from shared_frame import FramePublisher, FrameReader
+from vedirect import Vedirect
+from bench_async import DUMP
+
+NAME = 'bench-shared'
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+def publisher(frames, rate, duration, ready):
+    with FramePublisher(NAME) as pub:
+        ready.wait()
+        period = 1.0 / rate
+        next_time = time.monotonic()
+        end = next_time + duration
+        n = 0
+        while time.monotonic() < end:
+            pub.publish(frames[n % len(frames)])
+            n += 1
+            next_time += period
+            time.sleep(max(0.0, next_time - time.monotonic()))
+        # readers stop after 0.5 s without a new frame, keep the block until then
+        time.sleep(1.0)
+
+
+def reader(interval, ready, results):
+    while True:
+        try:
+            r = FrameReader(NAME)
+            break
+        except FileNotFoundError:
+            time.sleep(0.01)
+    ready.wait()
+    latencies = []
+    seen = missed = 0
+    seq = r.seq
+    read_time = 0.0
+    while True:
+        new = r.wait(seq, timeout=0.5, interval=interval)
+        if new == seq:
+            break
+        start = time.perf_counter()
+        snapshot = r.read()
+        read_time += time.perf_counter() - start
+        latencies.append(time.monotonic() - snapshot.published)
+        if seq:
+            missed += snapshot.seq - seq - 1
+        seen += 1
+        seq = snapshot.seq
+    results.put((latencies, seen, missed, r.retries, read_time))
+    r.close()
+
+
+def run(n, frames, rate, duration, interval):
+    ctx = multiprocessing.get_context('fork')
+    ready = ctx.Barrier(n + 1)
+    results = ctx.Queue()
+    pub = ctx.Process(target=publisher, args=(frames, rate, duration, ready))
+    pub.start()
+    readers = [ctx.Process(target=reader, args=(interval, ready, results)) for _ in range(n)]
+    for proc in readers:
+        proc.start()
+    collected = [results.get() for _ in readers]
+    for proc in readers + [pub]:
+        proc.join()
+    latencies = sorted(t for result in collected for t in result[0])
+    seen = sum(result[1] for result in collected)
+    return {
+        'seen': seen,
+        'missed': sum(result[2] for result in collected),
+        'retries': sum(result[3] for result in collected),
+        'read_us': 1e6 * sum(result[4] for result in collected) / max(seen, 1),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--readers', type=int, nargs='+', default=[1, 10, 20])
+    parser.add_argument('-r', '--rate', type=float, default=100.0, help='frames published per second')
+    parser.add_argument('-d', '--duration', type=float, default=5.0)
+    parser.add_argument('-i', '--interval', type=float, default=0.0005, help='reader poll interval')
+    args = parser.parse_args()
+
+    with open(DUMP, 'rb') as f:
+        frames = list(Vedirect(None, None).frames(f.read()))
+    print(f'{args.rate:g} frames/s for {args.duration:g} s, readers poll every {args.interval * 1e3:g} ms')
+    print(f'{"readers":>8} {"reads":>7} {"missed":>7} {"retries":>8} {"read us":>8} '
+          f'{"p50 ms":>7} {"p99 ms":>7} {"max ms":>7}')
+    for n in args.readers:
+        result = run(n, frames, args.rate, args.duration, args.interval)
+        print(f'{n:>8} {result["seen"]:>7} {result["missed"]:>7} {result["retries"]:>8} '
+              f'{result["read_us"]:>8.1f} {result["p50"] * 1e3:>7.2f} {result["p99"] * 1e3:>7.2f} '
+              f'{result["max"] * 1e3:>7.2f}')
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+'''
+Parser benchmark suite on synthetic traffic, results saved as JSON.
+
+Runs Vedirect.input (byte at a time), the chunked VedirectParser and
+ResyncParser, SolarHistory.process_byte and parse_history_record on streams
+from vedirect_traffic.py (one per device, each through its own parser), and
+records for each:
+
+    frames_per_second, bytes_per_second     best of --repeat runs
+    latency_us  p50 / p99 / max             time from one completed frame to
+                                            the next (the cost of a second of
+                                            traffic, HEX lines included); per
+                                            call for parse_history_record
+    alloc_peak_bytes                        tracemalloc peak during a run
+    alloc_retained_blocks                   blocks still allocated after it
+
+CPython has no count of allocations made, the peak and the retained blocks
+show the regressions that matter here (buffers that grow, frames kept alive).
+
+python3 bench_suite.py -n 4 -f 2000 -o bench.json
+python3 bench_suite.py -o new.json --compare bench.json     # exit 1 on a >10% regression
+'''
+
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from solar_history import SolarHistory
+from vedirect import Vedirect
+from vedirect_hex import parse_history_record, HISTORY_DAYS, HISTORY_RECORD_SIZE
+from vedirect_parser import VedirectParser, ResyncParser, TEXT
+from vedirect_replay import ReplaySerial
+from vedirect_traffic import TrafficDevice, generate, device_serial, inject_faults
+
+FORMAT_VERSION = 1
+# metric -> True when higher is better
+METRICS = {'frames_per_second': True, 'bytes_per_second': True, 'latency_us.p99': False,
+           'alloc_peak_bytes': False}
+
+
+def run_input(streams, chunk):
+    latencies = []
+    frames = 0
+    for data in streams:
+        ve = Vedirect(None, None)
+        last = time.perf_counter()
+        for byte in data:
+            if ve.input(byte) is not None:
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                frames += 1
+    return frames, latencies
+
+
+def run_chunked(streams, chunk, parser_class=VedirectParser):
+    latencies = []
+    frames = 0
+    for data in streams:
+        parser = parser_class()
+        view = memoryview(data)
+        last = time.perf_counter()
+        for i in range(0, len(data), chunk):
+            for kind, payload in parser.feed(view[i:i + chunk]):
+                if kind == TEXT:
+                    now = time.perf_counter()
+                    latencies.append(now - last)
+                    last = now
+                    frames += 1
+    return frames, latencies
+
+
+def run_resync(streams, chunk):
+    return run_chunked(streams, chunk, ResyncParser)
+
+
+def run_process_byte(streams, chunk):
+    '''SolarHistory.process_byte on day 0 replies, a frame is a completed reply.'''
+    latencies = []
+    frames = 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for data in streams:
+            history = SolarHistory(None, timeout=60)
+            history.ser = ReplaySerial(b'')
+            last = time.perf_counter()
+            for n in range(len(data)):
+                result = history.process_byte(data[n:n + 1])
+                if result is not None and history.state == history.FOUND:
+                    now = time.perf_counter()
+                    latencies.append(now - last)
+                    last = now
+                    frames += 1
+    return frames, latencies
+
+
+def run_history_record(records, chunk):
+    latencies = []
+    clock = time.perf_counter
+    for record in records:
+        start = clock()
+        parse_history_record(record)
+        latencies.append(clock() - start)
+    return len(records), latencies
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def measure(run, inputs, size, chunk, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        frames, latencies = run(inputs, chunk)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, frames, latencies)
+    elapsed, frames, latencies = best
+    latencies.sort()
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    run(inputs, chunk)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    return {
+        'frames': frames,
+        'bytes': size,
+        'seconds': elapsed,
+        'frames_per_second': frames / elapsed,
+        'bytes_per_second': size / elapsed,
+        'latency_us': {
+            'p50': percentile(latencies, 50) * 1e6,
+            'p99': percentile(latencies, 99) * 1e6,
+            'max': latencies[-1] * 1e6 if latencies else 0.0,
+        },
+        'alloc_peak_bytes': peak,
+        'alloc_retained_blocks': sys.getallocatedblocks() - blocks,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def metric(result, name):
+    for part in name.split('.'):
+        result = result[part]
+    return result
+
+
+def compare(results, baseline, threshold):
+    '''Print the change of each metric against baseline, returns the regressions.'''
+    regressions = []
+    print(f'\n{"benchmark":<22} {"metric":<18} {"baseline":>12} {"now":>12} {"change":>8}')
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        for key, higher_is_better in METRICS.items():
+            before, after = metric(old, key), metric(result, key)
+            if not before:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = ' <--' if worse > threshold else ''
+            if flag:
+                regressions.append((name, key, change))
+            print(f'{name:<22} {key:<18} {before:>12.1f} {after:>12.1f} {change:>+7.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--devices', type=int, default=4)
+    parser.add_argument('-f', '--frames', type=int, default=2000, help='seconds of traffic per device')
+    parser.add_argument('--noise', type=float, default=0.0, help='faults per byte')
+    parser.add_argument('-c', '--chunk', type=int, default=64, help='bytes per feed() of the chunked parsers')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    parser.add_argument('-b', '--bench', nargs='+', help='benchmarks to run (default all)')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10, help='regression threshold')
+    args = parser.parse_args()
+
+    streams = list(generate(args.devices, args.frames, args.noise, args.seed).values())
+    # SolarHistory only follows the reply to its own GET, day 0
+    history_streams = []
+    for n in range(args.devices):
+        data = TrafficDevice(device_serial(n), seed=args.seed + n).stream(args.frames, history_days=1)
+        history_streams.append(inject_faults(data, args.noise, args.seed + n)[0] if args.noise else data)
+    device = TrafficDevice(seed=args.seed)
+    records = [device.history_record(day % HISTORY_DAYS) for day in range(args.devices * args.frames)]
+
+    size = sum(len(data) for data in streams)
+    benchmarks = {
+        'vedirect_input': (run_input, streams, size),
+        'vedirect_parser': (run_chunked, streams, size),
+        'resync_parser': (run_resync, streams, size),
+        'solar_history': (run_process_byte, history_streams, sum(len(data) for data in history_streams)),
+        'parse_history_record': (run_history_record, records, len(records) * HISTORY_RECORD_SIZE),
+    }
+    names = args.bench or list(benchmarks)
+    unknown = set(names) - set(benchmarks)
+    if unknown:
+        parser.error('unknown benchmark %s (choose from %s)' % (', '.join(sorted(unknown)), ', '.join(benchmarks)))
+
+    print(f'{args.devices} devices x {args.frames} s, {size / 1e6:.2f} MB, noise {args.noise:g}')
+    print(f'{"benchmark":<22} {"frames/s":>10} {"MB/s":>7} {"p50 us":>8} {"p99 us":>8} '
+          f'{"peak KiB":>9} {"retained":>9}')
+    results = {}
+    for name in names:
+        run, inputs, nbytes = benchmarks[name]
+        result = results[name] = measure(run, inputs, nbytes, args.chunk, args.repeat)
+        print(f'{name:<22} {result["frames_per_second"]:>10.0f} {result["bytes_per_second"] / 1e6:>7.2f} '
+              f'{result["latency_us"]["p50"]:>8.1f} {result["latency_us"]["p99"]:>8.1f} '
+              f'{result["alloc_peak_bytes"] / 1024:>9.1f} {result["alloc_retained_blocks"]:>9}')
+
+    report = {
+        'format': FORMAT_VERSION,
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'params': {'devices': args.devices, 'frames': args.frames, 'noise': args.noise,
+                   'chunk': args.chunk, 'repeat': args.repeat, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('results written to', args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print('note: the baseline was run with', baseline.get('params'))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) over {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
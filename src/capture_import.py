@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Bulk import of archived VE.Direct serial captures.
+
+Scans a directory tree for captures (raw bytes like 'serial dump-1.txt',
+comma separated decimals like 'raw serial dump.txt', logic analyser CSVs),
+decodes every TEXT frame and ':7' / ':A' HEX line on a process pool and
+writes one time ordered JSON lines file per device (by SER#):
+
+    python3 capture_import.py ~/captures -o imported -w 8
+    imported/HQ2423N36NE.jsonl
+        {"time": 1718000000.0, "type": "text", "frame": {"PID": "0xA060", "V": 12800, ...}}
+        {"time": 1718000000.6, "type": "hex", "line": ":7501...", "command": 7,
+         "register": 4176, "flags": 0, "value": "00A0...", "history": {...}}
+
+Raw captures are split into chunks of about --chunk-size bytes. A chunk
+always ends right after a TEXT frame's checksum byte, where the device
+only ever sends HEX lines or the next frame, so each chunk decodes on its
+own with a fresh VedirectParser and nothing is lost or counted twice at the
+seams. Captures in the other formats are one chunk each.
+
+Recordings of capture_recorder (.vdc) are timed from the wall clock time
+stored with their first chunk. Other captures carry no wall clock time: the
+last byte is taken to be received at the file's mtime and the rest is timed
+back from there as vedirect_replay does (capture timestamps, else 19200 baud
+with a TEXT block per second).
+HEX lines have no SER#, they go to the device of the capture they are in.
+'''
+
+import argparse
+import bisect
+import fnmatch
+import heapq
+import json
+import os
+import re
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+from capture_recorder import CaptureFile
+from vedirect_frame import VedirectFrame
+from vedirect_hex import decode, decode_history_record, HISTORY_RECORD_SIZE, HISTORY_REGISTER, HISTORY_DAYS
+from vedirect_parser import VedirectParser, CHECKSUM_MARKER, TEXT
+from vedirect_replay import load_capture, Capture, BLOCK_START
+
+PATTERNS = ('*.txt', '*.bin', '*.raw', '*.csv', '*.vdc')
+CHUNK_SIZE = 1 << 20
+
+# path:   capture file
+# data:   capture bytes when they are not the file's bytes (decimal, CSV), else None
+# start, end:  byte range of the capture
+# starts, times:  timing anchors of the capture (vedirect_replay.Capture)
+# base:   wall clock time of byte 0
+Chunk = namedtuple('Chunk', ['path', 'index', 'data', 'start', 'end', 'starts', 'times', 'base'])
+
+
+def find_captures(root, patterns=PATTERNS):
+    '''Capture files under root (or root itself if it is a file), in path order.'''
+    if os.path.isfile(root):
+        return [root]
+    found = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                found.append(os.path.join(directory, name))
+    return found
+
+
+def chunk_bounds(data, chunk_size):
+    '''Offsets splitting data into chunks of about chunk_size, each just after a checksum byte.'''
+    bounds = [0]
+    n = len(data)
+    pos = chunk_size
+    while pos < n:
+        marker = data.find(CHECKSUM_MARKER, pos)
+        if marker == -1:
+            break
+        end = marker + len(CHECKSUM_MARKER) + 1
+        if end >= n:
+            break
+        bounds.append(end)
+        pos = end + chunk_size
+    bounds.append(n)
+    return bounds
+
+
+def plan_file(path, chunk_size=CHUNK_SIZE):
+    '''Load a capture once for its timing and split it into Chunks.'''
+    if path.endswith('.vdc'):
+        # capture times count from the first chunk, which has its wall clock start
+        recording = CaptureFile(path)
+        capture = recording.capture()
+        base = recording.entries[0].wall if recording.entries else recording.wall
+    else:
+        capture = load_capture(path)
+        base = os.path.getmtime(path) - capture.duration()
+    raw = not path.endswith('.csv') and len(capture) == os.path.getsize(path)
+    if not raw:
+        # decoded here already, hand over the bytes as one chunk
+        return [Chunk(path, 0, capture.data, 0, len(capture), capture.starts, capture.times, base)]
+    chunks = []
+    bounds = chunk_bounds(capture.data, chunk_size)
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        # anchors in range plus the one the chunk starts after
+        first = max(0, bisect.bisect_right(capture.starts, start) - 1)
+        last = bisect.bisect_right(capture.starts, end)
+        chunks.append(Chunk(path, index, None, start, end, capture.starts[first:last],
+                            capture.times[first:last], base))
+    return chunks
+
+
+def hex_record(t, line):
+    message = decode(line)
+    record = {'time': t, 'type': 'hex', 'line': line.decode('latin-1').strip()}
+    if message is None:
+        record['error'] = 'checksum'
+        return record
+    record['command'] = message.command
+    if message.register is not None:
+        value = bytes(message.value)
+        record['register'] = message.register
+        record['flags'] = message.flags
+        record['value'] = value.hex().upper()
+        if (HISTORY_REGISTER <= message.register < HISTORY_REGISTER + HISTORY_DAYS
+                and not message.flags and len(value) >= HISTORY_RECORD_SIZE):
+            record['history'] = decode_history_record(value).to_dict()
+    return record
+
+
+def decode_chunk(chunk):
+    '''
+    Decode one chunk. Returns (path, index, serials, records) with records a
+    time ordered list of (time, json line); serials counts the SER# seen.
+    '''
+    if chunk.data is not None:
+        data = chunk.data[chunk.start:chunk.end]
+    else:
+        with open(chunk.path, 'rb') as f:
+            f.seek(chunk.start)
+            data = f.read(chunk.end - chunk.start)
+    capture = Capture(b'', list(chunk.starts), list(chunk.times))
+    parser = VedirectParser()
+    serials = Counter()
+    records = []
+    # feed a TEXT block (and the HEX lines after it) at a time, so every
+    # event can be given the time of the block it came in
+    pos = 0
+    n = len(data)
+    while pos < n:
+        block = data.find(BLOCK_START, pos + 1)
+        end = n if block == -1 else block
+        block_time = chunk.base + capture.time_of(chunk.start + pos)
+        hex_pos = pos
+        for kind, payload in parser.feed(data[pos:end]):
+            if kind == TEXT:
+                frame = VedirectFrame(payload, block_time)
+                serial = frame.get('SER#')
+                if serial:
+                    serials[serial] += 1
+                records.append((block_time, json.dumps(
+                    {'time': block_time, 'type': 'text', 'frame': frame.to_dict()})))
+            else:
+                found = data.find(payload, hex_pos)
+                if found != -1:
+                    hex_pos = found + len(payload)
+                t = chunk.base + capture.time_of(chunk.start + hex_pos)
+                records.append((t, json.dumps(hex_record(t, payload))))
+        pos = end
+    records.sort(key=itemgetter(0))
+    return chunk.path, chunk.index, serials, records
+
+
+def device_name(path, serials):
+    if serials:
+        return serials.most_common(1)[0][0]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r'[^\w.-]+', '_', stem)
+
+
+def import_captures(paths, output, workers=None, chunk_size=CHUNK_SIZE):
+    '''
+    Decode captures on a pool of worker processes and write output/<device>.jsonl.
+    Returns {device: number of records}.
+    '''
+    os.makedirs(output, exist_ok=True)
+    with ProcessPoolExecutor(workers) as pool:
+        chunks = [chunk for file_chunks in pool.map(plan_file, paths, [chunk_size] * len(paths))
+                  for chunk in file_chunks]
+        files = {}
+        for path, index, serials, records in pool.map(decode_chunk, chunks):
+            serials_total, parts = files.setdefault(path, (Counter(), []))
+            serials_total.update(serials)
+            parts.append(records)
+
+    # chunks of a file come back in order, each sorted: chain them per file,
+    # then merge the files of each device by time
+    devices = {}
+    for path, (serials, parts) in files.items():
+        stream = heapq.merge(*parts, key=itemgetter(0))
+        devices.setdefault(device_name(path, serials), []).append(stream)
+    counts = {}
+    for device, streams in devices.items():
+        count = 0
+        with open(os.path.join(output, device + '.jsonl'), 'w') as f:
+            for t, line in heapq.merge(*streams, key=itemgetter(0)):
+                f.write(line)
+                f.write('\n')
+                count += 1
+        counts[device] = count
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import archived VE.Direct captures')
+    parser.add_argument('root', nargs='+', help='capture files or directories to scan')
+    parser.add_argument('-o', '--output', default='imported', help='output directory')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='bytes per chunk of a raw capture')
+    parser.add_argument('-p', '--pattern', action='append',
+                        help='file name pattern to import (default %s)' % ' '.join(PATTERNS))
+    args = parser.parse_args()
+
+    paths = [path for root in args.root for path in find_captures(root, args.pattern or PATTERNS)]
+    if not paths:
+        print('no captures found')
+        exit(1)
+    size = sum(os.path.getsize(path) for path in paths)
+    start = time.perf_counter()
+    counts = import_captures(paths, args.output, args.workers, args.chunk_size)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    for device, count in sorted(counts.items()):
+        print(f'{device}: {count} records -> {os.path.join(args.output, device + ".jsonl")}')
+    print(f'{len(paths)} files, {size / 1e6:.1f} MB in {elapsed:.2f} s ({size / elapsed / 1e6:.2f} MB/s)')
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Timestamped, compressed recordings of the raw bytes of a port (.vdc files).
+
+A CaptureRecorder takes every chunk SerialReader reads (SerialReader(ser,
+recorder=...), Vedirect(port, 1, recorder=...), vedirect_daemon.py --record)
+and keeps it with its monotonic and wall clock time. The bytes are collected
+into chunks of chunk_bytes or chunk_seconds, each compressed on its own
+(zlib, or zstd when the zstandard package is installed), and files are
+rotated by size or age:
+
+    recorder = CaptureRecorder('captures', '/dev/ttyUSB1', codec='zlib', max_seconds=3600)
+    ve = Vedirect('/dev/ttyUSB1', 1, recorder=recorder)
+    ...
+    recorder.close()
+
+    recording = CaptureFile('captures/ttyUSB1-20240601-120000.vdc')
+    for chunk in recording.chunks(start, end):       # wall clock range, from the index
+        data = recording.read_chunk(chunk)
+    capture = recording.capture(start, end)           # vedirect_replay.Capture
+    load_capture('captures/ttyUSB1-20240601-120000.vdc')  # replay, import
+
+Timing is kept as in vedirect_replay.Capture: anchors (byte offset, time)
+and bytes back to back at the baud rate in between. A read starts a new
+anchor only when its bytes came later than the baud rate alone explains by
+more than tolerance, so a second of traffic costs a few anchors.
+
+File: a header (magic, version, codec, wall and monotonic time at start,
+port), then chunks, each a header (marker, sizes, CRC-32 of the raw bytes,
+monotonic start/end, wall start) followed by the compressed anchors and
+bytes. The sidecar <file>.idx has one fixed size entry per chunk (file
+offset, stream offset, size and times) and is flushed with each chunk, so a
+reader seeks to a time range without decompressing anything else. Without
+an index (a copied .vdc) the chunk headers are scanned instead. A crash loses
+the chunk being collected, at most chunk_seconds.
+
+python3 capture_recorder.py -p /dev/ttyUSB1 -o captures --max-seconds 3600
+python3 capture_recorder.py --show captures/ttyUSB1-20240601-120000.vdc
+'''
+
+import argparse
+import bisect
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+from vedirect_replay import Capture, BAUDRATE, BITS_PER_BYTE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'VDCP'
+INDEX_MAGIC = b'VDCI'
+CHUNK_MARKER = b'CHNK'
+VERSION = 1
+CODECS = {'none': 0, 'zlib': 1, 'zstd': 2}
+CODEC_NAMES = {number: name for name, number in CODECS.items()}
+
+HEADER = struct.Struct('<4sBB2xdd32s')          # magic, version, codec, wall, monotonic, port
+CHUNK = struct.Struct('<4sIIIIddd')             # marker, compressed size, raw size, anchors, crc32,
+                                                # monotonic start, monotonic end, wall start
+ANCHOR = struct.Struct('<Id')                   # byte offset in the chunk, seconds after the chunk start
+INDEX_HEADER = struct.Struct('<4sB3x')
+INDEX_ENTRY = struct.Struct('<QQIddd')          # file offset, stream offset, raw size,
+                                                # monotonic start, monotonic end, wall start
+
+ChunkEntry = namedtuple('ChunkEntry', ['offset', 'stream_offset', 'size', 'start', 'end', 'wall'])
+
+
+def compressor(codec, level=None):
+    if codec == 'zlib':
+        level = 6 if level is None else level
+        return lambda data: zlib.compress(data, level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd recordings need the zstandard package')
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    if codec == 'none':
+        return bytes
+    raise ValueError('unknown codec %r (%s)' % (codec, ', '.join(CODECS)))
+
+
+def decompressor(codec):
+    if codec == CODECS['zlib']:
+        return zlib.decompress
+    if codec == CODECS['zstd']:
+        if zstandard is None:
+            raise ImportError('zstd recordings need the zstandard package')
+        return zstandard.ZstdDecompressor().decompress
+    if codec == CODECS['none']:
+        return bytes
+    raise ValueError('unknown codec %d' % codec)
+
+
+class CaptureRecorder:
+
+    def __init__(self, directory, port, codec='zlib', level=None, chunk_bytes=65536, chunk_seconds=10.0,
+                 max_bytes=64 << 20, max_seconds=3600.0, baudrate=BAUDRATE, tolerance=0.005):
+        '''
+        directory:     where the <port>-<date>-<time>.vdc files go
+        port:          port name, for the file names and the header
+        codec:         'zlib', 'zstd' or 'none'
+        chunk_bytes:   raw bytes per compressed chunk (at most)
+        chunk_seconds: seconds per chunk (at most), the seek granularity
+        max_bytes:     start a new file after this many bytes (compressed), None for no limit
+        max_seconds:   start a new file after this many seconds, None for no limit
+        tolerance:     seconds a read may come late before it gets its own timestamp
+        '''
+        self.directory = directory
+        self.port = port
+        self.name = os.path.basename(port) if isinstance(port, str) else 'port'
+        self.codec = codec
+        self.compress = compressor(codec, level)
+        self.chunk_bytes = chunk_bytes
+        self.chunk_seconds = chunk_seconds
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.tolerance = tolerance
+        self.file = None
+        self.index = None
+        self.path = None
+        self.paths = []
+        self.file_start = 0.0
+        self.stream_offset = 0
+        self.data = bytearray()
+        self.anchors = bytearray()
+        self.anchor_count = 0
+        self.anchor_offset = 0
+        self.anchor_time = 0.0
+        self.chunk_start = 0.0
+        self.chunk_end = 0.0
+        self.chunk_wall = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chunks = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, mono, wall):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(wall))
+        path = os.path.join(self.directory, '%s-%s.vdc' % (self.name, stamp))
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, '%s-%s-%d.vdc' % (self.name, stamp, n))
+            n += 1
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, CODECS[self.codec], wall, mono,
+                                    self.name.encode('utf-8')[:32]))
+        self.index = open(path + '.idx', 'wb')
+        self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION))
+        self.path = path
+        self.paths.append(path)
+        self.file_start = mono
+        self.stream_offset = 0
+
+    def write(self, data, mono=None, wall=None):
+        '''Record data (bytes or a memoryview), read from the port at monotonic time mono.'''
+        n = len(data)
+        if not n:
+            return
+        if mono is None:
+            mono = time.monotonic()
+        # time the first byte arrived, the read returns after the last
+        first = mono - n * self.byte_time
+        if not self.data:
+            if self.file is None:
+                self.open(mono, time.time() if wall is None else wall)
+            self.chunk_start = first
+            self.chunk_wall = (time.time() if wall is None else wall) - n * self.byte_time
+            self.anchor_count = 0
+            del self.anchors[:]
+        at = max(first - self.chunk_start, 0.0)
+        expected = self.anchor_time + (len(self.data) - self.anchor_offset) * self.byte_time
+        if not self.anchor_count or at - expected > self.tolerance:
+            self.anchor_offset = len(self.data)
+            self.anchor_time = at
+            self.anchors += ANCHOR.pack(self.anchor_offset, self.anchor_time)
+            self.anchor_count += 1
+        self.data += data
+        self.chunk_end = mono
+        self.bytes_in += n
+        if len(self.data) >= self.chunk_bytes or mono - self.chunk_start >= self.chunk_seconds:
+            self.flush()
+
+    def flush(self):
+        '''Write the chunk being collected, and rotate the file when it is due.'''
+        if not self.data:
+            return
+        raw = bytes(self.data)
+        payload = self.compress(bytes(self.anchors) + raw)
+        offset = self.file.tell()
+        self.file.write(CHUNK.pack(CHUNK_MARKER, len(payload), len(raw), self.anchor_count, zlib.crc32(raw),
+                                   self.chunk_start, self.chunk_end, self.chunk_wall))
+        self.file.write(payload)
+        self.file.flush()
+        self.index.write(INDEX_ENTRY.pack(offset, self.stream_offset, len(raw), self.chunk_start,
+                                          self.chunk_end, self.chunk_wall))
+        self.index.flush()
+        self.stream_offset += len(raw)
+        self.bytes_out += CHUNK.size + len(payload)
+        self.chunks += 1
+        del self.data[:]
+        if ((self.max_bytes and self.file.tell() >= self.max_bytes) or
+                (self.max_seconds and self.chunk_end - self.file_start >= self.max_seconds)):
+            self.close_file()
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.index.close()
+            self.file = self.index = None
+
+    def close(self):
+        self.flush()
+        self.close_file()
+
+    def stats(self):
+        return {
+            'files': len(self.paths),
+            'chunks': self.chunks,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_in / self.bytes_out if self.bytes_out else 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureFile:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('%s: not a capture recording' % path)
+        magic, version, self.codec, self.wall, self.monotonic, port = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a version %d capture recording' % (path, VERSION))
+        self.port = port.rstrip(b'\0').decode('utf-8', 'replace')
+        self.decompress = decompressor(self.codec)
+        self.entries = self.load_index()
+        if self.entries is None:
+            self.entries = self.scan()
+        self.walls = [entry.wall for entry in self.entries]
+
+    def load_index(self):
+        '''Entries from the sidecar index, None if it is missing or does not match the file.'''
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if data[:INDEX_HEADER.size] != INDEX_HEADER.pack(INDEX_MAGIC, VERSION):
+            return None
+        body = memoryview(data)[INDEX_HEADER.size:]
+        body = body[:len(body) - len(body) % INDEX_ENTRY.size]
+        entries = [ChunkEntry._make(entry) for entry in INDEX_ENTRY.iter_unpack(body)]
+        size = os.path.getsize(self.path)
+        if entries and entries[-1].offset + CHUNK.size > size:
+            return None
+        return entries
+
+    def scan(self):
+        '''Entries from the chunk headers, for a file without its index (the last chunk may be cut short).'''
+        entries = []
+        stream_offset = 0
+        with open(self.path, 'rb') as f:
+            offset = HEADER.size
+            size = os.path.getsize(self.path)
+            while offset + CHUNK.size <= size:
+                f.seek(offset)
+                marker, compressed, raw, _, _, start, end, wall = CHUNK.unpack(f.read(CHUNK.size))
+                if marker != CHUNK_MARKER or offset + CHUNK.size + compressed > size:
+                    break
+                entries.append(ChunkEntry(offset, stream_offset, raw, start, end, wall))
+                stream_offset += raw
+                offset += CHUNK.size + compressed
+        return entries
+
+    def __len__(self):
+        return sum(entry.size for entry in self.entries)
+
+    def chunks(self, start=None, end=None):
+        '''Index entries of the chunks overlapping wall clock times start .. end.'''
+        first = 0
+        if start is not None:
+            first = max(bisect.bisect_right(self.walls, start) - 1, 0)
+            while first < len(self.entries) and self.end_wall(self.entries[first]) < start:
+                first += 1
+        last = len(self.entries) if end is None else bisect.bisect_right(self.walls, end)
+        return self.entries[first:last]
+
+    @staticmethod
+    def end_wall(entry):
+        return entry.wall + entry.end - entry.start
+
+    def read_chunk(self, entry, anchors=False):
+        '''Raw bytes of one chunk, with [(offset, seconds after entry.start), ...] if anchors.'''
+        with open(self.path, 'rb') as f:
+            f.seek(entry.offset)
+            marker, compressed, raw, count, crc, _, _, _ = CHUNK.unpack(f.read(CHUNK.size))
+            payload = self.decompress(f.read(compressed))
+        if marker != CHUNK_MARKER or len(payload) != count * ANCHOR.size + raw:
+            raise ValueError('%s: bad chunk at %d' % (self.path, entry.offset))
+        data = payload[count * ANCHOR.size:]
+        if zlib.crc32(data) != crc:
+            raise ValueError('%s: CRC error in the chunk at %d' % (self.path, entry.offset))
+        if anchors:
+            return data, list(ANCHOR.iter_unpack(payload[:count * ANCHOR.size]))
+        return data
+
+    def capture(self, start=None, end=None, baudrate=BAUDRATE):
+        '''
+        The chunks overlapping start .. end (wall clock, whole chunks) as a
+        vedirect_replay.Capture, times in seconds after its first byte.
+        '''
+        entries = self.chunks(start, end)
+        data = bytearray()
+        starts, times = [], []
+        origin = entries[0].start if entries else 0.0
+        for entry in entries:
+            raw, anchors = self.read_chunk(entry, anchors=True)
+            for offset, t in anchors:
+                starts.append(len(data) + offset)
+                times.append(entry.start - origin + t)
+            data += raw
+        return Capture(data, starts or None, times or None, os.path.basename(self.path), baudrate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record a VE.Direct port to compressed, timestamped files')
+    parser.add_argument('-p', '--port', help='serial port to record (e.g., /dev/ttyUSB1)')
+    parser.add_argument('-o', '--output', default='captures', help='directory for the .vdc files')
+    parser.add_argument('-c', '--codec', default='zlib', choices=sorted(CODECS))
+    parser.add_argument('--chunk-seconds', type=float, default=10.0)
+    parser.add_argument('--max-bytes', type=int, default=64 << 20, help='rotate after this many bytes')
+    parser.add_argument('--max-seconds', type=float, default=3600.0, help='rotate after this many seconds')
+    parser.add_argument('--show', metavar='FILE', help='print the chunks of a recording')
+    args = parser.parse_args()
+
+    if args.show:
+        recording = CaptureFile(args.show)
+        print(f'{recording.port}, {CODEC_NAMES[recording.codec]}, started '
+              f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(recording.wall))}, {len(recording)} bytes')
+        for entry in recording.entries:
+            print(f'{time.strftime("%H:%M:%S", time.localtime(entry.wall))} {entry.end - entry.start:7.2f} s '
+                  f'{entry.size:>8} bytes at {entry.offset}')
+    elif args.port:
+        import serial
+        from serial_reader import SerialReader
+        ser = serial.Serial(args.port, BAUDRATE, timeout=1)
+        recorder = CaptureRecorder(args.output, args.port, args.codec, chunk_seconds=args.chunk_seconds,
+                                   max_bytes=args.max_bytes, max_seconds=args.max_seconds)
+        reader = SerialReader(ser, recorder=recorder)
+        try:
+            while True:
+                reader.read()
+        except KeyboardInterrupt:
+            print("\nExiting on user request.")
+        recorder.close()
+        print(recorder.stats())
+    else:
+        parser.print_help()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+'''
+Poll a fleet of VE.Direct devices from one host.
+
+Every port gets its own Vedirect parser and a bounded output queue (oldest
+frame dropped when full). The ports share a fixed size thread pool: each
+job reads one chunk from one port (waiting at most the port timeout) and is
+then resubmitted, so a silent or stalled port only ever holds a worker for
+one timeout slice and can't starve the others.
+
+python3 fleet_poller.py -p '/dev/serial/by-id/usb-FTDI*' /dev/ttyUSB1 -w 4
+
+    poller = FleetPoller(['/dev/serial/by-id/usb-FTDI*'], workers=4)
+    poller.start()
+    frame = poller.get('/dev/serial/by-id/usb-FTDI_..._A50285BI-if00-port0')
+    print(poller.stats())
+'''
+
+import argparse
+import glob
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from vedirect import Vedirect
+
+
+def expand_ports(patterns):
+    '''Expand globs (ie /dev/serial/by-id/*), names without glob characters are kept as is.'''
+    ports = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            ports.extend(sorted(glob.glob(pattern)))
+        else:
+            ports.append(pattern)
+    return list(dict.fromkeys(ports))
+
+
+class PortState:
+
+    def __init__(self, port, queue_size):
+        self.port = port
+        self.ve = None
+        self.queue = deque(maxlen=queue_size)
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.retry_at = 0.0
+        self.parse_time = 0.0       # seconds spent parsing, for the mean latency
+        self.parse_max = 0.0
+        self.last_frame = None      # monotonic time of the last frame
+        self.rate = 0.0             # frames/s, exponentially smoothed
+
+    def push(self, frame, now):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(frame)
+        if self.last_frame is not None:
+            interval = max(now - self.last_frame, 1e-6)
+            self.rate += 0.2 * (1.0 / interval - self.rate)
+        self.last_frame = now
+        self.frames += 1
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'frame_rate': self.rate,
+            'parse_latency_mean': self.parse_time / self.frames if self.frames else 0.0,
+            'parse_latency_max': self.parse_max,
+            'queue_depth': len(self.queue),
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'connected': self.ve is not None,
+        }
+
+
+class FleetPoller:
+
+    def __init__(self, ports, workers=4, queue_size=100, timeout=0.1, retry_interval=5.0, open_port=None):
+        '''
+        ports:          port names and/or globs (ie '/dev/serial/by-id/*')
+        workers:        size of the shared thread pool
+        queue_size:     frames kept per port before the oldest are dropped
+        timeout:        serial read timeout, the longest one job blocks a worker
+        retry_interval: seconds before reopening a port that failed
+        open_port:      function(port) -> Vedirect, defaults to Vedirect(port, timeout)
+        '''
+        self.ports = {port: PortState(port, queue_size) for port in expand_ports(ports)}
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.open_port = open_port or (lambda port: Vedirect(port, timeout))
+        self.pool = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fleet')
+        for state in self.ports.values():
+            self.submit(state)
+
+    def stop(self):
+        self.running = False
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        for state in self.ports.values():
+            if state.ve is not None:
+                state.ve.ser.close()
+                state.ve = None
+
+    def submit(self, state):
+        if self.running:
+            try:
+                self.pool.submit(self.poll, state)
+            except RuntimeError:
+                # pool shut down by stop()
+                pass
+
+    def poll(self, state):
+        try:
+            if state.ve is None:
+                # read the clock once, a second read can be past retry_at (negative sleep)
+                remaining = state.retry_at - time.monotonic()
+                if remaining > 0:
+                    time.sleep(max(0.0, min(self.timeout, remaining)))
+                    return
+                state.ve = self.open_port(state.port)
+            data = state.ve.reader.read()
+            start = time.perf_counter()
+            # VedirectFrames are immutable, queued as they are
+            packets = list(state.ve.frames(data))
+            elapsed = time.perf_counter() - start
+            now = time.monotonic()
+            for packet in packets:
+                state.push(packet, now)
+            if packets:
+                state.parse_time += elapsed
+                state.parse_max = max(state.parse_max, elapsed / len(packets))
+        except Exception as e:
+            state.errors += 1
+            state.last_error = str(e)
+            state.retry_at = time.monotonic() + self.retry_interval
+            if state.ve is not None:
+                try:
+                    state.ve.ser.close()
+                except Exception:
+                    pass
+                state.ve = None
+        finally:
+            self.submit(state)
+
+    def get(self, port):
+        '''Oldest queued frame of port, or None.'''
+        queue = self.ports[port].queue
+        try:
+            return queue.popleft()
+        except IndexError:
+            return None
+
+    def drain(self):
+        '''Pop every queued frame, returns [(port, frame), ...].'''
+        frames = []
+        for port, state in self.ports.items():
+            while True:
+                frame = self.get(port)
+                if frame is None:
+                    break
+                frames.append((port, frame))
+        return frames
+
+    def stats(self):
+        return {port: state.stats() for port, state in self.ports.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll many VE.Direct ports')
+    parser.add_argument('-p', '--ports', nargs='+', default=['/dev/serial/by-id/*'],
+                        help='ports or globs (e.g. /dev/serial/by-id/usb-FTDI*)')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='worker threads')
+    parser.add_argument('-q', '--queue', type=int, default=100, help='frames kept per port')
+    parser.add_argument('-i', '--interval', type=float, default=5.0, help='seconds between stats')
+    args = parser.parse_args()
+
+    poller = FleetPoller(args.ports, workers=args.workers, queue_size=args.queue)
+    print('ports:', list(poller.ports))
+    poller.start()
+    try:
+        while True:
+            time.sleep(args.interval)
+            # latest frame of each port
+            for port, frame in dict(poller.drain()).items():
+                print(port, frame.get('V'), frame.get('I'), frame.get('PPV'))
+            for port, stats in poller.stats().items():
+                print(f"{port}: {stats['frame_rate']:.2f} frames/s, "
+                      f"parse {1e6 * stats['parse_latency_mean']:.0f} us, "
+                      f"queue {stats['queue_depth']}, dropped {stats['dropped']}, errors {stats['errors']}")
+    except KeyboardInterrupt:
+        print("\nExiting on user request.")
+    finally:
+        poller.stop()
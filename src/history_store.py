@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+'''
+Append-only binary store for VE.Direct history day records.
+
+One fixed width record per (device serial, date):
+
+    serial        16s   device serial number (SER#), NUL padded
+    day_sequence  H     from the record itself (bytes 32..33)
+    fetched       I     unix time the record was read from the device
+    date          I     date of the day (date.toordinal()), the fetch date
+                        minus the days back it was fetched as
+    record        34s   the raw history day payload, as parse_history_record decodes it
+
+The day sequence (HSDS) wraps at 365, so days are keyed by their date and a
+sequence lookup finds the newest day with that sequence. Records are only
+ever appended. A day fetched again (ie today, before it closes) is appended
+again and the index points at the newest copy, compact() rewrites the file
+without the superseded copies. Reads go through mmap, and
+to_numpy() gives a zero copy structured array (column access) when NumPy is
+installed, with the record fields as a nested structured column
+(table['record']['yield_total']).
+
+    store = HistoryStore('history.vdh')
+    store.append('HQ2423N36NE', payload)  # fetched today as day 0
+    store.get('HQ2423N36NE', 85)          # parse_history_record dict
+    store.day('HQ2423N36NE', 85)          # HistoryDay
+    store.export_csv('solar_history.csv', 'HQ2423N36NE')
+'''
+
+import mmap
+import os
+import struct
+import time
+from datetime import date as Date, datetime
+
+from vedirect_hex import decode_history_record, history_dtype, HISTORY_RECORD_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'VEHIST\x00\x01'
+HEADER = struct.Struct('<8sHH4x')   # magic, version, record size
+RECORD = struct.Struct('<16sHII%ds' % HISTORY_RECORD_SIZE)
+KEY = struct.Struct('<16sHII')      # leading part of RECORD, for building the index
+VERSION = 2
+
+CSV_HEADER = ("Day,Estimated Date,Total Yield (kWh),Max Power Today (W),Max PV Voltage Today (V),"
+              "Max Battery Voltage Today (V),Min Battery Voltage Today (V),Day Sequence,"
+              "Time in Bulk (min),Time in Absorption (min),Time in Float (min),"
+              "Max Battery Current (A),Error Code 1,Error Code 2,Error Code 3,Error Code 4,"
+              "Consumed (kWh)\n")
+
+
+def format_row(day, estimated_date, parsed_data):
+    return (f"{day},{estimated_date},"
+            f"{parsed_data['Total Yield (kWh)']},"
+            f"{parsed_data['Max Power (W)']},"
+            f"{parsed_data['Max PV Voltage (V)']},"
+            f"{parsed_data['Max Battery Voltage (V)']},"
+            f"{parsed_data['Min Battery Voltage (V)']},"
+            f"{parsed_data['Day Sequence']},"
+            f"{parsed_data['Time in Bulk (min)']},"
+            f"{parsed_data['Time in Absorption (min)']},"
+            f"{parsed_data['Time in Float (min)']},"
+            f"{parsed_data['Max Battery Current (A)']},"
+            f"{parsed_data['Error 0 (Most Recent)']},"
+            f"{parsed_data['Error 1']},"
+            f"{parsed_data['Error 2']},"
+            f"{parsed_data['Error 3 (Oldest)']},"
+            f"{parsed_data['Consumed (kWh)']}\n"
+            )
+
+
+def numpy_dtype():
+    return np.dtype([('serial', 'S16'), ('day_sequence', '<u2'), ('fetched', '<u4'), ('date', '<u4'),
+                     ('record', history_dtype())])
+
+
+def day_date(fetched, day):
+    '''date.toordinal() of the day fetched as day (0 = today) at unix time fetched.'''
+    return datetime.fromtimestamp(fetched).date().toordinal() - day
+
+
+class HistoryStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        path = self.path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        with open(path, 'rb') as f:
+            magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or size != RECORD.size:
+            raise ValueError(f'{path} is not a history store (or a different record layout)')
+        # cut off a record torn by a crash mid append, or every later append is misaligned
+        whole = HEADER.size + (os.path.getsize(path) - HEADER.size) // RECORD.size * RECORD.size
+        if os.path.getsize(path) != whole:
+            os.truncate(path, whole)
+        self.file = open(path, 'ab')
+        self.map = None
+        self.mapped_size = 0
+        # (serial, date) -> record number
+        self.index = {}
+        # (serial, day sequence) -> newest date with that sequence
+        self.latest = {}
+        self.count = 0
+        self.remap()
+        self.build_index(0)
+
+    def close(self):
+        self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def remap(self):
+        self.file.flush()
+        size = os.path.getsize(self.path)
+        if size == self.mapped_size:
+            return
+        # the old map is not closed here, views handed out by raw() or
+        # to_numpy() keep it alive until they are released
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mapped_size = size
+
+    def build_index(self, start):
+        '''Index records start.. of the mapped file (a torn last record is ignored).'''
+        count = (self.mapped_size - HEADER.size) // RECORD.size
+        for n in range(start, count):
+            serial, sequence, _, day = KEY.unpack_from(self.map, HEADER.size + n * RECORD.size)
+            serial = serial.rstrip(b'\x00').decode()
+            self.index[(serial, day)] = n
+            if day >= self.latest.get((serial, sequence), 0):
+                self.latest[(serial, sequence)] = day
+        self.count = count
+
+    @staticmethod
+    def encode_serial(serial):
+        return serial.encode() if isinstance(serial, str) else bytes(serial)
+
+    def append(self, serial, payload, fetched=None, day=0):
+        '''Append one raw 34 byte history record of device serial, fetched as day (0 = today).'''
+        self.append_many(serial, [payload], fetched, [day])
+
+    def append_many(self, serial, payloads, fetched=None, days=None):
+        '''
+        days: the day (0 = today) each payload was fetched as, by default
+        0, 1, 2 ... in the order HexClient.get_history_records returns them
+        '''
+        fetched = int(time.time() if fetched is None else fetched)
+        if days is None:
+            days = range(len(payloads))
+        key = self.encode_serial(serial)
+        data = bytearray()
+        for payload, day in zip(payloads, days):
+            payload = bytes(payload[:HISTORY_RECORD_SIZE])
+            if len(payload) != HISTORY_RECORD_SIZE:
+                raise ValueError('history record must be %d bytes' % HISTORY_RECORD_SIZE)
+            sequence = int.from_bytes(payload[32:34], 'little')
+            data += RECORD.pack(key, sequence, fetched, day_date(fetched, day), payload)
+        self.file.write(data)
+        start = self.count
+        self.remap()
+        self.build_index(start)
+
+    def find(self, serial, sequence, date=None):
+        '''Record number of the day with sequence (the newest one unless date is given).'''
+        if date is None:
+            date = self.latest.get((serial, sequence))
+        return self.index.get((serial, date))
+
+    def raw(self, serial, sequence, date=None):
+        '''The 34 byte record read from the mmap, None if it is not stored.'''
+        n = self.find(serial, sequence, date)
+        if n is None:
+            return None
+        offset = HEADER.size + n * RECORD.size + KEY.size
+        return self.map[offset:offset + HISTORY_RECORD_SIZE]
+
+    def day(self, serial, sequence, date=None):
+        '''HistoryDay unpacked straight from the mmap, None if it is not stored.'''
+        n = self.find(serial, sequence, date)
+        if n is None:
+            return None
+        return decode_history_record(self.map, HEADER.size + n * RECORD.size + KEY.size)
+
+    def get(self, serial, sequence, date=None):
+        record = self.day(serial, sequence, date)
+        return None if record is None else record.to_dict()
+
+    def devices(self):
+        return sorted({serial for serial, date in self.index})
+
+    def dates(self, serial):
+        return sorted(date for s, date in self.index if s == serial)
+
+    def sequence(self, serial, date):
+        n = self.index.get((serial, date))
+        return None if n is None else KEY.unpack_from(self.map, HEADER.size + n * RECORD.size)[1]
+
+    def last_sequence(self, serial):
+        '''Day sequence of the newest stored day.'''
+        dates = self.dates(serial)
+        return self.sequence(serial, dates[-1]) if dates else None
+
+    def to_numpy(self):
+        '''All records (including superseded copies) as a structured array on the mmap.'''
+        if np is None:
+            raise ImportError('to_numpy needs numpy')
+        return np.frombuffer(self.map, dtype=numpy_dtype(), count=self.count, offset=HEADER.size)
+
+    def export_csv(self, csv_file, serial, today=None):
+        '''
+        Write the days of serial in the solar_history.csv layout, newest first.
+        Day is counted back from today (a date, default: the newest stored day).
+        '''
+        dates = self.dates(serial)
+        if today is None:
+            today = dates[-1] if dates else 0
+        elif isinstance(today, Date):
+            today = today.toordinal()
+        with open(csv_file, 'w') as f:
+            f.write(CSV_HEADER)
+            for date in reversed(dates):
+                record = self.get(serial, None, date)
+                f.write(format_row(today - date, Date.fromordinal(date).strftime('%Y-%m-%d'), record))
+
+    def compact(self):
+        '''Rewrite the file keeping only the newest copy of each (serial, date).'''
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            for n in sorted(self.index.values()):
+                offset = HEADER.size + n * RECORD.size
+                f.write(self.map[offset:offset + RECORD.size])
+        self.close()
+        os.replace(tmp, self.path)
+        self.open()
+
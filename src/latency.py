@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Fixed bucket latency histograms.
+
+    histogram = LatencyHistogram()
+    histogram.observe(0.012)            # seconds
+    histogram.percentile(99)            # upper bound of the bucket holding p99
+    histogram.stats()                   # count, mean, max, p50/p90/p99, buckets
+
+Buckets are upper bounds in seconds (1 ms .. 10 s, then +Inf), so observing
+is one bisect and memory is the same however many samples are taken.
+'''
+
+import bisect
+import math
+
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class LatencyHistogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        '''Upper bound of the bucket the p-th percentile falls in (the max for the +Inf bucket).'''
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.buckets[n], self.max) if n < len(self.buckets) else self.max
+        return self.max
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(['%g' % bound for bound in self.buckets] + ['+Inf'], self.counts)),
+        }
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Counters, gauges and histograms for the serial and protocol layers, served
+as OpenMetrics text over HTTP and readable in process.
+
+Most numbers are counted already (SerialReader, VedirectParser,
+VedirectDemux, HexClient), those are read by collectors when
+the metrics are scraped and cost nothing in between. Only what is not
+counted otherwise is observed on the hot path, and only once instrumented
+(one None check per read when not):
+
+    vedirect_read_backlog_bytes     histogram of bytes taken per read (what was waiting)
+    vedirect_parse_seconds          histogram of the parse time per read
+    vedirect_hex_roundtrip_seconds  histogram of request to reply per command and register
+
+    ve = Vedirect('/dev/ttyUSB1', 1)
+    instrument_vedirect(ve, 'ttyUSB1')
+    client = HexClient(ve.ser, demux=ve.demux)
+    instrument_hex(client, 'ttyUSB1')
+    server = REGISTRY.serve(9105)               # http://127.0.0.1:9105/metrics
+
+    REGISTRY.value('vedirect_frames', port='ttyUSB1', result='bad_checksum')
+    REGISTRY.collect()                          # {name: {'type', 'help', 'samples'}}
+    print(REGISTRY.exposition())
+
+Histograms are latency.LatencyHistogram with their own buckets.
+
+python3 metrics.py -p /dev/ttyUSB1 --listen 9105
+'''
+
+import argparse
+import http.server
+import threading
+
+from latency import LatencyHistogram
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+DEFAULT_PORT = 9105
+
+# parse time of one read: a few us for a HEX line, tens for a TEXT block
+PARSE_BUCKETS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 1e-2)
+# bytes waiting per read, the lua script warns above 256
+BACKLOG_BUCKETS = (1, 8, 32, 64, 128, 256, 512, 1024, 4096)
+# HEX round trip
+ROUNDTRIP_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+def format_number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+
+    def __init__(self):
+        # name -> (type, help, {label key: Counter/Gauge/LatencyHistogram})
+        self.families = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def metric(self, kind, name, help, labels, factory):
+        key = label_key(labels)
+        family = self.families.get(name)
+        if family is None:
+            with self.lock:
+                family = self.families.setdefault(name, (kind, help, {}))
+        if family[0] != kind:
+            raise ValueError('%s is a %s, not a %s' % (name, family[0], kind))
+        metric = family[2].get(key)
+        if metric is None:
+            with self.lock:
+                metric = family[2].setdefault(key, factory())
+        return metric
+
+    def counter(self, name, help='', **labels):
+        '''The Counter name{labels}, made on first use (name without _total).'''
+        return self.metric('counter', name, help, labels, Counter)
+
+    def gauge(self, name, help='', **labels):
+        return self.metric('gauge', name, help, labels, Gauge)
+
+    def histogram(self, name, help='', buckets=ROUNDTRIP_BUCKETS, **labels):
+        '''The LatencyHistogram name{labels}, made on first use with buckets.'''
+        return self.metric('histogram', name, help, labels, lambda: LatencyHistogram(buckets))
+
+    def add_collector(self, collect):
+        '''
+        collect() is called on every scrape and returns [(name, type, help,
+        {label: value}, value), ...], value a number or a LatencyHistogram.
+        '''
+        with self.lock:
+            self.collectors.append(collect)
+
+    def remove_collector(self, collect):
+        with self.lock:
+            self.collectors.remove(collect)
+
+    def snapshot(self):
+        '''{name: (type, help, [(label key, value), ...])} of everything, collectors included.'''
+        with self.lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in self.families.items()]
+            collectors = list(self.collectors)
+        merged = {}
+        for name, kind, help, metrics in families:
+            merged[name] = (kind, help, [(key, getattr(metric, 'value', metric)) for key, metric in metrics])
+        for collect in collectors:
+            for name, kind, help, labels, value in collect():
+                merged.setdefault(name, (kind, help, []))[2].append((label_key(labels), value))
+        return merged
+
+    def collect(self):
+        '''In process view: {name: {'type', 'help', 'samples': [{'labels', 'value'}]}}, histograms as stats().'''
+        return {
+            name: {
+                'type': kind,
+                'help': help,
+                'samples': [{'labels': dict(key),
+                             'value': value.stats() if isinstance(value, LatencyHistogram) else value}
+                            for key, value in samples],
+            }
+            for name, (kind, help, samples) in self.snapshot().items()
+        }
+
+    def value(self, name, **labels):
+        '''Value of one sample (a LatencyHistogram for histograms), None if there is none.'''
+        family = self.snapshot().get(name)
+        if family is None:
+            return None
+        key = label_key(labels)
+        for sample_key, value in family[2]:
+            if sample_key == key:
+                return value
+        return None
+
+    def exposition(self):
+        '''Everything in the OpenMetrics text format.'''
+        lines = []
+        for name, (kind, help, samples) in sorted(self.snapshot().items()):
+            lines.append('# TYPE %s %s' % (name, kind))
+            if help:
+                lines.append('# HELP %s %s' % (name, escape(help)))
+            for key, value in samples:
+                if kind == 'counter':
+                    lines.append('%s_total%s %s' % (name, format_labels(key), format_number(value)))
+                elif kind == 'histogram':
+                    counts = list(value.counts)
+                    cumulative = 0
+                    for bound, count in zip(list(value.buckets) + [float('inf')], counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, format_labels(key, ('le', format_number(
+                            float(bound)))), cumulative))
+                    lines.append('%s_count%s %d' % (name, format_labels(key), cumulative))
+                    lines.append('%s_sum%s %s' % (name, format_labels(key), repr(float(value.total))))
+                else:
+                    lines.append('%s%s %s' % (name, format_labels(key), format_number(value)))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=DEFAULT_PORT, host='127.0.0.1'):
+        '''Serve /metrics on host:port from a thread, returns the MetricsServer (.stop() it).'''
+        server = MetricsServer((host, port), MetricsHandler)
+        server.registry = self
+        server.thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+        server.thread.start()
+        return server
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+REGISTRY = Registry()
+
+
+def backlog_histogram(registry, port):
+    return registry.histogram('vedirect_read_backlog_bytes', 'Bytes waiting per read', BACKLOG_BUCKETS, port=port)
+
+
+def reader_samples(reader, labels):
+    return [
+        ('vedirect_read_bytes', 'counter', 'Bytes read from the port', labels, reader.bytes),
+        ('vedirect_reads', 'counter', 'Reads from the port', labels, reader.reads),
+    ]
+
+
+def instrument_reader(reader, port=None, registry=REGISTRY):
+    '''Bytes, reads and the backlog per read of a SerialReader.'''
+    reader.backlog = backlog_histogram(registry, port)
+
+    def collect():
+        return reader_samples(reader, {'port': port})
+    registry.add_collector(collect)
+    return collect
+
+
+def instrument_vedirect(ve, port=None, registry=REGISTRY):
+    '''Reads, frames, parse time and queues of a Vedirect (or anything with .reader and .demux).'''
+    if port is None:
+        port = getattr(ve.ser, 'port', None)
+    instrument_reader(ve.reader, port, registry)
+    demux = ve.demux
+    demux.parse_time = registry.histogram('vedirect_parse_seconds', 'Parse time per read', PARSE_BUCKETS,
+                                          port=port)
+
+    def collect():
+        parser = demux.parser
+        labels = {'port': port}
+        samples = [
+            ('vedirect_frames', 'counter', 'TEXT frames by checksum result', dict(labels, result='ok'),
+             parser.frames_ok),
+            ('vedirect_frames', 'counter', 'TEXT frames by checksum result', dict(labels, result='bad_checksum'),
+             parser.frames_bad),
+            ('vedirect_parser_buffered_bytes', 'gauge', 'Bytes of an incomplete frame or line held',
+             labels, len(parser.buffer)),
+        ]
+        for route in demux.counts:
+            route_labels = dict(labels, route=route)
+            samples += [
+                ('vedirect_events', 'counter', 'Events routed', route_labels, demux.counts[route]),
+                ('vedirect_events_dropped', 'counter', 'Events dropped from a full queue', route_labels,
+                 demux.dropped[route]),
+                ('vedirect_events_queued', 'gauge', 'Events waiting in a queue', route_labels,
+                 len(demux.queues[route])),
+            ]
+        for attribute, help in (('resyncs', 'Resynchronisations after corrupt data'),
+                                ('bytes_skipped', 'Bytes skipped while resynchronising'),
+                                ('frames_recovered', 'Frames recovered from a bad checksum'),
+                                ('hex_bad', 'HEX lines with a bad checksum')):
+            if hasattr(parser, attribute):
+                samples.append(('vedirect_parser_' + attribute, 'counter', help, labels,
+                                getattr(parser, attribute)))
+        return samples
+    registry.add_collector(collect)
+    return collect
+
+
+def roundtrip_observer(registry, port):
+    '''observe(command, register, seconds) into vedirect_hex_roundtrip_seconds, for HexClient.observe_roundtrip.'''
+    histograms = {}
+
+    def observe(command, register, seconds):
+        key = (command, register)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = registry.histogram(
+                'vedirect_hex_roundtrip_seconds', 'HEX request to reply', ROUNDTRIP_BUCKETS, port=port,
+                command=command, register=None if register is None else '0x%04X' % register)
+        histogram.observe(seconds)
+    return observe
+
+
+def hex_samples(client, labels):
+    return [
+        ('vedirect_hex_retries', 'counter', 'HEX requests sent again', labels, client.retried),
+        ('vedirect_hex_timeouts', 'counter', 'HEX requests without a reply', labels, client.timeouts),
+        ('vedirect_hex_errors', 'counter', 'HEX lines that failed to decode or match', labels, client.error_count),
+    ]
+
+
+def instrument_hex(client, port=None, registry=REGISTRY):
+    '''HEX round trip per command and register, retries, timeouts and errors of a HexClient.'''
+    if port is None:
+        port = getattr(client.ser, 'port', None)
+    client.observe_roundtrip = roundtrip_observer(registry, port)
+
+    def collect():
+        return hex_samples(client, {'port': port})
+    registry.add_collector(collect)
+    return collect
+
+
+def instrument_history(history, port=None, registry=REGISTRY):
+    '''
+    SolarHistory: the reader and HexClient it makes on connect() and
+    get_history().
+    '''
+    if port is None:
+        port = history.port
+    history.registry = registry
+
+    def collect():
+        labels = {'port': port}
+        samples = []
+        if history.reader is not None:
+            samples += reader_samples(history.reader, labels)
+        if history.client is not None:
+            samples += hex_samples(history.client, labels)
+        return samples
+    registry.add_collector(collect)
+    return collect
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the metrics of a VE.Direct port over HTTP')
+    parser.add_argument('-p', '--port', default='/dev/ttyUSB1', help='Serial port (e.g., /dev/ttyUSB1)')
+    parser.add_argument('--listen', type=int, default=DEFAULT_PORT, help='HTTP port on 127.0.0.1')
+    args = parser.parse_args()
+
+    from vedirect import Vedirect
+    ve = Vedirect(args.port, 1)
+    instrument_vedirect(ve, args.port)
+    server = REGISTRY.serve(args.listen)
+    print(f'metrics of {args.port} on http://127.0.0.1:{server.port}/metrics')
+    try:
+        while True:
+            for _ in ve.frames(ve.reader.read()):
+                pass
+    except KeyboardInterrupt:
+        print("\nExiting on user request.")
+    server.stop()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+HEX poll scheduler that sends requests in the gaps between TEXT blocks.
+
+The controller sends a TEXT block about once a second. serial_vedirect.lua
+and vedirect.py's __main__ write one history GET every second frame, right
+when the frame is parsed; a request that reaches the device while it is
+still sending a TEXT block can be delayed or lost, and the rest of the
+second the line is idle.
+
+PollScheduler learns the block timing from the frames it sees (period,
+block length at the baud rate) and sends the queued requests in the idle
+gap after each block:
+
+    ve = Vedirect('/dev/ttyUSB1', 0.05)
+    scheduler = PollScheduler(ve, budget=0.5)
+    scheduler.add(0xEDAB, interval=10, priority=1, callback=on_value)
+    scheduler.add_history(31, interval=600)
+    while True:
+        for frame in scheduler.poll():      # TEXT frames, as ve.next_frame()
+            ...
+    print(scheduler.stats())
+
+Requests that are due (never polled, or polled more than their interval
+ago) go out by priority, then by staleness (time since the last reply over
+the interval). A burst only goes out if the replies are expected to be in
+before the next block starts, and only while the line from the device stays
+under budget (TEXT blocks plus replies, as a fraction of the baud rate).
+'''
+
+import argparse
+import time
+from collections import deque
+
+from latency import LatencyHistogram
+from vedirect_hex import HexClient, encode_get, GET_RESPONSE, HISTORY_REGISTER, HISTORY_DAYS
+
+BAUDRATE = 19200
+BITS_PER_BYTE = 10          # 8N1
+# GET reply ':7<reg><flags><value><checksum>\n' with a 2 byte value, until one is seen
+DEFAULT_REPLY_SIZE = 15
+HISTORY_REPLY_SIZE = 83
+
+
+def frame_size(frame):
+    '''Bytes of a TEXT frame on the line, from its fields.'''
+    return sum(len(key) + len(str(value)) + 3 for key, value in frame.items()) + 12
+
+
+class BlockTiming:
+    '''Learns when TEXT blocks are sent from the times they complete.'''
+
+    def __init__(self, baudrate=BAUDRATE, interval=1.0, history=8):
+        '''
+        interval: block period assumed until one is measured
+        history:  block intervals the period is the median of
+        '''
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.default_interval = interval
+        self.intervals = deque(maxlen=history)
+        self.last_end = None
+        self.block_bytes = 0
+        self.blocks = 0
+        self.start = time.monotonic()
+
+    @property
+    def period(self):
+        if not self.intervals:
+            return self.default_interval
+        ordered = sorted(self.intervals)
+        return ordered[len(ordered) // 2]
+
+    @property
+    def learned(self):
+        return len(self.intervals) >= 2
+
+    @property
+    def duration(self):
+        return self.block_bytes * self.byte_time
+
+    def note_block(self, now, size):
+        '''A TEXT block of size bytes completed at monotonic time now.'''
+        if self.last_end is not None:
+            interval = now - self.last_end
+            if self.learned:
+                # a block lost on the line shows up as two periods
+                interval /= max(1, round(interval / self.period))
+            if interval > self.duration:
+                self.intervals.append(interval)
+        self.last_end = now
+        self.block_bytes = size
+        self.blocks += 1
+
+    def idle(self, now):
+        '''No block for 3 periods: TEXT is off (HEX only) or the device is silent.'''
+        return now - (self.start if self.last_end is None else self.last_end) > 3 * self.period
+
+    def next_start(self):
+        return self.last_end + self.period - self.duration
+
+    def gap(self, now, guard=0.0):
+        '''
+        Seconds of idle line left before the next block, less guard on
+        either side; 0 while a block is due or being sent.
+        '''
+        if self.idle(now):
+            return self.period
+        if self.last_end is None:
+            return 0.0
+        if now < self.last_end + guard:
+            return 0.0
+        return max(0.0, self.next_start() - guard - now)
+
+
+class PollItem:
+
+    def __init__(self, register, interval=None, priority=0, callback=None, size=DEFAULT_REPLY_SIZE):
+        '''
+        interval: seconds between polls, None to poll once
+        priority: higher goes first among the due items
+        callback: callback(register, HexMessage) for every reply
+        size:     expected reply bytes, replaced by the size of the first reply
+        '''
+        self.register = register
+        self.interval = interval
+        self.priority = priority
+        self.callback = callback
+        self.size = size
+        self.frame = encode_get(register)
+        self.last = None            # monotonic time of the last reply
+        self.sent = None            # monotonic send time while outstanding
+        self.value = None
+        self.polls = 0
+        self.lost = 0
+
+    def staleness(self, now):
+        if self.last is None:
+            return float('inf')
+        if not self.interval:
+            return 0.0
+        return (now - self.last) / self.interval
+
+    def due(self, now):
+        return self.sent is None and (self.last is None or
+                                      (self.interval is not None and now - self.last >= self.interval))
+
+
+class PollScheduler:
+
+    def __init__(self, ve, client=None, budget=0.5, guard=0.02, timeout=0.5,
+                 baudrate=BAUDRATE, gaps=True):
+        '''
+        ve:       Vedirect to read TEXT frames from
+        client:   HexClient sharing ve.demux, one is made if None
+        budget:   fraction of the device -> host line TEXT plus replies may use
+        guard:    seconds kept free after a block ends and before the next starts
+        timeout:  seconds without a reply before a request counts as lost
+        baudrate: line speed the byte times are taken at
+        gaps:     False sends whenever the budget allows, ignoring the block timing
+        '''
+        self.ve = ve
+        self.client = client or HexClient(ve.ser, demux=ve.demux)
+        self.budget = budget
+        self.guard = guard
+        self.timeout = timeout
+        self.gaps = gaps
+        self.bytes_per_second = baudrate / BITS_PER_BYTE
+        self.timing = BlockTiming(baudrate)
+        self.items = {}             # register -> PollItem
+        self.outstanding = {}       # register -> PollItem
+        self.period_used = 0        # reply bytes asked for since period_start
+        self.period_start = time.monotonic()
+        self.latency = LatencyHistogram()
+        self.sent = 0
+        self.answered = 0
+        self.lost = 0
+        self.bursts = 0
+        self.text_bytes = 0
+        self.reply_bytes = 0
+        self.start = time.monotonic()
+
+    def add(self, register, interval=None, priority=0, callback=None, size=DEFAULT_REPLY_SIZE):
+        '''Queue a GET of register, every interval seconds or once.'''
+        item = PollItem(register, interval, priority, callback, size)
+        self.items[register] = item
+        return item
+
+    def add_history(self, days=HISTORY_DAYS, interval=None, priority=-1, callback=None):
+        '''Queue the history day records 0 (today) .. days-1.'''
+        return [self.add(HISTORY_REGISTER + day, interval, priority, callback, HISTORY_REPLY_SIZE)
+                for day in range(min(days, HISTORY_DAYS))]
+
+    def remove(self, register):
+        self.items.pop(register, None)
+        self.outstanding.pop(register, None)
+
+    def poll(self):
+        '''
+        Read the port once, collect replies, send what fits in the current
+        gap and return the TEXT frames (VedirectFrame) that completed.
+        '''
+        self.ve.demux.pump()
+        now = time.monotonic()
+        frames = []
+        while True:
+            frame = self.ve.next_frame()
+            if frame is None:
+                break
+            size = frame_size(frame)
+            self.timing.note_block(now, size)
+            self.text_bytes += size
+            self.period_used = 0
+            self.period_start = now
+            frames.append(frame)
+        self.collect(now)
+        self.dispatch(now)
+        return frames
+
+    def collect(self, now):
+        replies = self.client.replies
+        for register, item in list(self.outstanding.items()):
+            message = replies.pop((GET_RESPONSE, register), None)
+            if message is not None:
+                del self.outstanding[register]
+                self.latency.observe(now - item.sent)
+                item.sent = None
+                item.last = now
+                item.value = message
+                item.size = len(message.raw) + 1
+                self.answered += 1
+                self.reply_bytes += item.size
+                if item.interval is None:
+                    self.items.pop(register, None)
+                if item.callback is not None:
+                    item.callback(register, message)
+            elif now - item.sent > self.timeout:
+                del self.outstanding[register]
+                item.sent = None
+                item.lost += 1
+                self.lost += 1
+
+    def allowance(self, now):
+        '''Reply bytes that may be asked for right now.'''
+        timing = self.timing
+        idle = timing.idle(now)
+        if idle and now - self.period_start >= timing.period:
+            self.period_used = 0
+            self.period_start = now
+        if not self.gaps:
+            line = int(timing.period * self.bytes_per_second)
+        elif timing.learned or idle:
+            line = int(timing.gap(now, self.guard) * self.bytes_per_second)
+        else:
+            return 0
+        budget = int(self.budget * timing.period * self.bytes_per_second)
+        if not idle:
+            budget -= timing.block_bytes
+        in_flight = sum(item.size for item in self.outstanding.values())
+        return min(line - in_flight, budget - self.period_used)
+
+    def dispatch(self, now):
+        allowance = self.allowance(now)
+        if allowance <= 0:
+            return
+        due = [item for item in self.items.values() if item.due(now)]
+        due.sort(key=lambda item: (-item.priority, -item.staleness(now)))
+        burst = []
+        for item in due:
+            if item.size > allowance:
+                break
+            allowance -= item.size
+            self.period_used += item.size
+            item.sent = now
+            item.polls += 1
+            self.outstanding[item.register] = item
+            burst.append(item.frame)
+        if burst:
+            self.ve.ser.write(b''.join(burst))
+            self.sent += len(burst)
+            self.bursts += 1
+
+    def run(self, duration=None):
+        '''poll() until duration seconds have passed (for ever if None).'''
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            self.poll()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return {
+            'period': self.timing.period,
+            'block_bytes': self.timing.block_bytes,
+            'sent': self.sent,
+            'answered': self.answered,
+            'lost': self.lost,
+            'bursts': self.bursts,
+            'requests_per_second': self.answered / elapsed,
+            'line_utilization': (self.text_bytes + self.reply_bytes) / elapsed / self.bytes_per_second,
+            'latency': self.latency.stats(),
+        }
+
+
+if __name__ == '__main__':
+    from vedirect import Vedirect
+
+    parser = argparse.ArgumentParser(description='Poll registers in the gaps between TEXT blocks')
+    parser.add_argument('-p', '--port', default='/dev/ttyUSB1', help='Serial port (e.g., /dev/ttyUSB1)')
+    parser.add_argument('-r', '--register', type=lambda r: int(r, 0), action='append', default=[],
+                        help='register to poll every --interval seconds (repeatable)')
+    parser.add_argument('-i', '--interval', type=float, default=10.0)
+    parser.add_argument('-d', '--days', type=int, default=0, help='history days to fetch once')
+    parser.add_argument('-b', '--budget', type=float, default=0.5, help='line utilization budget')
+    args = parser.parse_args()
+
+    def show(register, message):
+        print(f'0x{register:04X} = {bytes(message.value).hex().upper()}')
+
+    ve = Vedirect(args.port, 0.05)
+    scheduler = PollScheduler(ve, budget=args.budget)
+    for register in args.register:
+        scheduler.add(register, args.interval, priority=1, callback=show)
+    scheduler.add_history(args.days, callback=show)
+    try:
+        last = time.monotonic()
+        while True:
+            scheduler.poll()
+            if time.monotonic() - last > 10:
+                last = time.monotonic()
+                stats = scheduler.stats()
+                print(f"{stats['requests_per_second']:.1f} requests/s, "
+                      f"line {stats['line_utilization']:.0%}, lost {stats['lost']}")
+    except KeyboardInterrupt:
+        print(scheduler.stats())
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''
+Register value cache in front of HexClient.
+
+Some values can never change while the device is attached, some change
+rarely and some the device pushes by itself, yet every script asks the
+device again each time:
+
+    product id, app version, static      memoized for good
+    registers (serial, model name ...)
+    closed history days                  memoized for good, keyed by their
+                                         day sequence (today is refetched)
+    settings (load output, switch        kept for a per register TTL
+    levels 0xEDAB, 0xED9C, 0xED9D ...)
+    registers the device pushes as       kept up to date from the ':A' lines,
+    async ':A' updates                   served while younger than async_ttl
+
+    cache = RegisterCache(HexClient(ser))
+    cache.product_id()                  # asks the device once
+    cache.get(0xEDAB)                   # then from the cache for 60 s
+    cache.get_history(31)               # only today + days not seen before
+    print(cache.stats())                # hits / misses per kind
+
+A SET goes straight to the device and the reply replaces the cached value.
+'''
+
+import time
+
+from vedirect_demux import ASYNC as ASYNC_ROUTE
+from vedirect_hex import (decode, parse_history_record, GET_RESPONSE, HISTORY_DAYS,
+                          HISTORY_RECORD_SIZE, HISTORY_REGISTER)
+
+# registers that don't change while the device is attached
+STATIC_REGISTERS = frozenset([
+    0x0100,     # product id
+    0x0104,     # group id
+    0x010A,     # serial number
+    0x010B,     # model name
+    0x0140,     # capabilities
+])
+
+# seconds a GET of these settings stays valid
+DEFAULT_TTLS = {
+    0xEDAB: 60.0,   # load output control
+    0xED9C: 60.0,   # load switch low level
+    0xED9D: 60.0,   # load switch high level
+}
+
+STATIC = 'static'
+SETTING = 'setting'
+ASYNC = 'async'
+HISTORY = 'history'
+KINDS = (STATIC, SETTING, ASYNC, HISTORY)
+
+
+def record_sequence(record):
+    return int.from_bytes(record[32:34], 'little')
+
+
+class RegisterCache:
+
+    def __init__(self, client, ttls=None, async_ttl=10.0):
+        '''
+        client:     HexClient to fetch misses with
+        ttls:       {register: seconds} for settings, defaults to DEFAULT_TTLS
+        async_ttl:  seconds an ':A' pushed value is served without asking
+        '''
+        self.client = client
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.async_ttl = async_ttl
+        # register -> (HexMessage, monotonic time it was received, kind)
+        self.values = {}
+        self.memo = {}              # product id / app version replies
+        self.days = {}              # day sequence -> raw closed history record
+        self.today_sequence = None
+        self.hits = dict.fromkeys(KINDS, 0)
+        self.misses = dict.fromkeys(KINDS, 0)
+        self.async_updates = 0
+        client.demux.subscribe(ASYNC_ROUTE, self.on_async)
+
+    def close(self):
+        self.client.demux.unsubscribe(ASYNC_ROUTE, self.on_async)
+
+    def on_async(self, line):
+        message = decode(line)
+        if message is not None and not message.flags:
+            self.values[message.register] = (message, time.monotonic(), ASYNC)
+            self.async_updates += 1
+
+    def note_frame(self, frame):
+        '''Take today's day sequence (HSDS) from a TEXT frame.'''
+        hsds = frame.get('HSDS')
+        if hsds is not None:
+            self.today_sequence = int(hsds)
+
+    def kind(self, register):
+        if register in STATIC_REGISTERS:
+            return STATIC
+        if register in self.ttls:
+            return SETTING
+        return ASYNC
+
+    def cached(self, register):
+        '''Cached reply of register if still valid, else None.'''
+        entry = self.values.get(register)
+        if entry is None:
+            return None
+        message, received, kind = entry
+        if register in STATIC_REGISTERS:
+            return message
+        ttl = self.async_ttl if kind == ASYNC else self.ttls.get(register, 0.0)
+        if kind == ASYNC and register in self.ttls:
+            ttl = max(ttl, self.ttls[register])
+        return message if time.monotonic() - received < ttl else None
+
+    def peek(self, register):
+        '''cached() counted as a hit, a miss is not counted (for answering without the port).'''
+        message = self.cached(register)
+        if message is not None:
+            self.hits[self.kind(register)] += 1
+        return message
+
+    def get_many(self, registers, timeout=None):
+        '''Like HexClient.get_many, only the registers not in the cache go to the device.'''
+        results = {}
+        missing = []
+        for register in registers:
+            message = self.cached(register)
+            kind = self.kind(register)
+            if message is not None:
+                self.hits[kind] += 1
+                results[register] = message
+            else:
+                self.misses[kind] += 1
+                missing.append(register)
+        if missing:
+            replies = self.client.get_many(missing, timeout)
+            now = time.monotonic()
+            for register, message in replies.items():
+                results[register] = message
+                kind = self.kind(register)
+                # other registers are only cached from the ':A' updates
+                if not message.flags and kind != ASYNC:
+                    self.values[register] = (message, now, kind)
+        return results
+
+    def get(self, register, timeout=None):
+        return self.get_many([register], timeout).get(register)
+
+    def set(self, register, value, size=2, flags=0, timeout=None):
+        '''Write through: SET on the device, the reply replaces the cached value.'''
+        self.values.pop(register, None)
+        reply = self.client.set(register, value, size, flags, timeout)
+        if reply is not None and not reply.flags and reply.value:
+            kind = self.kind(register)
+            self.values[register] = (reply._replace(command=GET_RESPONSE), time.monotonic(), kind)
+        return reply
+
+    def invalidate(self, register=None):
+        '''Forget one register, or every cached register value (memoized replies stay).'''
+        if register is None:
+            self.values.clear()
+        else:
+            self.values.pop(register, None)
+
+    def memoized(self, key, fetch, timeout):
+        message = self.memo.get(key)
+        if message is not None:
+            self.hits[STATIC] += 1
+            return message
+        self.misses[STATIC] += 1
+        message = fetch(timeout)
+        if message is not None:
+            self.memo[key] = message
+        return message
+
+    def peek_memo(self, key):
+        '''Memoized 'product_id' / 'app_version' reply counted as a hit, None if not fetched yet.'''
+        message = self.memo.get(key)
+        if message is not None:
+            self.hits[STATIC] += 1
+        return message
+
+    def product_id(self, timeout=None):
+        return self.memoized('product_id', self.client.product_id, timeout)
+
+    def app_version(self, timeout=None):
+        return self.memoized('app_version', self.client.app_version, timeout)
+
+    def get_history_records(self, days=HISTORY_DAYS, timeout=None):
+        '''
+        Like HexClient.get_history_records. Today (day 0) is always fetched,
+        closed days come from the cache when their day sequence is known
+        (from note_frame(), or today's record fetched first otherwise).
+        '''
+        days = min(days, HISTORY_DAYS)
+        assumed = self.today_sequence
+        records = {}
+        if assumed is None and days > 1:
+            self.fetch_days([0], records, timeout)
+        wanted = [] if records.get(0) else [0]
+        for day in range(1, days):
+            record = None
+            if self.today_sequence is not None:
+                record = self.days.get(self.today_sequence - day)
+            if record is not None:
+                self.hits[HISTORY] += 1
+                records[day] = record
+            else:
+                wanted.append(day)
+        self.fetch_days(wanted, records, timeout)
+        if assumed is not None and self.today_sequence != assumed:
+            # the day rolled over since HSDS was noted, the cached days were mapped one off
+            return self.get_history_records(days, timeout)
+        return [records.get(day) for day in range(days)]
+
+    def fetch_days(self, days, records, timeout):
+        if not days:
+            return
+        self.misses[HISTORY] += len(days)
+        registers = [HISTORY_REGISTER + day for day in days]
+        replies = self.client.get_many(registers, timeout)
+        for day, register in zip(days, registers):
+            message = replies.get(register)
+            if message is None or message.flags or len(message.value) < HISTORY_RECORD_SIZE:
+                records[day] = None
+                continue
+            record = bytes(message.value[:HISTORY_RECORD_SIZE])
+            records[day] = record
+            if day == 0:
+                self.today_sequence = record_sequence(record)
+            else:
+                self.days[record_sequence(record)] = record
+
+    def get_history(self, days=HISTORY_DAYS, timeout=None):
+        return [None if record is None else parse_history_record(record)
+                for record in self.get_history_records(days, timeout)]
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        misses = sum(self.misses.values())
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'async_updates': self.async_updates,
+            'cached_registers': len(self.values),
+            'cached_days': len(self.days),
+        }
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+Buffered serial reads shared by Vedirect, SolarHistory and the history scripts.
+
+serial.Serial.read() without a size makes one syscall (and one wakeup) per
+byte. SerialReader instead drains whatever the driver has buffered
+(ser.in_waiting), or a fixed block size if one is given, into one reusable
+bytearray, and counts reads so the syscalls per frame can be reported.
+
+    reader = SerialReader(ser)
+    data = reader.read()          # memoryview, valid until the next read
+    byte = reader.read_byte()     # drop-in for ser.read(1)
+
+The parsers keep their own partial-frame buffer, so a single receive buffer
+that is reused on every read is enough (no ring buffer needed).
+
+With a recorder (capture_recorder.CaptureRecorder) every chunk read is also
+recorded with its time, see capture_recorder.py.
+'''
+
+import select
+import time
+
+
+class SerialReader:
+
+    def __init__(self, ser, block_size=None, buffer_size=4096, recorder=None):
+        '''
+        ser:         open serial.Serial (or anything with read/in_waiting)
+        block_size:  read this many bytes per call (waits for the port timeout
+                     if fewer arrive), None to read what is in_waiting
+        buffer_size: size of the reusable receive buffer
+        recorder:    CaptureRecorder that gets every chunk read, None to not record
+        '''
+        self.ser = ser
+        self.block_size = block_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.pending = self.view[:0]
+        self.recorder = recorder
+        # LatencyHistogram of the bytes taken per read, see metrics.py
+        self.backlog = None
+        self.reads = 0
+        self.bytes = 0
+        self.frames = 0
+        self.start = time.monotonic()
+
+    def fill(self):
+        if self.block_size:
+            size = self.block_size
+        else:
+            # block for the first byte, then take everything already buffered
+            size = self.ser.in_waiting or 1
+        size = min(size, len(self.buffer))
+        self.reads += 1
+        if hasattr(self.ser, 'readinto'):
+            n = self.ser.readinto(self.view[:size]) or 0
+        else:
+            data = self.ser.read(size)
+            n = len(data)
+            self.buffer[:n] = data
+        self.bytes += n
+        if self.backlog is not None:
+            self.backlog.observe(n)
+        if n and self.recorder is not None:
+            self.recorder.write(self.view[:n])
+        return self.view[:n]
+
+    def read(self):
+        '''
+        Return a memoryview of the next chunk of data (empty on timeout).
+        The view points into the reusable buffer and is only valid until the
+        next call, copy it (bytes(data)) to keep it.
+        '''
+        if self.pending:
+            data, self.pending = self.pending, self.view[:0]
+            return data
+        return self.fill()
+
+    def wait(self, timeout):
+        '''
+        Wait up to timeout seconds for data, True as soon as some is there.
+        Ports without a fileno() can't be waited on, they report True and
+        the next read() blocks for the port timeout instead.
+        '''
+        if self.pending or self.ser.in_waiting:
+            return True
+        try:
+            fileno = self.ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            return True
+        return bool(select.select([fileno], [], [], max(timeout, 0.0))[0])
+
+    def read_byte(self):
+        '''Return the next byte as a 1 byte bytes object, b'' on timeout (like ser.read(1)).'''
+        if not self.pending:
+            self.pending = self.fill()
+            if not self.pending:
+                return b''
+        byte = bytes(self.pending[:1])
+        self.pending = self.pending[1:]
+        return byte
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return {
+            'reads': self.reads,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'bytes_per_read': self.bytes / self.reads if self.reads else 0.0,
+            'reads_per_frame': self.reads / self.frames if self.frames else 0.0,
+            'reads_per_second': self.reads / elapsed,
+        }
+
+    def reset_stats(self):
+        self.reads = 0
+        self.bytes = 0
+        self.frames = 0
+        self.start = time.monotonic()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Latest TEXT frame of a device in shared memory, for any number of local readers.
+
+Only one process can have /dev/ttyUSB1 open. The one that does (this
+script's publisher, or vedirect_daemon.py --shm) writes every checksum
+verified frame into a fixed layout multiprocessing.shared_memory block
+named vedirect-<port>; the logger, the MAVLink bridge and the dashboard
+attach to it and read the latest values without locks and without
+talking to the publisher:
+
+    publisher = FramePublisher('ttyUSB1')
+    publisher.publish(frame)                    # VedirectFrame or {key: value}
+
+    reader = FrameReader('ttyUSB1')
+    reader.seq                                  # frames published so far
+    reader.get('V')                             # one field, read in place
+    snapshot = reader.read()                    # (seq, time, published, VedirectFrame)
+    seq = reader.wait(snapshot.seq, 2.0)        # until the next frame
+
+Layout (little endian): a header with the magic, version and the sequence
+number of the latest frame, then two slots. Frame seq goes into slot
+seq & 1 (double buffer): the slot's own seq is zeroed, the values written,
+then the slot seq, a CRC-32 of the slot and last the header seq are set.
+A reader takes the slot the header points at and keeps the values only if
+the slot seq matches before and after (seqlock) and, for read(), the CRC
+matches too, else it tries again. The CRC makes the check independent of
+the order other cores see the stores in.
+
+python3 shared_frame.py -p /dev/ttyUSB1                 # publish a port
+python3 shared_frame.py -r ttyUSB1                      # print frames as they come
+'''
+
+import argparse
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+
+from vedirect_frame import VedirectFrame
+
+MAGIC = b'VEDF'
+VERSION = 1
+
+# numeric fields, int64 each (MISSING when the frame has no such field)
+NUMBER_FIELDS = (
+    'V', 'V2', 'V3', 'VS', 'VM', 'DM', 'VPV', 'PPV', 'I', 'I2', 'I3', 'IL',
+    'T', 'P', 'CE', 'SOC', 'TTG', 'CS', 'MPPT', 'ERR', 'OR', 'LOAD', 'AR', 'MON',
+    'H19', 'H20', 'H21', 'H22', 'H23', 'HSDS',
+)
+# text fields and their size in bytes
+TEXT_FIELDS = (('PID', 8), ('FW', 8), ('SER#', 16))
+# fields sent as ON/OFF and as hex, stored as numbers
+ON_OFF_FIELDS = frozenset(['LOAD'])
+HEX_FIELDS = frozenset(['OR'])
+MISSING = -(1 << 63)
+
+HEADER = struct.Struct('<4sHHI4xQ')         # magic, version, slots, publisher pid, seq
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = HEADER.size - SEQ.size
+SLOT_HEADER = struct.Struct('<QddI4x')      # seq, frame time, publish time (monotonic), crc32
+CRC = struct.Struct('<I')
+CRC_OFFSET = 24
+VALUES = struct.Struct('<%dq' % len(NUMBER_FIELDS) + ''.join('%ds' % size for _, size in TEXT_FIELDS))
+SLOT_SIZE = SLOT_HEADER.size + VALUES.size
+SIZE = HEADER.size + 2 * SLOT_SIZE
+
+# field -> (struct, offset in the slot)
+FIELD_LAYOUT = {}
+_offset = SLOT_HEADER.size
+for _field in NUMBER_FIELDS:
+    FIELD_LAYOUT[_field] = (struct.Struct('<q'), _offset)
+    _offset += 8
+for _field, _size in TEXT_FIELDS:
+    FIELD_LAYOUT[_field] = (struct.Struct('%ds' % _size), _offset)
+    _offset += _size
+
+Snapshot = namedtuple('Snapshot', ['seq', 'time', 'published', 'frame'])
+
+
+def shm_name_for(port):
+    '''Shared memory name of a port (/dev/ttyUSB1 -> vedirect-ttyUSB1).'''
+    return 'vedirect-%s' % os.path.basename(port)
+
+
+def slot_offset(seq):
+    return HEADER.size + (seq & 1) * SLOT_SIZE
+
+
+def slot_crc(buf, offset):
+    crc = zlib.crc32(buf[offset:offset + CRC_OFFSET])
+    return zlib.crc32(buf[offset + SLOT_HEADER.size:offset + SLOT_SIZE], crc)
+
+
+def encode_number(field, value):
+    if value is None:
+        return MISSING
+    if isinstance(value, int):
+        return value
+    if field in ON_OFF_FIELDS:
+        return 1 if value == 'ON' else 0
+    try:
+        return int(value, 16) if field in HEX_FIELDS else int(value)
+    except ValueError:
+        return MISSING
+
+
+def decode_value(field, value):
+    if isinstance(value, bytes):
+        text = value.rstrip(b'\0').decode('latin-1')
+        return text or None
+    if value == MISSING:
+        return None
+    if field in ON_OFF_FIELDS:
+        return 'ON' if value else 'OFF'
+    if field in HEX_FIELDS:
+        return '0x%08X' % value
+    return value
+
+
+class FramePublisher:
+
+    def __init__(self, port):
+        '''port: port name or path, the block is shm_name_for(port)'''
+        self.name = shm_name_for(port)
+        try:
+            self.shm = shared_memory.SharedMemory(self.name, create=True, size=SIZE)
+        except FileExistsError:
+            # left behind by a publisher that did not exit cleanly
+            self.shm = shared_memory.SharedMemory(self.name)
+            if self.shm.size < SIZE:
+                raise ValueError('%s is too small (%d bytes), remove /dev/shm/%s'
+                                 % (self.name, self.shm.size, self.name))
+        self.buf = self.shm.buf
+        self.buf[:SIZE] = bytes(SIZE)
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, 2, os.getpid(), 0)
+        self.seq = 0
+
+    def publish(self, frame, timestamp=None):
+        '''Write a frame (VedirectFrame or {key: value}) as the latest one.'''
+        values = [encode_number(field, frame.get(field)) for field in NUMBER_FIELDS]
+        values += [str(frame.get(field) or '').encode('latin-1')[:size] for field, size in TEXT_FIELDS]
+        if timestamp is None:
+            timestamp = getattr(frame, 'time', None) or time.time()
+        seq = self.seq + 1
+        buf = self.buf
+        offset = slot_offset(seq)
+        SEQ.pack_into(buf, offset, 0)               # slot being written
+        VALUES.pack_into(buf, offset + SLOT_HEADER.size, *values)
+        SLOT_HEADER.pack_into(buf, offset, seq, timestamp, time.monotonic(), 0)
+        CRC.pack_into(buf, offset + CRC_OFFSET, slot_crc(buf, offset))
+        SEQ.pack_into(buf, SEQ_OFFSET, seq)
+        self.seq = seq
+        return seq
+
+    def close(self, unlink=True):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameReader:
+
+    def __init__(self, port):
+        '''port: port name or path the publisher was started with'''
+        self.name = shm_name_for(port)
+        try:
+            self.shm = shared_memory.SharedMemory(self.name, track=False)
+            tracked = False
+        except TypeError:
+            # before Python 3.13 attaching registers the block with the
+            # resource tracker, which removes it when the reader exits
+            self.shm = shared_memory.SharedMemory(self.name)
+            tracked = True
+        self.buf = self.shm.buf
+        magic, version, slots, self.publisher_pid, _ = HEADER.unpack_from(self.buf, 0)
+        if tracked and self.publisher_pid != os.getpid():
+            # the block is the publisher's to remove (in the publisher's own
+            # process it is the same registration, leave it)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d frame table' % (self.name, VERSION))
+        self.retries = 0
+
+    @property
+    def seq(self):
+        '''Sequence number of the latest frame, 0 before the first one.'''
+        return SEQ.unpack_from(self.buf, SEQ_OFFSET)[0]
+
+    def get(self, field, default=None):
+        '''Latest value of one field, read in place (no snapshot of the frame).'''
+        layout, at = FIELD_LAYOUT[field]
+        buf = self.buf
+        while True:
+            seq = SEQ.unpack_from(buf, SEQ_OFFSET)[0]
+            if not seq:
+                return default
+            offset = slot_offset(seq)
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                value = layout.unpack_from(buf, offset + at)[0]
+                if SEQ.unpack_from(buf, offset)[0] == seq:
+                    value = decode_value(field, value)
+                    return default if value is None else value
+            self.retries += 1
+
+    def read(self):
+        '''Latest frame as a Snapshot, None before the first one.'''
+        buf = self.buf
+        while True:
+            seq = SEQ.unpack_from(buf, SEQ_OFFSET)[0]
+            if not seq:
+                return None
+            offset = slot_offset(seq)
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                slot = bytes(buf[offset:offset + SLOT_SIZE])
+                slot_seq, timestamp, published, crc = SLOT_HEADER.unpack_from(slot)
+                if slot_seq == seq and crc == slot_crc(slot, 0):
+                    values = VALUES.unpack_from(slot, SLOT_HEADER.size)
+                    fields = {}
+                    for field, value in zip(NUMBER_FIELDS + tuple(f for f, _ in TEXT_FIELDS), values):
+                        value = decode_value(field, value)
+                        if value is not None:
+                            fields[field] = value
+                    return Snapshot(seq, timestamp, published, VedirectFrame(fields, timestamp))
+            self.retries += 1
+
+    def wait(self, seq, timeout=None, interval=0.001):
+        '''Poll until a frame after seq is published, returns the new seq (seq on timeout).'''
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = SEQ.unpack_from(self.buf, SEQ_OFFSET)[0]
+            if current != seq:
+                return current
+            if end is not None and time.monotonic() >= end:
+                return current
+            time.sleep(interval)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latest VE.Direct frame in shared memory')
+    parser.add_argument('-p', '--port', help='serial port to read and publish (e.g., /dev/ttyUSB1)')
+    parser.add_argument('-r', '--read', metavar='PORT', help='print the frames published for PORT')
+    args = parser.parse_args()
+
+    if args.read:
+        with FrameReader(args.read) as reader:
+            seq = 0
+            try:
+                while True:
+                    seq = reader.wait(seq)
+                    snapshot = reader.read()
+                    print(snapshot.seq, dict(snapshot.frame))
+            except KeyboardInterrupt:
+                pass
+    elif args.port:
+        from vedirect import Vedirect
+        ve = Vedirect(args.port, 1)
+        with FramePublisher(args.port) as publisher:
+            print(f'{args.port} published as /dev/shm/{publisher.name}')
+            try:
+                while True:
+                    for frame in ve.frames(ve.reader.read()):
+                        publisher.publish(frame)
+            except KeyboardInterrupt:
+                print("\nExiting on user request.")
+    else:
+        parser.print_help()
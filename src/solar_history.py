@@ -9,15 +9,27 @@ import serial
 import time
 from datetime import datetime, timedelta
 
+from serial_reader import SerialReader
+import vedirect_hex
+from vedirect_hex import HexClient, HISTORY_REGISTER
+import metrics
+
 class SolarHistory:
-    def __init__(self, port, baudrate=19200, timeout=1):
+    def __init__(self, port, baudrate=19200, timeout=1, retries=2):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.ser = None
+        self.reader = None
+        self.client = None
+        # metrics.Registry, set by metrics.instrument_history
+        self.registry = None
         self.buffer = b''
         self.base_command = ''
         self.day_sequence = None
+        self.current_day = 0
+        # HexClient: times a history GET without a reply is sent again
+        self.retries = retries
         
         # States
         (GET_DAY, WAIT_HEADER, WAIT_CR, FOUND) = range(4)
@@ -28,14 +40,10 @@ class SolarHistory:
         self.state = self.GET_DAY
 
     def calculate_checksum(self, message):
-        checksum = 0x55  # Initial value per VE.Direct protocol
-        for byte in message:
-            checksum -= byte
-        checksum = checksum & 0xFF  # Ensure 8-bit result
-        return bytes([checksum])
+        return vedirect_hex.calculate_checksum(message)
 
     def bytes_to_hex_string(self, byte_data):
-        return ''.join([f'{b:02X}' for b in byte_data])
+        return vedirect_hex.bytes_to_hex_string(byte_data)
 
     def hex_to_bytes(self, hex_string):
         return bytes.fromhex(hex_string)
@@ -43,6 +51,9 @@ class SolarHistory:
     def connect(self):
         try:
             self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.reader = SerialReader(self.ser)
+            if self.registry is not None:
+                self.reader.backlog = metrics.backlog_histogram(self.registry, self.port)
             print(f"Connected to {self.port}")
             return True
         except Exception as e:
@@ -53,6 +64,16 @@ class SolarHistory:
         if self.ser and self.ser.is_open:
             self.ser.close()
 
+    def send_get(self):
+        # Build command for history day record
+        command = vedirect_hex.encode_get(HISTORY_REGISTER + self.current_day)
+        # the reply echoes the command without ':' and checksum, ie '7501000'
+        self.base_command = command[1:-3].decode()
+        self.ser.write(command)
+        print('sent:', command)
+        self.state = self.WAIT_HEADER
+        self.buffer = b''
+
     def process_byte(self, byte):
         if not byte:
             return None
@@ -60,16 +81,7 @@ class SolarHistory:
         self.buffer += byte
 
         if self.state == self.GET_DAY:
-            # Build command for history day record
-            self.base_command = '7' + str(50 + self.current_day) + '10' + '00'
-            checksum = self.calculate_checksum(bytes.fromhex('0' + self.base_command))
-            checksum_hex = self.bytes_to_hex_string(checksum)
-            command = str.encode(':' + self.base_command + checksum_hex + '\n')
-            self.ser.write(command)
-            print('sent:', command)
-            time.sleep(0.1)  # Wait for response
-            self.state = self.WAIT_HEADER
-            self.buffer = b''
+            self.send_get()
             return None
 
         elif self.state == self.WAIT_HEADER:
@@ -100,15 +112,21 @@ class SolarHistory:
             return
 
         try:
-            self.current_day = 0
-            while self.current_day < days:
-                byte = self.ser.read(1)
-                result = self.process_byte(byte)
-                
-                if result is not None:
-                    print(f"Day {self.current_day} sequence: {result}")
-                    self.current_day += 1
-                    time.sleep(0.1)  # Small delay between requests
+            # all days are requested in one burst and matched by register
+            client = self.client = HexClient(self.ser, timeout=self.timeout, reader=self.reader,
+                                             retries=self.retries)
+            if self.registry is not None:
+                client.observe_roundtrip = metrics.roundtrip_observer(self.registry, self.port)
+            history = client.get_history(days)
+            for day, record in enumerate(history):
+                if record is None:
+                    print(f"Day {day}: no reply")
+                else:
+                    print(f"Day {day} sequence: {record['Day Sequence']}")
+                    self.reader.frames += 1
+            print('serial reads:', self.reader.stats())
+            print('latency:', client.stats()['latency'])
+            return history
         except Exception as e:
             print(f"Error: {e}")
         finally:
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Fixed memory time series of recent VE.Direct telemetry, per device.
+
+Every TEXT frame adds one row of V, I, VPV, PPV, CS, ERR and LOAD (1/0) to a
+full rate ring buffer and to the running 1 minute and 1 hour rollups, which
+are written as min/mean/max rows into their own rings when the minute / hour
+closes. All rings are NumPy arrays allocated up front, so memory stays the
+same however long the process runs (about 11 MB per device with the default
+sizes: 1 day at 1 Hz, 30 days of minutes, 5 years of hours).
+
+Range queries are two searchsorted() calls on the time column and a slice,
+O(log n + window):
+
+    buffers = TelemetryBuffers()
+    for frame in ve.frames(data):
+        buffers.append(frame)
+    buf = buffers['HQ2423N36NE']
+    times, values = buf.range(time.time() - 600, time.time())    # raw rows
+    times, ppv = buf.series('PPV', t0, t1, tier=MINUTE, stat=MAX)
+
+python3 telemetry_buffer.py -r '../serial dump-1.txt' -s 0
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+FIELDS = ('V', 'I', 'VPV', 'PPV', 'CS', 'ERR', 'LOAD')
+COLUMN = {field: n for n, field in enumerate(FIELDS)}
+
+RAW = 'raw'
+MINUTE = 'minute'
+HOUR = 'hour'
+PERIODS = {MINUTE: 60, HOUR: 3600}
+
+# stat index of the rollup rows
+MIN = 'min'
+MEAN = 'mean'
+MAX = 'max'
+STATS = (MIN, MEAN, MAX)
+
+
+def frame_row(frame):
+    '''V, I, VPV, PPV, CS, ERR, LOAD of a frame as floats, NaN for missing fields.'''
+    row = np.full(len(FIELDS), np.nan)
+    for n, field in enumerate(FIELDS):
+        value = frame.get(field)
+        if value is None:
+            continue
+        if field == 'LOAD':
+            row[n] = 1.0 if value == 'ON' else 0.0
+            continue
+        try:
+            row[n] = float(value)
+        except ValueError:
+            pass
+    return row
+
+
+class Ring:
+    '''Fixed capacity (time, row) ring, rows appended in time order.'''
+
+    def __init__(self, capacity, shape, dtype=np.float32):
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.data = np.zeros((capacity,) + shape, dtype=dtype)
+        self.capacity = capacity
+        self.head = 0       # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.data.nbytes
+
+    def append(self, t, row):
+        self.times[self.head] = t
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def segments(self):
+        '''The filled part as (start, stop) slices, oldest first.'''
+        if self.count < self.capacity:
+            return [(0, self.count)]
+        if self.head == 0:
+            return [(0, self.capacity)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def range(self, t0, t1):
+        '''(times, rows) with t0 <= time < t1, oldest first (copies).'''
+        times = []
+        rows = []
+        for start, stop in self.segments():
+            segment = self.times[start:stop]
+            lo = start + np.searchsorted(segment, t0, 'left')
+            hi = start + np.searchsorted(segment, t1, 'left')
+            if hi > lo:
+                times.append(self.times[lo:hi])
+                rows.append(self.data[lo:hi])
+        if not times:
+            return self.times[:0].copy(), self.data[:0].copy()
+        if len(times) == 1:
+            return times[0].copy(), rows[0].copy()
+        return np.concatenate(times), np.concatenate(rows)
+
+    def last(self):
+        if not self.count:
+            return None, None
+        n = (self.head - 1) % self.capacity
+        return self.times[n], self.data[n]
+
+
+class Rollup:
+    '''Running min/sum/max of the rows of the current period.'''
+
+    def __init__(self, period, width):
+        self.period = period
+        self.bucket = None
+        self.count = np.zeros(width)
+        self.total = np.zeros(width)
+        self.low = np.full(width, np.inf)
+        self.high = np.full(width, -np.inf)
+
+    def add(self, t, mean, low, high, count):
+        '''
+        Add a row (count samples with this mean/low/high, NaN where missing).
+        Returns (bucket start, [min, mean, max] rows) of the period it closes, or None.
+        '''
+        bucket = t - t % self.period
+        closed = None
+        if self.bucket is not None and bucket != self.bucket:
+            closed = self.close()
+        self.bucket = bucket
+        present = ~np.isnan(mean)
+        self.count[present] += count[present]
+        self.total[present] += mean[present] * count[present]
+        np.fmin(self.low, low, out=self.low)
+        np.fmax(self.high, high, out=self.high)
+        return closed
+
+    def close(self):
+        if self.bucket is None:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total / self.count
+        empty = self.count == 0
+        low = np.where(empty, np.nan, self.low)
+        high = np.where(empty, np.nan, self.high)
+        closed = self.bucket, np.stack([low, mean, high]), self.count.copy()
+        self.bucket = None
+        self.count[:] = 0
+        self.total[:] = 0
+        self.low[:] = np.inf
+        self.high[:] = -np.inf
+        return closed
+
+
+class TelemetryBuffer:
+
+    def __init__(self, raw_size=86400, minute_size=30 * 1440, hour_size=5 * 8760):
+        '''
+        raw_size:     full rate rows kept (86400 = 1 day at one frame per second)
+        minute_size:  1 minute min/mean/max rows kept
+        hour_size:    1 hour min/mean/max rows kept
+        '''
+        width = len(FIELDS)
+        self.rings = {
+            RAW: Ring(raw_size, (width,)),
+            MINUTE: Ring(minute_size, (len(STATS), width)),
+            HOUR: Ring(hour_size, (len(STATS), width)),
+        }
+        self.minute = Rollup(PERIODS[MINUTE], width)
+        self.hour = Rollup(PERIODS[HOUR], width)
+        self.last_time = -np.inf
+        self.frames = 0
+
+    @property
+    def nbytes(self):
+        return sum(ring.nbytes for ring in self.rings.values())
+
+    def append(self, frame, timestamp=None):
+        '''Add one frame (VedirectFrame or {key: value} dict), at frame.time or now.'''
+        if timestamp is None:
+            timestamp = getattr(frame, 'time', None) or time.time()
+        self.append_row(timestamp, frame_row(frame))
+
+    def append_row(self, t, row):
+        # the rings are searched by time, keep it monotonic
+        t = max(t, self.last_time)
+        self.last_time = t
+        self.frames += 1
+        self.rings[RAW].append(t, row)
+        ones = (~np.isnan(row)).astype(float)
+        closed = self.minute.add(t, row, row, row, ones)
+        if closed is not None:
+            self.roll_minute(closed)
+
+    def roll_minute(self, closed):
+        bucket, stats, count = closed
+        self.rings[MINUTE].append(bucket, stats)
+        closed = self.hour.add(bucket, stats[1], stats[0], stats[2], count)
+        if closed is not None:
+            self.rings[HOUR].append(closed[0], closed[1])
+
+    def flush(self):
+        '''Close the current minute and hour now (ie before a shutdown).'''
+        closed = self.minute.close()
+        if closed is not None:
+            self.roll_minute(closed)
+        closed = self.hour.close()
+        if closed is not None:
+            self.rings[HOUR].append(closed[0], closed[1])
+
+    def range(self, t0, t1, tier=RAW):
+        '''
+        (times, rows) with t0 <= time < t1. RAW rows are (n, len(FIELDS)),
+        MINUTE/HOUR rows are (n, 3, len(FIELDS)) of min/mean/max, with the
+        time of the start of the minute/hour. Still open periods are not included.
+        '''
+        return self.rings[tier].range(t0, t1)
+
+    def series(self, field, t0, t1, tier=RAW, stat=MEAN):
+        '''(times, values) of one field, stat picks min/mean/max of the MINUTE/HOUR tiers.'''
+        times, rows = self.range(t0, t1, tier)
+        if tier == RAW:
+            return times, rows[:, COLUMN[field]]
+        return times, rows[:, STATS.index(stat), COLUMN[field]]
+
+    def latest(self):
+        '''{field: value} of the newest frame, None before the first.'''
+        t, row = self.rings[RAW].last()
+        if t is None:
+            return None
+        return dict(zip(FIELDS, row.tolist()), time=float(t))
+
+
+class TelemetryBuffers(dict):
+    '''TelemetryBuffer per device, keyed by SER# (or the given key).'''
+
+    def __init__(self, **sizes):
+        super().__init__()
+        self.sizes = sizes
+
+    def append(self, frame, key=None, timestamp=None):
+        key = key or frame.get('SER#') or ''
+        buffer = self.get(key)
+        if buffer is None:
+            buffer = self[key] = TelemetryBuffer(**self.sizes)
+        buffer.append(frame, timestamp)
+        return buffer
+
+
+if __name__ == '__main__':
+    from vedirect import Vedirect
+    from vedirect_replay import ReplaySerial, load_capture
+
+    parser = argparse.ArgumentParser(description='Keep recent VE.Direct telemetry in memory')
+    parser.add_argument('-p', '--port', default='/dev/ttyUSB1')
+    parser.add_argument('-r', '--replay', help='replay this capture instead of the port')
+    parser.add_argument('-s', '--speed', type=float, default=1.0, help='replay speed, 0 as fast as possible')
+    args = parser.parse_args()
+
+    port = ReplaySerial(load_capture(args.replay), args.speed) if args.replay else args.port
+    ve = Vedirect(port, 1)
+    buffers = TelemetryBuffers()
+    try:
+        while not getattr(port, 'eof', False):
+            for frame in ve.frames(ve.reader.read()):
+                buffer = buffers.append(frame)
+                if buffer.frames % 10 == 0:
+                    print(frame.get('SER#'), buffer.latest())
+    except KeyboardInterrupt:
+        pass
+    for serial, buffer in buffers.items():
+        times, rows = buffer.range(-np.inf, np.inf)
+        print(f'{serial}: {buffer.frames} frames, {buffer.nbytes / 1e6:.1f} MB allocated')
+        print('  min ', dict(zip(FIELDS, np.nanmin(rows, axis=0).tolist())))
+        print('  mean', dict(zip(FIELDS, np.nanmean(rows, axis=0).astype(float).round(1).tolist())))
+        print('  max ', dict(zip(FIELDS, np.nanmax(rows, axis=0).tolist())))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Change-only encoding of VE.Direct frames for slow GCS links.
+
+The TEXT block repeats every field once a second (PID, FW, SER#, H19..H23,
+HSDS hardly ever change) and serial_vedirect.lua forwards two send_text
+strings every other frame. ChangeEncoder keeps the last state it sent and
+only emits the fields that moved by more than their deadband, plus a full
+keyframe every keyframe_interval seconds so a receiver that missed a
+message (or just started) catches up:
+
+    encoder = ChangeEncoder()
+    for frame in ve.frames(data):
+        message = encoder.encode(frame)             # compact binary, b'' if nothing changed
+        link.write(message)
+        # or MAVLink NAMED_VALUE_INT frames for a GCS:
+        link.write(encoder.encode_mavlink(frame, time_boot_ms))
+
+Binary message:
+
+    <flags: 0x01 keyframe> <sequence 0..255> then per field
+    <field id> <zigzag varint>                  numeric field
+    <field id | 0x80> <length> <latin-1 text>   text field (PID, SER#, LOAD ...)
+
+Field ids are the FIELDS index, new names are only ever appended.
+ChangeDecoder rebuilds the full frame on the receiving side.
+
+python3 telemetry_encoder.py '../serial dump-1.txt' '../serial dump.txt'
+'''
+
+import argparse
+import struct
+import time
+
+from vedirect_frame import VedirectFrame
+
+# wire ids, append only
+FIELDS = ('PID', 'FW', 'SER#', 'V', 'V2', 'V3', 'VS', 'VM', 'DM', 'VPV', 'PPV', 'I', 'I2',
+          'I3', 'IL', 'LOAD', 'T', 'P', 'CE', 'SOC', 'TTG', 'Alarm', 'Relay', 'AR', 'OR',
+          'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'H7', 'H8', 'H9', 'H10', 'H11', 'H12', 'H13',
+          'H14', 'H15', 'H16', 'H17', 'H18', 'H19', 'H20', 'H21', 'H22', 'H23', 'ERR', 'CS',
+          'BMV', 'MPPT', 'MON', 'HSDS', 'AC_OUT_V', 'AC_OUT_I', 'AC_OUT_S', 'WARN', 'MODE')
+FIELD_ID = {field: n for n, field in enumerate(FIELDS)}
+TEXT_FLAG = 0x80
+KEYFRAME = 0x01
+
+# smallest change worth sending, in the field's own units (mV, mA, W, 0.01 kWh ...),
+# fields not listed are sent on any change
+DEADBANDS = {
+    'V': 20, 'V2': 20, 'V3': 20, 'VS': 20, 'VM': 20, 'VPV': 200,
+    'I': 50, 'I2': 50, 'I3': 50, 'IL': 50, 'PPV': 2, 'P': 2,
+    'T': 1, 'CE': 100, 'SOC': 5, 'TTG': 10, 'DM': 5,
+    'AC_OUT_V': 50, 'AC_OUT_I': 5, 'AC_OUT_S': 5,
+}
+
+# MAVLink 2 NAMED_VALUE_INT (id 252): time_boot_ms, value, name[10]
+MAVLINK_STX = 0xFD
+NAMED_VALUE_INT = 252
+NAMED_VALUE_INT_CRC_EXTRA = 44
+NAMED_VALUE_INT_PAYLOAD = struct.Struct('<Ii10s')
+MAVLINK_HEADER = struct.Struct('<BBBBBBBHB')    # stx, len, incompat, compat, seq, sys, comp, msgid (24 bit)
+# STATUSTEXT (id 253): severity, text[50], id, chunk_seq, as sent by gcs:send_text
+STATUSTEXT_TEXT = 50
+MAVLINK_OVERHEAD = MAVLINK_HEADER.size + 2     # + crc
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def put_varint(out, value):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def x25_crc(data, crc=0xFFFF):
+    '''CRC-16/MCRF4XX used by MAVLink.'''
+    for byte in data:
+        tmp = byte ^ (crc & 0xFF)
+        tmp = (tmp ^ (tmp << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF
+    return crc
+
+
+def mavlink_named_value_int(name, value, time_boot_ms=0, seq=0, sysid=1, compid=191):
+    '''One MAVLink 2 NAMED_VALUE_INT frame (unsigned, trailing zeros trimmed).'''
+    payload = NAMED_VALUE_INT_PAYLOAD.pack(time_boot_ms & 0xFFFFFFFF, value, name.encode()[:10])
+    payload = payload.rstrip(b'\x00') or b'\x00'
+    header = MAVLINK_HEADER.pack(MAVLINK_STX, len(payload), 0, 0, seq & 0xFF, sysid, compid,
+                                 NAMED_VALUE_INT & 0xFFFF, NAMED_VALUE_INT >> 16)
+    crc = x25_crc(header[1:] + payload)
+    crc = x25_crc(bytes([NAMED_VALUE_INT_CRC_EXTRA]), crc)
+    return header + payload + struct.pack('<H', crc)
+
+
+def mavlink_int(field, value):
+    '''Integer for NAMED_VALUE_INT, None for text that has no number (ie SER#).'''
+    if isinstance(value, int):
+        return value
+    if value in ('ON', 'OFF'):
+        return int(value == 'ON')
+    try:
+        return int(value, 0)
+    except ValueError:
+        return None
+
+
+def statustext_size(text):
+    return MAVLINK_OVERHEAD + 1 + min(len(text), STATUSTEXT_TEXT)
+
+
+class ChangeEncoder:
+
+    def __init__(self, deadbands=None, keyframe_interval=60.0):
+        '''
+        deadbands:          {field: smallest change sent}, defaults to DEADBANDS
+        keyframe_interval:  seconds between full frames
+        '''
+        self.deadbands = DEADBANDS if deadbands is None else deadbands
+        self.keyframe_interval = keyframe_interval
+        self.sent = {}
+        self.last_keyframe = None
+        self.sequence = 0
+        self.mavlink_sequence = 0
+        self.frames = 0
+        self.keyframes = 0
+        self.fields_in = 0
+        self.fields_out = 0
+        self.bytes_out = 0
+
+    def changes(self, frame, now=None):
+        '''
+        (keyframe, {field: value}) to send for frame and remember them as sent.
+        frame is a VedirectFrame or a {key: value} dict from the parser.
+        '''
+        if not isinstance(frame, VedirectFrame):
+            frame = VedirectFrame(frame)
+        if now is None:
+            now = frame.time
+        keyframe = self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval
+        if keyframe:
+            self.last_keyframe = now
+            self.keyframes += 1
+            changed = {key: value for key, value in frame.items() if key in FIELD_ID}
+        else:
+            changed = {}
+            sent = self.sent
+            for key, value in frame.items():
+                if key not in FIELD_ID:
+                    continue
+                last = sent.get(key)
+                if last is None or type(last) is not type(value):
+                    changed[key] = value
+                elif isinstance(value, int):
+                    if abs(value - last) > self.deadbands.get(key, 0):
+                        changed[key] = value
+                elif value != last:
+                    changed[key] = value
+        self.sent.update(changed)
+        self.frames += 1
+        self.fields_in += len(frame)
+        self.fields_out += len(changed)
+        return keyframe, changed
+
+    def encode(self, frame, now=None):
+        '''Binary change message for frame, b'' when nothing needs sending.'''
+        keyframe, changed = self.changes(frame, now)
+        if not changed:
+            return b''
+        out = bytearray((KEYFRAME if keyframe else 0, self.sequence))
+        self.sequence = (self.sequence + 1) & 0xFF
+        for key, value in changed.items():
+            if isinstance(value, int):
+                out.append(FIELD_ID[key])
+                put_varint(out, zigzag(value))
+            else:
+                text = value.encode('latin-1')[:255]
+                out.append(FIELD_ID[key] | TEXT_FLAG)
+                out.append(len(text))
+                out += text
+        self.bytes_out += len(out)
+        return bytes(out)
+
+    def encode_mavlink(self, frame, time_boot_ms=0, now=None, sysid=1, compid=191):
+        '''NAMED_VALUE_INT frames (one per changed field), b'' when nothing changed.'''
+        _, changed = self.changes(frame, now)
+        out = bytearray()
+        for key, value in changed.items():
+            value = mavlink_int(key, value)
+            if value is None:
+                continue
+            out += mavlink_named_value_int(key, value, time_boot_ms, self.mavlink_sequence, sysid, compid)
+            self.mavlink_sequence += 1
+        self.bytes_out += len(out)
+        return bytes(out)
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'keyframes': self.keyframes,
+            'fields_in': self.fields_in,
+            'fields_out': self.fields_out,
+            'bytes_out': self.bytes_out,
+            'bytes_per_frame': self.bytes_out / self.frames if self.frames else 0.0,
+        }
+
+
+class ChangeDecoder:
+    '''Receiving side of ChangeEncoder.encode: rebuilds the full frame state.'''
+
+    def __init__(self):
+        self.state = {}
+        self.sequence = None
+        self.synced = False
+        self.lost = 0
+
+    def decode(self, message):
+        '''
+        Apply one message and return the full {field: value} state, or None
+        while waiting for a keyframe after a lost message.
+        '''
+        flags, sequence = message[0], message[1]
+        if self.sequence is not None and sequence != (self.sequence + 1) & 0xFF:
+            self.lost += (sequence - self.sequence - 1) & 0xFF
+            self.synced = False
+        self.sequence = sequence
+        if flags & KEYFRAME:
+            self.state = {}
+            self.synced = True
+        pos = 2
+        while pos < len(message):
+            field = message[pos]
+            pos += 1
+            if field & TEXT_FLAG:
+                length = message[pos]
+                value = bytes(message[pos + 1:pos + 1 + length]).decode('latin-1')
+                pos += 1 + length
+                field &= ~TEXT_FLAG
+            else:
+                value, pos = get_varint(message, pos)
+                value = unzigzag(value)
+            self.state[FIELDS[field]] = value
+        return dict(self.state) if self.synced else None
+
+
+def lua_statustext_bytes(frame, count):
+    '''Bytes serial_vedirect.lua sends for this frame (two send_text every other frame).'''
+    if count % 2:
+        return 0
+    frame = frame if isinstance(frame, VedirectFrame) else VedirectFrame(frame)
+    text = ('PPV: %.2f W, VPV: %.2f V, IPV: %.2f A, VB: %.2f, IB: %.2f A' %
+            (frame.panel_power or 0, frame.panel_voltage or 0.0, frame.panel_current or 0.0,
+             frame.battery_voltage or 0.0, frame.battery_current or 0.0))
+    return statustext_size(text) + statustext_size('History: ')
+
+
+def text_block_size(fields):
+    '''Bytes of the TEXT block on the VE.Direct line.'''
+    return sum(4 + len(key) + len(str(value)) for key, value in fields.items()) + len('\r\nChecksum\t') + 1
+
+
+if __name__ == '__main__':
+    from vedirect_parser import VedirectParser
+    from vedirect_replay import load_capture
+
+    parser = argparse.ArgumentParser(description='Change-only encoding savings on captures')
+    parser.add_argument('captures', nargs='+', help="capture files, e.g. '../serial dump-1.txt'")
+    parser.add_argument('-k', '--keyframe', type=float, default=60.0, help='seconds between keyframes')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='play each capture this many times (at one frame per second)')
+    args = parser.parse_args()
+
+    for path in args.captures:
+        capture = load_capture(path)
+        frames = VedirectParser().frames(capture.data)
+        if not frames:
+            print(f'{capture.name}: no frames')
+            continue
+        frames = frames * args.repeat
+        binary = ChangeEncoder(keyframe_interval=args.keyframe)
+        mavlink = ChangeEncoder(keyframe_interval=args.keyframe)
+        every = ChangeEncoder(keyframe_interval=0.0)
+        decoder = ChangeDecoder()
+        totals = dict.fromkeys(['TEXT block', 'lua send_text', 'NAMED_VALUE all', 'NAMED_VALUE changes',
+                                'binary changes'], 0)
+        start = time.time()
+        for n, fields in enumerate(frames):
+            frame = VedirectFrame(fields, start + n)
+            totals['TEXT block'] += text_block_size(fields)
+            totals['lua send_text'] += lua_statustext_bytes(frame, n + 1)
+            totals['NAMED_VALUE all'] += len(every.encode_mavlink(frame, n * 1000))
+            totals['NAMED_VALUE changes'] += len(mavlink.encode_mavlink(frame, n * 1000))
+            message = binary.encode(frame)
+            totals['binary changes'] += len(message)
+            if message:
+                state = decoder.decode(message)
+                assert state is not None and all(
+                    key not in FIELD_ID or key in state for key in frame), 'decoder lost a field'
+
+        minutes = len(frames) / 60.0
+        print(f'{capture.name}: {len(frames)} frames at 1 Hz, keyframe every {args.keyframe:g} s')
+        print(f'  {"":>20} {"bytes/min":>9} {"of TEXT":>8} {"of lua":>8}')
+        for name, size in totals.items():
+            print(f'  {name:>20} {size / minutes:9.0f} {100 * size / totals["TEXT block"]:7.1f}% '
+                  f'{100 * size / totals["lua send_text"]:7.1f}%')
+        print('  binary:', binary.stats())
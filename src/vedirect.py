@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import serial
+from vedirect_parser import TEXT
+from vedirect_demux import VedirectDemux, REPLY
+from vedirect_frame import VedirectFrame
+from serial_reader import SerialReader
 
 class Vedirect:
 
-    def __init__(self, serialport, timeout):
+    def __init__(self, serialport, timeout, block_size=None, parser=None, recorder=None):
         self.serialport = serialport
-        self.ser = serial.Serial(serialport, 19200, timeout=timeout)
+        if isinstance(serialport, str):
+            self.ser = serial.Serial(serialport, 19200, timeout=timeout)
+        else:
+            # already open serial.Serial (or anything with read/write)
+            self.ser = serialport
         self.header1 = ord('\r')
         self.header2 = ord('\n')
         self.hexmarker = ord(':')
@@ -16,10 +24,20 @@ class Vedirect:
         self.bytes_sum = 0;
         self.state = self.WAIT_HEADER
         self.dict = {}
+        # chunked parser used by read_data_single/read_data_callback, TEXT
+        # frames are queued here, HEX replies update dict['Get'] and can
+        # also be taken by a HexClient sharing the demux
+        # parser: ResyncParser() on noisy lines, see vedirect_parser.py
+        # recorder: CaptureRecorder keeping the raw bytes, see capture_recorder.py
+        self.demux = VedirectDemux(self.ser, SerialReader(self.ser, block_size, recorder=recorder), parser=parser)
+        self.demux.subscribe(REPLY, self.on_reply)
+        self.reader = self.demux.reader
 
 
     (HEX, WAIT_HEADER, IN_KEY, IN_VALUE, IN_CHECKSUM, IN_GET) = range(6)
 
+    # byte at a time state machine (same as scripts/serial_vedirect.lua),
+    # the read_data_* methods use the chunked VedirectParser instead
     def input(self, byte):
         if byte == self.hexmarker and self.state != self.IN_CHECKSUM:
             self.state = self.HEX
@@ -85,22 +103,74 @@ class Vedirect:
         else:
             raise AssertionError()
 
+    def on_reply(self, line):
+        if line.startswith(b':7'):
+            self.dict['Get'] = line.decode('latin-1')
+
+    def next_packet(self):
+        '''
+        Return the next queued TEXT frame merged into self.dict (same dict as
+        input() returns), or None if none is pending.
+        '''
+        frame = self.demux.pop(TEXT)
+        if frame is None:
+            return None
+        self.reader.frames += 1
+        self.dict.update(frame)
+        return self.dict
+
+    def packets(self, data):
+        '''Feed a chunk of serial data and yield each completed packet.'''
+        self.demux.feed(data)
+        while True:
+            packet = self.next_packet()
+            if packet is None:
+                return
+            yield packet
+
+    def next_frame(self):
+        '''
+        Return the next queued TEXT frame as its own immutable VedirectFrame
+        (numbers parsed, not merged into self.dict), or None if none is pending.
+        '''
+        frame = self.demux.pop(TEXT)
+        if frame is None:
+            return None
+        self.reader.frames += 1
+        return VedirectFrame(frame)
+
+    def frames(self, data):
+        '''Feed a chunk of serial data and yield each completed VedirectFrame.'''
+        self.demux.feed(data)
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def read_frame(self):
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            self.demux.pump()
+
     def read_data_single(self):
         while True:
-            data = self.ser.read()
-            for single_byte in data:
-                packet = self.input(single_byte)
-                if (packet != None):
-                    return packet
+            packet = self.next_packet()
+            if packet is not None:
+                return packet
+            self.demux.pump()
             
 
     def read_data_callback(self, callbackFunction):
         while True:
-            data = self.ser.read()
-            for byte in data:
-                packet = self.input(byte)
-                if (packet != None):
-                    callbackFunction(packet)
+            for packet in self.packets(self.reader.read()):
+                callbackFunction(packet)
+
+    def stats(self):
+        '''Serial read statistics, see SerialReader.stats().'''
+        return self.reader.stats()
 
 
 
@@ -127,17 +197,14 @@ if __name__ == '__main__':
     while True:
 
         # print(count)
-        data = ve.ser.read()
+        data = ve.reader.read()
         if data:
             # print(data.decode(), end='')
-            for single_byte in data:
-                packet = ve.input(single_byte)
-                if (packet != None):
-                    break
-
-            if packet:
+            for packet in ve.packets(data):
                 count += 1
                 print(packet)
+                if count % 60 == 0:
+                    print(ve.stats())
                 get = hist_list[count % len(hist_list)]
                 ve.ser.write(str.encode(get))
                 # print('++++++++++++++++sent', get)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+'''
+asyncio versions of Vedirect and SolarHistory.
+
+The port is opened with pyserial (for the termios setup) and then read from
+the event loop with loop.add_reader on its file descriptor, so one loop can
+watch any number of controllers without a thread per port.
+
+    async def main():
+        ve = AsyncVedirect('/dev/ttyUSB1')
+        await ve.start()
+        hist = AsyncSolarHistory(ve)          # shares the port
+        print(await hist.get_day(0))
+        async for frame in ve.frames():
+            print(frame['V'], frame['I'])
+
+    asyncio.run(main())
+
+Anything with fileno() or a plain fd (pipe, pty) can be passed instead of a
+port name, see bench_async.py.
+'''
+
+import asyncio
+import os
+
+import serial
+
+from vedirect_demux import VedirectDemux, ASYNC, REPLY
+from vedirect_parser import TEXT
+from vedirect_hex import (decode, encode_get, parse_history_record, GET_RESPONSE,
+                          HISTORY_REGISTER, HISTORY_DAYS)
+from vedirect_hex import ASYNC as ASYNC_COMMAND
+
+
+class AsyncVedirect:
+
+    def __init__(self, port, baudrate=19200, queue_size=64):
+        '''
+        port:       serial port name, object with fileno(), or an open fd
+        queue_size: TEXT frames kept for frames() before the oldest are dropped
+        '''
+        self.ser = None
+        if isinstance(port, str):
+            self.ser = serial.Serial(port, baudrate, timeout=0)
+            self.fd = self.ser.fileno()
+        elif isinstance(port, int):
+            self.fd = port
+        else:
+            self.ser = port
+            self.fd = port.fileno()
+        os.set_blocking(self.fd, False)
+        self.loop = None
+        self.queue = None
+        self.queue_size = queue_size
+        self.demux = VedirectDemux(None)
+        self.demux.subscribe(TEXT, self.on_text)
+        self.demux.subscribe(REPLY, self.on_line)
+        self.demux.subscribe(ASYNC, self.on_line)
+        # (response command, register) -> [Future, ...]
+        self.waiters = {}
+        self.async_values = {}
+        # bytes write() could not hand to the fd yet, sent by on_writable
+        self.pending = bytearray()
+        self.reads = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.loop.add_reader(self.fd, self.on_readable)
+
+    def close(self):
+        if self.loop is not None:
+            if not self.closed:
+                self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+        del self.pending[:]
+        self.closed = True
+        if self.ser is not None:
+            self.ser.close()
+        for futures in self.waiters.values():
+            for future in futures:
+                future.cancel()
+        self.waiters.clear()
+
+    def on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not data:
+            # writer side closed (pipe/pty)
+            self.loop.remove_reader(self.fd)
+            self.closed = True
+            self.on_text(None)
+            return
+        self.reads += 1
+        self.bytes += len(data)
+        self.demux.feed(data)
+
+    def on_text(self, frame):
+        # None marks the end of the stream for frames()
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    def on_line(self, line):
+        message = decode(line)
+        if message is None:
+            return
+        if message.command == ASYNC_COMMAND:
+            self.async_values[message.register] = message
+            return
+        for future in self.waiters.pop((message.command, message.register), []):
+            if not future.done():
+                future.set_result(message)
+
+    async def frames(self):
+        '''Yield each checksum verified TEXT frame as a {key: value} dict.'''
+        while True:
+            frame = await self.queue.get()
+            if frame is None:
+                return
+            yield frame
+
+    def write(self, data):
+        '''Send data without blocking, what the fd does not take now goes out when it is writable.'''
+        if self.pending:
+            # keep the order, on_writable sends it after what is queued
+            self.pending += data
+            return
+        try:
+            n = os.write(self.fd, data)
+        except (BlockingIOError, InterruptedError):
+            n = 0
+        if n < len(data):
+            self.pending += data[n:]
+            self.loop.add_writer(self.fd, self.on_writable)
+
+    def on_writable(self):
+        try:
+            n = os.write(self.fd, self.pending)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # the other end is gone, the requests waiting on a reply time out
+            n = len(self.pending)
+        del self.pending[:n]
+        if not self.pending:
+            self.loop.remove_writer(self.fd)
+
+    async def request(self, key, frame, timeout=2.0):
+        '''Send frame and wait for the reply matching key, None on timeout.'''
+        future = self.loop.create_future()
+        self.waiters.setdefault(key, []).append(future)
+        self.write(frame)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            futures = self.waiters.get(key, [])
+            if future in futures:
+                futures.remove(future)
+            return None
+
+    async def get(self, register, timeout=2.0):
+        return await self.request((GET_RESPONSE, register), encode_get(register), timeout)
+
+    def stats(self):
+        return {'reads': self.reads, 'bytes': self.bytes, 'dropped': self.dropped,
+                'routes': self.demux.stats()['counts']}
+
+
+class AsyncSolarHistory:
+
+    def __init__(self, ve, timeout=2.0):
+        '''ve: a started AsyncVedirect to share, or a port name to open'''
+        self.ve = ve if isinstance(ve, AsyncVedirect) else AsyncVedirect(ve)
+        self.timeout = timeout
+
+    async def start(self):
+        if self.ve.loop is None:
+            await self.ve.start()
+
+    async def get_day(self, day):
+        '''History record for day (0 = today) as a parse_history_record dict, None on timeout/error.'''
+        message = await self.ve.get(HISTORY_REGISTER + day, self.timeout)
+        if message is None or message.flags:
+            return None
+        return parse_history_record(message.value)
+
+    async def get_history(self, days=10):
+        '''All requested days at once, replies matched by register.'''
+        days = min(days, HISTORY_DAYS)
+        return await asyncio.gather(*(self.get_day(day) for day in range(days)))
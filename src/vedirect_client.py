@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Thin client for vedirect_daemon.py.
+
+python3 vedirect_client.py get 0xEDAB                 # load output control
+python3 vedirect_client.py set 0xEDAB 4 --size 1
+python3 vedirect_client.py frame
+python3 vedirect_client.py history -d 10
+python3 vedirect_client.py product_id
+python3 vedirect_client.py -p /dev/ttyUSB0 stats      # daemon of another port
+
+    with DaemonClient('/tmp/vedirect-ttyUSB1.sock') as client:
+        print(client.frame()['frame']['V'])
+'''
+
+import argparse
+import json
+import socket
+
+from vedirect_daemon import socket_path_for, PORT
+
+
+class DaemonClient:
+
+    def __init__(self, socket_path, timeout=10.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rb')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def call(self, cmd, **args):
+        args['cmd'] = cmd
+        self.sock.sendall(json.dumps(args).encode() + b'\n')
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('daemon closed the connection')
+        return json.loads(line)
+
+    def get(self, register, fresh=False):
+        return self.call('get', register=register, fresh=fresh)
+
+    def set(self, register, value, size=2):
+        return self.call('set', register=register, value=value, size=size)
+
+    def frame(self):
+        return self.call('frame')
+
+    def history(self, days=10):
+        return self.call('history', days=days)
+
+    def ping(self):
+        return self.call('ping')
+
+    def product_id(self):
+        return self.call('product_id')
+
+    def app_version(self):
+        return self.call('app_version')
+
+    def stats(self):
+        return self.call('stats')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query a running vedirect_daemon.py')
+    parser.add_argument('-p', '--port', default=PORT, help='port the daemon serves')
+    parser.add_argument('-s', '--socket', help='Unix socket path (default /tmp/vedirect-<port>.sock)')
+    commands = parser.add_subparsers(dest='cmd', required=True)
+    get = commands.add_parser('get', help='GET a register')
+    get.add_argument('register', type=lambda r: int(r, 0))
+    get.add_argument('-f', '--fresh', action='store_true', help='ask the device, not the cache')
+    set_ = commands.add_parser('set', help='SET a register')
+    set_.add_argument('register', type=lambda r: int(r, 0))
+    set_.add_argument('value', type=lambda v: int(v, 0))
+    set_.add_argument('--size', type=int, default=2, help='value size in bytes')
+    history = commands.add_parser('history', help='history day records')
+    history.add_argument('-d', '--days', type=int, default=10)
+    for name in ('frame', 'ping', 'product_id', 'app_version', 'stats'):
+        commands.add_parser(name)
+    args = parser.parse_args()
+
+    path = args.socket or socket_path_for(args.port)
+    try:
+        client = DaemonClient(path)
+    except OSError as e:
+        print(f"Error connecting to {path} (is vedirect_daemon.py running?): {e}")
+        exit(1)
+    with client:
+        if args.cmd == 'get':
+            response = client.get(args.register, args.fresh)
+        elif args.cmd == 'set':
+            response = client.set(args.register, args.value, args.size)
+        elif args.cmd == 'history':
+            response = client.history(args.days)
+        else:
+            response = client.call(args.cmd)
+    print(json.dumps(response, indent=2))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Long running owner of a VE.Direct port, serving local clients.
+
+vedirecthex*.py and the history scripts each open the port themselves, so
+only one of them can run at a time and every call pays for opening the port
+and waiting out a read timeout. The daemon opens the port once, keeps the
+Vedirect parser running (latest TEXT frame always at hand) and answers
+requests from any number of clients over a Unix domain socket, one JSON
+object per line:
+
+    {"cmd": "get", "register": 60843}          -> {"ok": true, "flags": 0, "value": "01", "int": 1}
+    {"cmd": "get", "register": 60843, "fresh": true}    bypass the RegisterCache
+    {"cmd": "set", "register": 60843, "value": 1, "size": 1}
+    {"cmd": "frame"}                            -> latest TEXT frame and its age
+    {"cmd": "history", "days": 10}              -> parse_history_record dicts
+    {"cmd": "ping"} / {"cmd": "app_version"} / {"cmd": "product_id"} / {"cmd": "stats"}
+
+Errors come back as {"ok": false, "error": "..."}. HEX requests from
+different clients are sent one at a time through the shared HexClient.
+Cache hits and "frame" are answered without waiting for the port.
+
+python3 vedirect_daemon.py -p /dev/ttyUSB1            # socket /tmp/vedirect-ttyUSB1.sock
+python3 vedirect_client.py get 0xEDAB                 # see vedirect_client.py
+'''
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+
+from vedirect import Vedirect
+from vedirect_hex import HexClient, HISTORY_DAYS
+from register_cache import RegisterCache
+from shared_frame import FramePublisher
+from capture_recorder import CaptureRecorder
+import metrics
+
+PORT = '/dev/ttyUSB1'
+
+
+def socket_path_for(port):
+    return '/tmp/vedirect-%s.sock' % os.path.basename(port)
+
+
+def message_dict(message):
+    '''JSON friendly form of a HexMessage reply.'''
+    if message is None:
+        return {'ok': False, 'error': 'no reply'}
+    value = bytes(message.value)
+    return {
+        'ok': True,
+        'command': message.command,
+        'register': message.register,
+        'flags': message.flags,
+        'value': value.hex().upper(),
+        'int': int.from_bytes(value, 'little') if value else None,
+    }
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.vedirect
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = daemon.handle(request)
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class VedirectDaemon:
+
+    def __init__(self, port, socket_path=None, timeout=0.05, request_timeout=0.5, open_port=None,
+                 shm=False, record=None, metrics_port=None):
+        '''
+        port:            serial port name (or an open serial.Serial)
+        socket_path:     Unix socket to listen on, defaults to /tmp/vedirect-<port>.sock
+        timeout:         serial read timeout of the poll loop
+        request_timeout: seconds to wait for a HEX reply before resending (HexClient timeout)
+        open_port:       function(port) -> Vedirect, defaults to Vedirect(port, timeout)
+        shm:             also publish every frame to shared memory (shared_frame.FrameReader)
+        record:          directory to record the raw bytes to (capture_recorder.py), None to not record
+        metrics_port:    serve OpenMetrics on http://127.0.0.1:<metrics_port>/metrics (metrics.py)
+        '''
+        self.port = port
+        self.socket_path = socket_path or socket_path_for(port if isinstance(port, str) else 'port')
+        self.request_timeout = request_timeout
+        self.ve = (open_port or (lambda p: Vedirect(p, timeout)))(port)
+        self.client = HexClient(self.ve.ser, timeout=request_timeout, demux=self.ve.demux)
+        # product id, closed history days and settings are answered from here
+        self.cache = RegisterCache(self.client)
+        # the poll loop and the request handlers take turns on the port
+        self.lock = threading.Lock()
+        self.waiting = 0            # requests queued for the lock, the poll loop backs off
+        self.waiting_lock = threading.Lock()
+        self.publisher = FramePublisher(port if isinstance(port, str) else 'port') if shm else None
+        self.recorder = CaptureRecorder(record, port) if record else None
+        self.ve.reader.recorder = self.recorder
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        if metrics_port is not None:
+            name = os.path.basename(port) if isinstance(port, str) else 'port'
+            metrics.instrument_vedirect(self.ve, name)
+            metrics.instrument_hex(self.client, name)
+        # (latest frame, monotonic time it arrived), one attribute so the
+        # request handlers read it without the lock
+        self.latest = None
+        self.frames = 0
+        self.requests = 0
+        self.running = False
+        self.server = None
+        self.thread = None
+        self.commands = {
+            'get': self.cmd_get,
+            'set': self.cmd_set,
+            'frame': self.cmd_frame,
+            'history': self.cmd_history,
+            'ping': self.cmd_ping,
+            'app_version': self.cmd_app_version,
+            'product_id': self.cmd_product_id,
+            'stats': self.cmd_stats,
+        }
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = UnixServer(self.socket_path, RequestHandler)
+        self.server.vedirect = self
+        self.running = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='vedirect-server',
+                                       daemon=True)
+        self.thread.start()
+        if self.metrics_port is not None:
+            self.metrics_server = metrics.REGISTRY.serve(self.metrics_port)
+
+    def stop(self):
+        self.running = False
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if self.recorder is not None:
+            self.recorder.close()
+        self.ve.ser.close()
+
+    def poll(self):
+        '''Read the port once (unless a request is waiting for it) and keep the latest frame.'''
+        if self.waiting:
+            time.sleep(0.001)
+            return
+        with self.lock:
+            self.ve.demux.pump()
+            self.take_frames()
+
+    def take_frames(self):
+        while True:
+            frame = self.ve.next_frame()
+            if frame is None:
+                return
+            self.latest = (frame, time.monotonic())
+            if self.publisher is not None:
+                self.publisher.publish(frame)
+            self.cache.note_frame(frame)
+            self.frames += 1
+
+    def run(self):
+        self.start()
+        try:
+            while self.running:
+                self.poll()
+        finally:
+            self.stop()
+
+    def hex_request(self, fn, *args):
+        '''Run a HexClient call with the port to ourselves.'''
+        with self.waiting_lock:
+            self.waiting += 1
+        try:
+            with self.lock:
+                self.requests += 1
+                try:
+                    return fn(*args)
+                finally:
+                    # TEXT frames that arrived during the request
+                    self.take_frames()
+        finally:
+            with self.waiting_lock:
+                self.waiting -= 1
+
+    def handle(self, request):
+        command = self.commands.get(request.get('cmd'))
+        if command is None:
+            return {'ok': False, 'error': 'unknown command %r' % request.get('cmd')}
+        return command(request)
+
+    @staticmethod
+    def register(request):
+        register = request['register']
+        return int(register, 0) if isinstance(register, str) else int(register)
+
+    def cmd_get(self, request):
+        register = self.register(request)
+        if request.get('fresh'):
+            self.cache.invalidate(register)
+        else:
+            # a cache hit does not wait for the poll loop's read
+            message = self.cache.peek(register)
+            if message is not None:
+                return message_dict(message)
+        return message_dict(self.hex_request(self.cache.get, register))
+
+    def cmd_set(self, request):
+        value = request['value']
+        if isinstance(value, str):
+            value = bytes.fromhex(value)
+        reply = self.hex_request(self.cache.set, self.register(request), value,
+                                 int(request.get('size', 2)))
+        return message_dict(reply)
+
+    def cmd_ping(self, request):
+        return message_dict(self.hex_request(self.client.ping))
+
+    def cmd_app_version(self, request):
+        return message_dict(self.cache.peek_memo('app_version') or self.hex_request(self.cache.app_version))
+
+    def cmd_product_id(self, request):
+        return message_dict(self.cache.peek_memo('product_id') or self.hex_request(self.cache.product_id))
+
+    def cmd_history(self, request):
+        days = int(request.get('days', HISTORY_DAYS))
+        history = self.hex_request(self.cache.get_history, days)
+        return {'ok': True, 'history': history}
+
+    def cmd_frame(self, request):
+        latest = self.latest
+        if latest is None:
+            return {'ok': False, 'error': 'no frame received yet'}
+        frame, received = latest
+        return {'ok': True, 'frame': frame.to_dict(), 'time': frame.time,
+                'age': time.monotonic() - received}
+
+    def cmd_stats(self, request):
+        return {
+            'ok': True,
+            'frames': self.frames,
+            'requests': self.requests,
+            'serial': self.ve.stats(),
+            'demux': self.ve.demux.stats(),
+            'hex_errors': self.client.error_count,
+            'cache': self.cache.stats(),
+            'recording': self.recorder.stats() if self.recorder is not None else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a VE.Direct port over a Unix socket')
+    parser.add_argument('-p', '--port', default=PORT, help='Serial port (e.g., /dev/ttyUSB1)')
+    parser.add_argument('-s', '--socket', help='Unix socket path (default /tmp/vedirect-<port>.sock)')
+    parser.add_argument('--shm', action='store_true',
+                        help='also publish frames to shared memory /dev/shm/vedirect-<port>')
+    parser.add_argument('--record', metavar='DIR', help='record the raw bytes to DIR (capture_recorder.py)')
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='serve OpenMetrics on http://127.0.0.1:PORT/metrics (metrics.py)')
+    args = parser.parse_args()
+
+    daemon = VedirectDaemon(args.port, args.socket, shm=args.shm, record=args.record, metrics_port=args.metrics)
+    print(f'{args.port} served on {daemon.socket_path}')
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print("\nExiting on user request.")
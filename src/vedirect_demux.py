@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+'''
+Single pass demultiplexer for the VE.Direct serial stream.
+
+The controller interleaves TEXT blocks, async ':A' register updates and the
+replies to our HEX requests on the same line. VedirectDemux reads the port
+once, splits the stream with VedirectParser and routes every event to the
+callbacks subscribed to its route, or to the route's bounded queue (oldest
+dropped when full) when nobody is subscribed:
+
+    TEXT   {key: value} dict of a checksum verified TEXT frame
+    ASYNC  b':A...\\n' register update pushed by the device
+    REPLY  b':7...\\n', b':8...\\n', b':1...\\n' ... reply to a request
+
+Vedirect and HexClient can share one demux, so history polling and live
+telemetry run on the same port without either dropping the other's data:
+
+    ve = Vedirect('/dev/ttyUSB1', 1)
+    client = HexClient(ve.ser, demux=ve.demux)
+'''
+
+import time
+from collections import deque
+
+from serial_reader import SerialReader
+from vedirect_parser import VedirectParser, TEXT
+
+ASYNC = 'async'
+REPLY = 'reply'
+
+
+class VedirectDemux:
+
+    def __init__(self, ser, reader=None, queue_size=64, parser=None):
+        '''
+        ser:        open serial.Serial
+        reader:     SerialReader already wrapping ser, if there is one
+        queue_size: events kept per route before the oldest are dropped
+        parser:     VedirectParser (default) or ie ResyncParser for noisy lines
+        '''
+        self.ser = ser
+        self.reader = reader or SerialReader(ser)
+        self.parser = parser or VedirectParser()
+        self.queues = {route: deque(maxlen=queue_size) for route in (TEXT, ASYNC, REPLY)}
+        self.callbacks = {route: [] for route in (TEXT, ASYNC, REPLY)}
+        self.counts = {route: 0 for route in (TEXT, ASYNC, REPLY)}
+        self.dropped = {route: 0 for route in (TEXT, ASYNC, REPLY)}
+        # LatencyHistogram of the parse time per feed(), see metrics.py
+        self.parse_time = None
+
+    def subscribe(self, route, callback):
+        '''Call callback(payload) for every event on route (TEXT, ASYNC or REPLY).'''
+        self.callbacks[route].append(callback)
+
+    def unsubscribe(self, route, callback):
+        self.callbacks[route].remove(callback)
+
+    def feed(self, data):
+        '''Parse a chunk of serial data and route the events, returns the number routed.'''
+        if self.parse_time is None:
+            events = self.parser.feed(data)
+        else:
+            start = time.perf_counter()
+            events = self.parser.feed(data)
+            self.parse_time.observe(time.perf_counter() - start)
+        for kind, payload in events:
+            if kind == TEXT:
+                route = TEXT
+            elif payload[1:2] == b'A':
+                route = ASYNC
+            else:
+                route = REPLY
+            self.counts[route] += 1
+            callbacks = self.callbacks[route]
+            if callbacks:
+                for callback in callbacks:
+                    callback(payload)
+                continue
+            queue = self.queues[route]
+            if len(queue) == queue.maxlen:
+                self.dropped[route] += 1
+            queue.append(payload)
+        return len(events)
+
+    def pump(self):
+        '''Read one chunk from the port and route it.'''
+        return self.feed(self.reader.read())
+
+    def pop(self, route):
+        '''Oldest queued event on route, or None.'''
+        queue = self.queues[route]
+        return queue.popleft() if queue else None
+
+    def stats(self):
+        return {
+            'counts': dict(self.counts),
+            'dropped': dict(self.dropped),
+            'queued': {route: len(queue) for route, queue in self.queues.items()},
+        }
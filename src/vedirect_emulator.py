@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+VE.Direct MPPT emulator on a pseudo terminal, for the HEX paths without hardware.
+
+Every interval seconds (1 by default, like the real device) the emulator
+sends the ':A' async updates and the TEXT block of a TrafficDevice
+(vedirect_traffic.py), and it answers HEX requests written to the port:
+
+    GET/SET 0x1050 .. 0x106E    history day records (SET is not supported)
+    GET     0xEDA8              load output state
+    GET/SET 0xEDAB              load control mode (0 off, 4 on, others by the switch levels)
+    GET/SET 0xED9C / 0xED9D     switch low / high level, 0.01 V
+    GET/SET 0xEDCC              streetlight function
+    GET/SET 0xEDF0              battery max current, 0.1 A
+    ping, app version, product id, restart
+
+A line with a bad checksum gets ':4AAAAFD' (framing error), an unknown
+register a reply with the unknown id flag, as on the device. Replies go
+out after latency + uniform(0, jitter) seconds, a drop fraction of them is
+never sent, and the output is paced at baudrate so a reply waits for a
+TEXT block that is going out. A load state change is pushed as ':A' EDA8.
+
+    with DeviceEmulator(latency=0.02, jitter=0.01, drop=0.05) as emulator:
+        history = SolarHistory(emulator.port)   # or vedirecthex1.py -p <port>
+        history.connect()
+        history.get_history(31)
+        print(emulator.stats())
+
+python3 vedirect_emulator.py -n 4 --latency 0.02 --jitter 0.01 --drop 0.05
+'''
+
+import argparse
+import heapq
+import itertools
+import os
+import random
+import select
+import threading
+import time
+
+from vedirect_hex import (encode, decode, register_payload, PING, APP_VERSION, PRODUCT_ID, RESTART, GET, SET,
+                          DONE, UNKNOWN, ERROR, PING_RESPONSE, GET_RESPONSE, SET_RESPONSE, ASYNC,
+                          FLAG_UNKNOWN_ID, FLAG_NOT_SUPPORTED, FLAG_PARAMETER_ERROR,
+                          HISTORY_REGISTER, HISTORY_DAYS)
+from vedirect_traffic import TrafficDevice, device_serial
+
+FIRMWARE = 0x0164
+PRODUCT = 0xA060
+LOAD_STATE = 0xEDA8
+LOAD_MODE = 0xEDAB
+SWITCH_LOW = 0xED9C
+SWITCH_HIGH = 0xED9D
+# register -> (value size in bytes, writable, default)
+REGISTERS = {
+    LOAD_STATE: (1, False, 1),
+    LOAD_MODE: (1, True, 1),
+    SWITCH_LOW: (2, True, 1202),
+    SWITCH_HIGH: (2, True, 1302),
+    0xEDCC: (1, True, 0),
+    0xEDF0: (2, True, 100),
+}
+# load control modes
+LOAD_OFF = 0
+LOAD_ON = 4
+FRAMING_ERROR = encode(ERROR, b'\xAA\xAA')
+MAX_LINE = 256
+
+
+class DeviceEmulator:
+
+    def __init__(self, device=None, latency=0.005, jitter=0.0, drop=0.0, interval=1.0, async_lines=4,
+                 baudrate=19200, seed=None):
+        '''
+        device:      TrafficDevice behind the port (one with default values if None)
+        latency:     seconds from a request to its reply
+        jitter:      up to this many seconds added to each reply's latency
+        drop:        fraction of replies never sent
+        interval:    seconds between TEXT blocks
+        async_lines: ':A' updates sent before each TEXT block
+        baudrate:    output pacing, 0 to write as fast as the pty takes it
+        '''
+        self.device = device or TrafficDevice()
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.interval = interval
+        self.async_lines = async_lines
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.random = random.Random(seed)
+        self.values = {register: default for register, (_, _, default) in REGISTERS.items()}
+        self.pending = []           # heap of (due, n, bytes) replies
+        self.order = itertools.count()
+        self.output = []            # bytes ready to go out, oldest first
+        self.line_free = 0.0
+        self.input = bytearray()
+        self.next_text = 0.0
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.running = False
+        self.counts = dict.fromkeys(['requests', 'replies', 'dropped', 'framing_errors', 'text_blocks',
+                                     'async', 'bytes_out', 'bytes_lost'], 0)
+
+    def start(self):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.next_text = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name='vedirect-emulator', daemon=True)
+        self.thread.start()
+        return self.port
+
+    def run(self):
+        master = self.master
+        while self.running:
+            now = time.monotonic()
+            if now >= self.next_text:
+                self.send_second()
+                # a stalled thread catches up with one block, not a burst
+                self.next_text = max(self.next_text + self.interval, now)
+            while self.pending and self.pending[0][0] <= now:
+                self.output.append(heapq.heappop(self.pending)[2])
+            if self.output and now >= self.line_free:
+                data = self.output.pop(0)
+                self.write(data)
+                self.line_free = now + len(data) * self.byte_time
+            wake = self.next_text
+            if self.pending:
+                wake = min(wake, self.pending[0][0])
+            if self.output:
+                wake = min(wake, self.line_free)
+            if select.select([master], [], [], min(max(wake - time.monotonic(), 0.0), 0.1))[0]:
+                try:
+                    self.receive(os.read(master, 4096))
+                except (BlockingIOError, OSError):
+                    pass
+
+    def write(self, data):
+        '''Write to the pty, what does not fit (no client reading) is lost as on a real line.'''
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+        self.counts['bytes_out'] += written
+        self.counts['bytes_lost'] += len(data) - written
+
+    def send_second(self):
+        device = self.device
+        device.step()
+        self.update_load()
+        if not self.values[LOAD_STATE]:
+            device.load_ma = 0
+        lines = device.async_lines(self.async_lines)
+        self.counts['async'] += len(lines)
+        self.counts['text_blocks'] += 1
+        self.output.append(b''.join(lines) + device.text_block())
+
+    def update_load(self):
+        '''Load output from the mode and the switch levels, a change is pushed as :A.'''
+        mode = self.values[LOAD_MODE]
+        state = self.values[LOAD_STATE]
+        if mode == LOAD_OFF:
+            state = 0
+        elif mode == LOAD_ON:
+            state = 1
+        else:
+            centivolts = self.device.battery_mv // 10
+            if centivolts >= self.values[SWITCH_HIGH]:
+                state = 1
+            elif centivolts < self.values[SWITCH_LOW]:
+                state = 0
+        if state != self.values[LOAD_STATE]:
+            self.values[LOAD_STATE] = state
+            self.output.append(encode(ASYNC, register_payload(LOAD_STATE, 0, bytes([state]))))
+            self.counts['async'] += 1
+
+    def receive(self, data):
+        self.input += data
+        while True:
+            end = self.input.find(b'\n')
+            if end < 0:
+                if len(self.input) > MAX_LINE:
+                    del self.input[:]
+                return
+            line = bytes(self.input[:end])
+            del self.input[:end + 1]
+            start = line.find(b':')
+            if start < 0:
+                continue
+            reply = self.respond(line[start:])
+            if reply is None:
+                continue
+            if self.drop and self.random.random() < self.drop:
+                self.counts['dropped'] += 1
+                continue
+            due = time.monotonic() + self.latency + self.random.uniform(0.0, self.jitter)
+            heapq.heappush(self.pending, (due, next(self.order), reply))
+            self.counts['replies'] += 1
+
+    def respond(self, line):
+        '''Reply bytes to one HEX request line, None when there is no reply.'''
+        self.counts['requests'] += 1
+        message = decode(line)
+        if message is None:
+            self.counts['framing_errors'] += 1
+            return FRAMING_ERROR
+        command = message.command
+        if command == PING:
+            return encode(PING_RESPONSE, FIRMWARE.to_bytes(2, 'little'))
+        if command == APP_VERSION:
+            return encode(DONE, FIRMWARE.to_bytes(2, 'little'))
+        if command == PRODUCT_ID:
+            return encode(DONE, PRODUCT.to_bytes(2, 'little'))
+        if command == RESTART:
+            self.values = {register: default for register, (_, _, default) in REGISTERS.items()}
+            return None
+        if command == GET and message.register is not None:
+            flags, value = self.get(message.register)
+            return encode(GET_RESPONSE, register_payload(message.register, flags, value))
+        if command == SET and message.register is not None:
+            flags, value = self.set(message.register, message.value)
+            return encode(SET_RESPONSE, register_payload(message.register, flags, value))
+        return encode(UNKNOWN, bytes([command]))
+
+    def get(self, register):
+        '''(flags, value bytes) of a register.'''
+        if HISTORY_REGISTER <= register < HISTORY_REGISTER + HISTORY_DAYS:
+            return 0, self.device.history_record(register - HISTORY_REGISTER)
+        if register in REGISTERS:
+            return 0, self.values[register].to_bytes(REGISTERS[register][0], 'little')
+        return FLAG_UNKNOWN_ID, b''
+
+    def set(self, register, value):
+        '''Store value (bytes) in a register, returns the reply's (flags, value bytes).'''
+        if HISTORY_REGISTER <= register < HISTORY_REGISTER + HISTORY_DAYS:
+            return FLAG_NOT_SUPPORTED, value
+        if register not in REGISTERS:
+            return FLAG_UNKNOWN_ID, value
+        size, writable, _ = REGISTERS[register]
+        if not writable:
+            return FLAG_NOT_SUPPORTED, value
+        if len(value) != size:
+            return FLAG_PARAMETER_ERROR, value
+        number = int.from_bytes(value, 'little')
+        low = number if register == SWITCH_LOW else self.values[SWITCH_LOW]
+        high = number if register == SWITCH_HIGH else self.values[SWITCH_HIGH]
+        if low >= high:
+            return FLAG_PARAMETER_ERROR, value
+        self.values[register] = number
+        if register in (LOAD_MODE, SWITCH_LOW, SWITCH_HIGH):
+            self.update_load()
+        return 0, value
+
+    def stats(self):
+        return dict(self.counts, pending=len(self.pending) + len(self.output))
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulate VE.Direct MPPTs on pseudo terminals')
+    parser.add_argument('-n', '--devices', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds from request to reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds added per reply')
+    parser.add_argument('--drop', type=float, default=0.0, help='fraction of replies not sent')
+    parser.add_argument('-i', '--interval', type=float, default=1.0, help='seconds between TEXT blocks')
+    parser.add_argument('-b', '--baudrate', type=int, default=19200, help='output pacing, 0 for none')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    emulators = [DeviceEmulator(TrafficDevice(device_serial(n), seed=args.seed + n), args.latency, args.jitter,
+                                args.drop, args.interval, baudrate=args.baudrate, seed=args.seed + n)
+                 for n in range(args.devices)]
+    for emulator in emulators:
+        print(emulator.device.serial, 'on', emulator.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nExiting on user request.")
+    for emulator in emulators:
+        emulator.stop()
+        print(emulator.device.serial, emulator.stats())
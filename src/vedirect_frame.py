@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+'''
+Immutable VE.Direct TEXT frame.
+
+Vedirect.packets() merges every frame into the same self.dict, so a consumer
+that keeps a packet sees it change under it, keys dropped by the device stay
+around and every value is a string to be converted again by each consumer.
+VedirectFrame is built once per completed frame instead:
+
+    frame = VedirectFrame({'V': '12800', 'I': '-150', 'VPV': '16050', ...})
+    frame['V']                  # 12800, numeric fields are parsed once
+    frame.battery_voltage       # 12.8 (V), scaled on access
+    frame.panel_current         # PPV / VPV, 0.0 at night, None if missing
+    frame.to_dict()             # plain dict copy
+
+Field names are interned, so the keys of all frames share one string object.
+Fields that are not numbers (PID, FW, SER#, LOAD ...) keep their text, as
+does a numeric field whose value does not parse.
+'''
+
+import sys
+import time
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# fields sent as decimal integers (MPPT, BMV and inverter TEXT protocol)
+INT_FIELDS = frozenset([
+    'V', 'V2', 'V3', 'VS', 'VM', 'DM', 'VPV', 'PPV', 'I', 'I2', 'I3', 'IL',
+    'T', 'P', 'CE', 'SOC', 'TTG', 'AR', 'CS', 'ERR', 'MPPT', 'MON', 'WARN',
+    'HSDS', 'AC_OUT_V', 'AC_OUT_I', 'AC_OUT_S',
+    'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'H7', 'H8', 'H9', 'H10', 'H11',
+    'H12', 'H13', 'H14', 'H15', 'H16', 'H17', 'H18',
+    'H19', 'H20', 'H21', 'H22', 'H23',
+])
+
+
+class VedirectFrame(Mapping):
+
+    __slots__ = ('values', 'time')
+
+    def __init__(self, fields, timestamp=None):
+        '''
+        fields:     {key: value} strings of one TEXT frame (VedirectParser)
+        timestamp:  time.time() the frame completed, defaults to now
+        '''
+        values = {}
+        for key, value in fields.items():
+            key = sys.intern(key)
+            if key in INT_FIELDS:
+                try:
+                    value = int(value)
+                except ValueError:
+                    pass
+            values[key] = value
+        # a read-only view, the dict itself is never handed out
+        object.__setattr__(self, 'values', MappingProxyType(values))
+        object.__setattr__(self, 'time', time.time() if timestamp is None else timestamp)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('VedirectFrame is immutable')
+
+    def __reduce__(self):
+        # pickle, copy and multiprocessing queues rebuild the frame through __init__
+        return (VedirectFrame, (dict(self.values), self.time))
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __repr__(self):
+        return f'VedirectFrame({dict(self.values)!r})'
+
+    def to_dict(self):
+        return dict(self.values)
+
+    def scaled(self, key, scale):
+        value = self.values.get(key)
+        return value * scale if isinstance(value, int) else None
+
+    # MPPT
+
+    @property
+    def battery_voltage(self):
+        '''V'''
+        return self.scaled('V', 0.001)
+
+    @property
+    def battery_current(self):
+        '''A, positive when charging'''
+        return self.scaled('I', 0.001)
+
+    @property
+    def panel_voltage(self):
+        '''V'''
+        return self.scaled('VPV', 0.001)
+
+    @property
+    def panel_power(self):
+        '''W'''
+        return self.scaled('PPV', 1)
+
+    @property
+    def panel_current(self):
+        '''A, PPV / VPV (0.0 with no panel voltage, None if either is missing)'''
+        power = self.values.get('PPV')
+        voltage = self.values.get('VPV')
+        if not isinstance(power, int) or not isinstance(voltage, int):
+            return None
+        return power * 1000.0 / voltage if voltage else 0.0
+
+    @property
+    def load_current(self):
+        '''A'''
+        return self.scaled('IL', 0.001)
+
+    @property
+    def load_on(self):
+        load = self.values.get('LOAD')
+        return None if load is None else load == 'ON'
+
+    @property
+    def state(self):
+        '''charge state (CS), 0 off, 3 bulk, 4 absorption, 5 float'''
+        return self.values.get('CS')
+
+    @property
+    def error(self):
+        '''error code (ERR), 0 no error'''
+        return self.values.get('ERR')
+
+    @property
+    def yield_total(self):
+        '''kWh (H19)'''
+        return self.scaled('H19', 0.01)
+
+    @property
+    def yield_today(self):
+        '''kWh (H20)'''
+        return self.scaled('H20', 0.01)
+
+    @property
+    def max_power_today(self):
+        '''W (H21)'''
+        return self.scaled('H21', 1)
+
+    @property
+    def day_sequence(self):
+        return self.values.get('HSDS')
+
+    @property
+    def serial(self):
+        return self.values.get('SER#')
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+'''
+VE.Direct HEX protocol: frame encoding/decoding and a pipelining client.
+
+Message format (see vedirecthex1.py for examples):
+
+    :<cmd nibble><payload as hex><checksum as hex>\\n
+
+    checksum = (0x55 - cmd - sum(payload)) & 0xFF
+    ie 0x55-0x08-0xF0-0xED-0x00-0x64-0x00 = 0x0C
+
+GET/SET/async payloads are <register id, 2 bytes little endian><flags><value>.
+
+HexClient writes several requests back to back and matches the replies by
+register id (GET/SET/async) or by command (ping, app version, product id),
+so the reply order does not matter and no fixed sleep is needed between
+requests:
+
+    client = HexClient(ser)
+    days = client.get_history(31)       # 31 GETs in one burst
+
+The port is read through a VedirectDemux, pass the one of a Vedirect to keep
+receiving its TEXT frames while requests are outstanding.
+'''
+
+import struct
+import time
+from collections import namedtuple, deque
+
+from latency import LatencyHistogram
+from vedirect_demux import VedirectDemux
+from vedirect_demux import ASYNC as ASYNC_ROUTE, REPLY as REPLY_ROUTE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# commands
+PING = 0x1
+APP_VERSION = 0x3
+PRODUCT_ID = 0x4
+RESTART = 0x6
+GET = 0x7
+SET = 0x8
+
+# responses
+DONE = 0x1
+UNKNOWN = 0x3
+ERROR = 0x4
+PING_RESPONSE = 0x5
+GET_RESPONSE = 0x7
+SET_RESPONSE = 0x8
+ASYNC = 0xA
+
+# response flags
+FLAG_UNKNOWN_ID = 0x01
+FLAG_NOT_SUPPORTED = 0x02
+FLAG_PARAMETER_ERROR = 0x04
+
+# history day records 0x1050 (today) ... 0x106E (30 days ago)
+HISTORY_REGISTER = 0x1050
+HISTORY_DAYS = 31
+# the day sequence (HSDS) of a day record counts 0 .. 364 and wraps
+DAY_SEQUENCES = 365
+HISTORY_RECORD_SIZE = 34
+# bad lines kept in HexClient.errors
+RECENT_ERRORS = 32
+
+COMMAND_NAMES = {GET: 'get', SET: 'set', PING_RESPONSE: 'ping', APP_VERSION: 'app_version',
+                 PRODUCT_ID: 'product_id'}
+
+HexMessage = namedtuple('HexMessage', ['command', 'register', 'flags', 'value', 'raw'])
+
+
+def calculate_checksum(message):
+    '''Checksum byte for message = command byte followed by the payload bytes.'''
+    checksum = 0x55  # Initial value per VE.Direct protocol
+    for byte in message:
+        checksum -= byte
+    return bytes([checksum & 0xFF])
+
+
+def bytes_to_hex_string(byte_data):
+    return byte_data.hex().upper()
+
+
+def encode(command, payload=b''):
+    '''Encode a HEX frame, ie encode(GET, b'\\x50\\x10\\x00') -> b':7501000EE\\n' '''
+    checksum = (0x55 - command - sum(payload)) & 0xFF
+    return b':%X%s%02X\n' % (command, payload.hex().upper().encode(), checksum)
+
+
+def register_payload(register, flags=0, value=b''):
+    return register.to_bytes(2, 'little') + bytes([flags]) + value
+
+
+def encode_get(register, flags=0):
+    return encode(GET, register_payload(register, flags))
+
+
+def encode_set(register, value, size=2, flags=0):
+    '''value is bytes, or an int packed little endian into size bytes'''
+    if isinstance(value, int):
+        value = value.to_bytes(size, 'little', signed=value < 0)
+    return encode(SET, register_payload(register, flags, value))
+
+
+def encode_ping():
+    return encode(PING)
+
+
+def encode_app_version():
+    return encode(APP_VERSION)
+
+
+def encode_product_id():
+    return encode(PRODUCT_ID)
+
+
+def decode(line):
+    '''
+    Decode one HEX line (b':7501000...71\\n') to a HexMessage, None if it is
+    malformed or the checksum does not match.
+    '''
+    line = bytes(line).strip()
+    if len(line) < 4 or line[0] != 0x3A:
+        return None
+    try:
+        command = int(line[1:2], 16)
+        data = bytes.fromhex(line[2:].decode('ascii'))
+    except ValueError:
+        return None
+    if (command + sum(data)) & 0xFF != 0x55:
+        return None
+    data = data[:-1]
+    if command in (GET_RESPONSE, SET_RESPONSE, ASYNC) and len(data) >= 3:
+        return HexMessage(command, int.from_bytes(data[0:2], 'little'), data[2], data[3:], line)
+    return HexMessage(command, None, None, data, line)
+
+
+# history day record, 34 bytes little endian (fields as HistoryDay)
+HISTORY_STRUCT = struct.Struct('<BIIHHBBBBBHHHIHHH')
+
+
+class HistoryDay(namedtuple('HistoryDay', [
+        'reserved', 'yield_total', 'consumed', 'max_battery_voltage', 'min_battery_voltage',
+        'error_database', 'error_0', 'error_1', 'error_2', 'error_3',
+        'time_bulk', 'time_absorption', 'time_float', 'max_power',
+        'max_battery_current', 'max_pv_voltage', 'day_sequence'])):
+    '''
+    One history day record as raw integers in device units: yield/consumed
+    0.01 kWh, voltages 0.01 V, current 0.1 A, times in minutes, power in W.
+    The properties give the scaled values.
+    '''
+    __slots__ = ()
+
+    @property
+    def yield_kwh(self):
+        return self.yield_total / 100.0
+
+    @property
+    def consumed_kwh(self):
+        return self.consumed / 100.0
+
+    @property
+    def max_battery_v(self):
+        return self.max_battery_voltage / 100.0
+
+    @property
+    def min_battery_v(self):
+        return self.min_battery_voltage / 100.0
+
+    @property
+    def max_battery_a(self):
+        return self.max_battery_current / 10.0
+
+    @property
+    def max_pv_v(self):
+        return self.max_pv_voltage / 100.0
+
+    def to_dict(self):
+        '''The parse_history_record dict.'''
+        return {
+            'Reserved': self.reserved,  # Should be 0
+            'Total Yield (kWh)': self.yield_total / 100.0,
+            'Consumed (kWh)': self.consumed / 100.0,
+            'Max Battery Voltage (V)': self.max_battery_voltage / 100.0,
+            'Min Battery Voltage (V)': self.min_battery_voltage / 100.0,
+            'Error Database': self.error_database,  # Should be 0
+            'Error 0 (Most Recent)': self.error_0,
+            'Error 1': self.error_1,
+            'Error 2': self.error_2,
+            'Error 3 (Oldest)': self.error_3,
+            'Time in Bulk (min)': self.time_bulk,
+            'Time in Absorption (min)': self.time_absorption,
+            'Time in Float (min)': self.time_float,
+            'Max Power (W)': self.max_power,
+            'Max Battery Current (A)': self.max_battery_current / 10.0,
+            'Max PV Voltage (V)': self.max_pv_voltage / 100.0,
+            'Day Sequence': self.day_sequence,
+        }
+
+
+def decode_history_record(buffer, offset=0):
+    '''
+    HistoryDay from the 34 bytes at offset of buffer (bytes, bytearray,
+    memoryview, mmap), unpacked in place without slicing. None if too short.
+    '''
+    if len(buffer) - offset < HISTORY_RECORD_SIZE:
+        return None
+    return HistoryDay._make(HISTORY_STRUCT.unpack_from(buffer, offset))
+
+
+def iter_history_records(buffer):
+    '''HistoryDay for each whole record of back to back records in buffer.'''
+    view = memoryview(buffer).cast('B')
+    view = view[:len(view) - len(view) % HISTORY_RECORD_SIZE]
+    return map(HistoryDay._make, HISTORY_STRUCT.iter_unpack(view))
+
+
+def history_dtype():
+    '''NumPy structured dtype with the HistoryDay fields, itemsize 34.'''
+    return np.dtype([('reserved', 'u1'), ('yield_total', '<u4'), ('consumed', '<u4'),
+                     ('max_battery_voltage', '<u2'), ('min_battery_voltage', '<u2'),
+                     ('error_database', 'u1'), ('error_0', 'u1'), ('error_1', 'u1'),
+                     ('error_2', 'u1'), ('error_3', 'u1'), ('time_bulk', '<u2'),
+                     ('time_absorption', '<u2'), ('time_float', '<u2'), ('max_power', '<u4'),
+                     ('max_battery_current', '<u2'), ('max_pv_voltage', '<u2'),
+                     ('day_sequence', '<u2')])
+
+
+def history_array(buffer, count=-1, offset=0):
+    '''
+    Back to back records in buffer as a structured array (one call, no copy,
+    read only if buffer is), ie history_array(b''.join(payloads))['yield_total'].
+    '''
+    if np is None:
+        raise ImportError('history_array needs numpy')
+    if count < 0:
+        count = (len(buffer) - offset) // HISTORY_RECORD_SIZE
+    return np.frombuffer(buffer, dtype=history_dtype(), count=count, offset=offset)
+
+
+# Function to parse the HEX response (34-byte payload for history day record)
+def parse_history_record(response):
+    record = decode_history_record(response)
+    if record is None:  # Check if payload is too short
+        print("Error: Incomplete response")
+        return None
+    return record.to_dict()
+
+
+class HexClient:
+
+    def __init__(self, ser, timeout=0.5, window=None, reader=None, demux=None, retries=2):
+        '''
+        ser:     open serial.Serial
+        timeout: seconds to wait for the reply to each request before resending it
+        window:  max requests outstanding at once, None for no limit
+        reader:  SerialReader already wrapping ser, if there is one
+        demux:   VedirectDemux to share (ie Vedirect.demux), one is made if None
+        retries: times a request without a reply is sent again
+        '''
+        self.ser = ser
+        self.demux = demux or VedirectDemux(ser, reader)
+        self.reader = self.demux.reader
+        self.demux.subscribe(REPLY_ROUTE, self.handle_line)
+        self.demux.subscribe(ASYNC_ROUTE, self.handle_line)
+        self.timeout = timeout
+        self.window = window
+        # (response command, register) -> HexMessage, filled as replies arrive
+        self.replies = {}
+        # keys waiting for a DONE reply (app version / product id), oldest first
+        self.done_waiting = deque()
+        self.async_values = {}
+        # recent lines that failed to decode or match, and how many there were in all
+        self.errors = deque(maxlen=RECENT_ERRORS)
+        self.error_count = 0
+        self.retries = retries
+        self.retried = 0
+        self.timeouts = 0
+        # command name -> LatencyHistogram of send to reply times
+        self.latencies = {}
+        # observe(command name, register or None, seconds) for each reply, see metrics.py
+        self.observe_roundtrip = None
+
+    def handle_line(self, line):
+        message = decode(line)
+        if message is None:
+            self.error(bytes(line))
+            return None
+        if message.command == ASYNC:
+            self.async_values[message.register] = message
+        elif message.command in (GET_RESPONSE, SET_RESPONSE):
+            self.replies[(message.command, message.register)] = message
+        elif message.command == PING_RESPONSE:
+            self.replies[(PING_RESPONSE, None)] = message
+        elif message.command == DONE and self.done_waiting:
+            self.replies[self.done_waiting.popleft()] = message
+        else:
+            self.error(message)
+        return message
+
+    def error(self, item):
+        self.errors.append(item)
+        self.error_count += 1
+
+    def pump(self):
+        '''Read one chunk from the port, HEX lines come back through handle_line.'''
+        self.demux.pump()
+
+    def close(self):
+        '''Stop taking HEX lines from a shared demux.'''
+        self.demux.unsubscribe(REPLY_ROUTE, self.handle_line)
+        self.demux.unsubscribe(ASYNC_ROUTE, self.handle_line)
+
+    def request(self, frames, timeout=None, retries=None):
+        '''
+        Send [(key, frame), ...] with up to self.window outstanding and wait
+        until every key has a reply. A request still waiting after timeout
+        seconds without any reply arriving is sent again, up to retries times.
+        Returns {key: HexMessage}, keys without a reply are missing.
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        queue = deque(frames)
+        frame_of = dict(frames)
+        attempts = {}
+        sent = {}           # key -> (monotonic send time, deadline)
+        results = {}
+        while queue or sent:
+            now = time.monotonic()
+            for key in [k for k, (_, deadline) in sent.items() if deadline <= now]:
+                del sent[key]
+                if key in self.done_waiting:
+                    self.done_waiting.remove(key)
+                if attempts[key] <= retries:
+                    self.retried += 1
+                    queue.appendleft((key, frame_of[key]))
+                else:
+                    self.timeouts += 1
+            burst = []
+            while queue and (self.window is None or len(sent) < self.window):
+                key, frame = queue.popleft()
+                self.replies.pop(key, None)
+                if key[0] == DONE:
+                    self.done_waiting.append(key)
+                attempts[key] = attempts.get(key, 0) + 1
+                sent[key] = (now, now + timeout)
+                burst.append(frame)
+            if burst:
+                self.ser.write(b''.join(burst))
+            if not sent:
+                break
+            # returns as soon as bytes arrive, never later than the next deadline
+            if self.reader.wait(min(deadline for _, deadline in sent.values()) - time.monotonic()):
+                self.pump()
+            answered = [k for k in sent if k in self.replies]
+            now = time.monotonic()
+            for key in answered:
+                results[key] = self.replies.pop(key)
+                elapsed = now - sent.pop(key)[0]
+                self.latency(key).observe(elapsed)
+                if self.observe_roundtrip is not None:
+                    register = key[1] if key[0] in (GET_RESPONSE, SET_RESPONSE) else None
+                    self.observe_roundtrip(self.command_name(key), register, elapsed)
+            if answered:
+                # replies are still coming in (a burst is answered one by one
+                # at 19200 baud), only a silent line counts against a deadline
+                for key, (start, _) in sent.items():
+                    sent[key] = (start, now + timeout)
+        return results
+
+    @staticmethod
+    def command_name(key):
+        return COMMAND_NAMES.get(key[1] if key[0] == DONE else key[0], 'other')
+
+    def latency(self, key):
+        '''LatencyHistogram of the command type of request key.'''
+        name = self.command_name(key)
+        histogram = self.latencies.get(name)
+        if histogram is None:
+            histogram = self.latencies[name] = LatencyHistogram()
+        return histogram
+
+    def command(self, line, timeout=None, retries=None):
+        '''
+        Send one raw HEX line (ie ':7A8ED00B9') and return its reply as a
+        HexMessage, None on timeout or for commands without a reply (restart).
+        A line ending in '??' instead of a checksum gets its checksum filled in.
+        ValueError for a malformed line or a wrong checksum.
+        '''
+        if isinstance(line, str):
+            line = line.encode()
+        line = line.strip()
+        if line.startswith(b':') and line.endswith(b'??'):
+            try:
+                line = encode(int(line[1:2], 16), bytes.fromhex(line[2:-2].decode()))
+            except ValueError:
+                raise ValueError('bad HEX command %r' % line) from None
+        line = line.strip() + b'\n'
+        message = decode(line)
+        if message is None:
+            raise ValueError('bad HEX command %r (checksum?)' % line)
+        if message.command in (GET, SET):
+            key = (message.command, message.register)
+        elif message.command == PING:
+            key = (PING_RESPONSE, None)
+        elif message.command in (APP_VERSION, PRODUCT_ID):
+            key = (DONE, message.command)
+        else:
+            self.ser.write(line)
+            return None
+        return self.request([(key, line)], timeout, retries).get(key)
+
+    def stats(self):
+        return {
+            'latency': {name: histogram.stats() for name, histogram in self.latencies.items()},
+            'retried': self.retried,
+            'timeouts': self.timeouts,
+            'errors': self.error_count,
+        }
+
+    def get_many(self, registers, timeout=None):
+        '''Pipelined GET of several registers, returns {register: HexMessage}.'''
+        frames = [((GET_RESPONSE, r), encode_get(r)) for r in registers]
+        return {key[1]: msg for key, msg in self.request(frames, timeout).items()}
+
+    def get(self, register, timeout=None):
+        return self.get_many([register], timeout).get(register)
+
+    def set(self, register, value, size=2, flags=0, timeout=None):
+        key = (SET_RESPONSE, register)
+        return self.request([(key, encode_set(register, value, size, flags))], timeout).get(key)
+
+    def ping(self, timeout=None):
+        key = (PING_RESPONSE, None)
+        return self.request([(key, encode_ping())], timeout).get(key)
+
+    def app_version(self, timeout=None):
+        key = (DONE, APP_VERSION)
+        return self.request([(key, encode_app_version())], timeout).get(key)
+
+    def product_id(self, timeout=None):
+        key = (DONE, PRODUCT_ID)
+        return self.request([(key, encode_product_id())], timeout).get(key)
+
+    def get_history_records(self, days=HISTORY_DAYS, timeout=None):
+        '''
+        Pull the raw 34 byte history day records 0 (today) .. days-1 in one
+        pipelined burst, None for days that did not answer or answered with
+        an error flag.
+        '''
+        registers = [HISTORY_REGISTER + day for day in range(min(days, HISTORY_DAYS))]
+        replies = self.get_many(registers, timeout)
+        records = []
+        for register in registers:
+            message = replies.get(register)
+            if message is None or message.flags or len(message.value) < HISTORY_RECORD_SIZE:
+                records.append(None)
+            else:
+                records.append(message.value)
+        return records
+
+    def get_history(self, days=HISTORY_DAYS, timeout=None):
+        '''Like get_history_records, decoded with parse_history_record.'''
+        return [None if record is None else parse_history_record(record)
+                for record in self.get_history_records(days, timeout)]
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+'''
+Chunked VE.Direct stream parser.
+
+Takes arbitrary chunks of serial data (bytes, bytearray or memoryview) and
+splits them into complete TEXT frames and HEX lines. Frame boundaries are
+found with bytes.find on '\\r\\n', ':' and '\\r\\nChecksum\\t' instead of
+walking a state machine byte by byte, so the cost per chunk is a handful of
+C level searches rather than one Python call per byte.
+
+TEXT frame:  \\r\\nKEY\\tVALUE ... \\r\\nChecksum\\t<byte>   (sum of all bytes & 0xFF == 0)
+HEX line:    :<cmd><hex digits>\\n
+
+HEX lines are only ever sent between TEXT frames, so a ':' inside a TEXT
+frame means the frame was interrupted; it is dropped just like Vedirect.input
+drops it.
+
+ResyncParser is the same for noisy lines: it only takes a frame start or a
+':' at a known boundary, skips straight to the next '\r\nPID\t' or valid
+HEX line after corruption, and can hand out what is left of a corrupt frame
+over the last good one (recover=True).
+'''
+
+import re
+
+from vedirect_frame import INT_FIELDS
+
+TEXT = 'text'
+HEX = 'hex'
+
+CHECKSUM_MARKER = b'\r\nChecksum\t'
+BLOCK_START = b'\r\nPID\t'
+# a full MPPT TEXT block is ~200 bytes, anything much longer is line noise
+MAX_FRAME = 1024
+# longest HEX line: history record reply, 83 bytes
+MAX_HEX = 256
+# TEXT lines as a device sends them: ASCII key, tab, printable ASCII value without ':'
+PLAUSIBLE_LINES = re.compile(rb'[A-Za-z0-9_#]+\t[ -9;-~]*(?:\r\n[A-Za-z0-9_#]+\t[ -9;-~]*)*')
+
+
+class VedirectParser:
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scan = 0           # where to resume the search for the checksum marker
+        self.frames_ok = 0
+        self.frames_bad = 0
+
+    def feed(self, data):
+        '''
+        Add a chunk of serial data and return the list of completed events
+        in arrival order, each a tuple (TEXT, {key: value}) or (HEX, b':...\\n').
+        Incomplete data is kept until the next call.
+        '''
+        buf = self.buffer
+        buf += data
+        events = []
+        n = len(buf)
+        pos = 0
+        while pos < n:
+            colon = buf.find(b':', pos)
+            header = buf.find(b'\r\n', pos)
+
+            # HEX line before the next TEXT frame
+            if colon != -1 and (header == -1 or colon < header):
+                end = buf.find(b'\n', colon)
+                if end == -1:
+                    pos = colon
+                    break
+                # a ':' inside the line starts over, like Vedirect.input
+                restart = buf.rfind(b':', colon + 1, end)
+                if restart != -1:
+                    colon = restart
+                events.append((HEX, bytes(buf[colon:end + 1])))
+                pos = end + 1
+                continue
+
+            if header == -1:
+                # keep a trailing '\r' that may start the next frame
+                pos = n - 1 if buf[n - 1] == 0x0D else n
+                break
+
+            marker = buf.find(CHECKSUM_MARKER, max(header, self.scan))
+            if marker == -1 or marker + len(CHECKSUM_MARKER) >= n:
+                if colon != -1:
+                    # frame interrupted by a HEX line
+                    self.frames_bad += 1
+                    self.scan = 0
+                    pos = colon
+                    continue
+                if n - header > MAX_FRAME:
+                    self.frames_bad += 1
+                    self.scan = 0
+                    pos = n - len(CHECKSUM_MARKER)
+                    break
+                pos = header
+                if marker == -1:
+                    self.scan = max(header, n - len(CHECKSUM_MARKER) + 1)
+                else:
+                    self.scan = marker
+                break
+
+            self.scan = 0
+            if colon != -1 and colon < marker:
+                self.frames_bad += 1
+                pos = colon
+                continue
+
+            end = marker + len(CHECKSUM_MARKER) + 1
+            if sum(buf[header:end]) & 0xFF:
+                self.frames_bad += 1
+            else:
+                self.frames_ok += 1
+                events.append((TEXT, self.split_fields(buf[header + 2:marker])))
+            pos = end
+
+        if pos:
+            del buf[:pos]
+            if self.scan:
+                self.scan = max(0, self.scan - pos)
+        return events
+
+    @staticmethod
+    def split_fields(body):
+        # latin-1 keeps the chr(byte) mapping of Vedirect.input
+        text = body.decode('latin-1')
+        if text.count('\t') == text.count('\r\n') + 1:
+            # one tab per line: split everything in one go and pair up
+            parts = iter(text.replace('\r\n', '\t').split('\t'))
+            return dict(zip(parts, parts))
+        frame = {}
+        for line in text.split('\r\n'):
+            key, _, value = line.partition('\t')
+            frame[key] = value
+        return frame
+
+    def frames(self, data):
+        '''Feed data and return only the TEXT frames.'''
+        return [payload for kind, payload in self.feed(data) if kind == TEXT]
+
+    def reset(self):
+        self.buffer.clear()
+        self.scan = 0
+
+
+def valid_hex_line(line):
+    '''True if line is ':<hex digits>\\n' with a matching checksum.'''
+    body = bytes(line[1:]).rstrip(b'\r\n')
+    if len(body) < 3 or not len(body) % 2 or not body.isalnum():
+        return False
+    try:
+        data = bytes.fromhex('0' + body.decode('ascii'))
+    except ValueError:
+        return False
+    return sum(data) & 0xFF == 0x55
+
+
+def plausible_field(key, value):
+    '''
+    True if a TEXT line could have come from a device: an ASCII key of
+    letters, digits, '_' and '#', a printable ASCII value without ':', and a
+    number where one is expected.
+    '''
+    if not key.isascii() or not key.replace('#', '').replace('_', '').isalnum():
+        return False
+    if not value.isascii() or not value.isprintable() or ':' in value:
+        return False
+    return key not in INT_FIELDS or value.lstrip('-').isdigit()
+
+
+class Recovered(dict):
+    '''
+    TEXT fields of a frame that failed its checksum: the last good frame's
+    values, updated with the lines of the corrupt frame that still look
+    right (known key, printable value, a number where one is expected).
+    Those lines are unverified, a digit changed on the line still gets in.
+    '''
+
+
+class ResyncParser(VedirectParser):
+    '''
+    VedirectParser for noisy lines. A frame is only started at '\\r\\n'
+    right after the previous frame or HEX line, or at '\\r\\nPID\\t'; a
+    HEX line only if it checks out. After corruption the bytes up to the next
+    such boundary are skipped.
+
+    It does not lose fewer frames than VedirectParser: a fault in a frame
+    costs that frame with either (bench_faults.py). What it adds is that no
+    corrupt HEX line is handed on, a frame whose checksum matches by chance
+    is still dropped when a line of it is malformed (PLAUSIBLE_LINES), and
+    stats() counts what the noise cost.
+
+    feed() returns the same events as VedirectParser, plus a
+    (TEXT, Recovered) event for each corrupt frame when recover is True.
+    Recovered values are unverified and can be wrong.
+    '''
+
+    def __init__(self, recover=False):
+        super().__init__()
+        self.recover = recover
+        self.synced = False         # the buffer starts at a frame or HEX line boundary
+        self.last_good = None
+        self.frames_recovered = 0
+        self.resyncs = 0            # times bytes were skipped to find a boundary
+        self.bytes_skipped = 0
+        self.hex_ok = 0
+        self.hex_bad = 0
+
+    def feed(self, data):
+        buf = self.buffer
+        buf += data
+        events = []
+        n = len(buf)
+        pos = 0
+        while pos < n:
+            if buf[pos] == 0x0D and n - pos < 2:
+                break
+            if not (buf[pos] == 0x3A or (self.synced and buf.startswith(b'\r\n', pos))):
+                # hunt for the next frame or HEX line
+                block = buf.find(BLOCK_START, pos)
+                colon = buf.find(b':', pos, n if block == -1 else block)
+                start = colon if colon != -1 else block
+                if start == -1:
+                    # keep a tail that may be the start of '\r\nPID\t'
+                    start = max(pos, n - len(BLOCK_START) + 1)
+                    self.skip(start - pos)
+                    pos = start
+                    break
+                self.skip(start - pos)
+                pos = start
+
+            if buf[pos] == 0x3A:
+                end = buf.find(b'\n', pos, pos + MAX_HEX)
+                if end == -1:
+                    if n - pos < MAX_HEX:
+                        break
+                elif valid_hex_line(buf[pos:end + 1]):
+                    self.hex_ok += 1
+                    self.synced = True
+                    events.append((HEX, bytes(buf[pos:end + 1])))
+                    pos = end + 1
+                    continue
+                # noise, not a HEX line: hunt again from the next byte
+                self.hex_bad += 1
+                self.synced = False
+                pos += 1
+                continue
+
+            marker = buf.find(CHECKSUM_MARKER, pos)
+            block = buf.find(BLOCK_START, pos + 2)
+            if marker != -1 and (block == -1 or marker < block):
+                end = marker + len(CHECKSUM_MARKER) + 1
+                if end > n:
+                    break
+                self.close_frame(buf, pos, marker, end, events)
+                pos = end
+            elif block != -1:
+                # the checksum line was lost, the next block starts first
+                self.corrupt_frame(buf, pos, block, events)
+                pos = block
+            elif n - pos > MAX_FRAME:
+                self.frames_bad += 1
+                self.synced = False
+                pos += 2
+            else:
+                break
+            self.synced = True
+
+        if pos:
+            del buf[:pos]
+        return events
+
+    def skip(self, count):
+        if count:
+            self.resyncs += 1
+            self.bytes_skipped += count
+        self.synced = False
+
+    def close_frame(self, buf, start, marker, end, events):
+        fields = None
+        # 1 in 256 corrupt frames passes the checksum, its lines still have to look right
+        if not sum(buf[start:end]) & 0xFF and PLAUSIBLE_LINES.fullmatch(buf, start + 2, marker):
+            fields = self.split_fields(buf[start + 2:marker])
+        if fields is None:
+            self.corrupt_frame(buf, start, marker, events)
+            return
+        self.frames_ok += 1
+        self.last_good = fields
+        events.append((TEXT, fields))
+
+    def corrupt_frame(self, buf, start, end, events):
+        self.frames_bad += 1
+        body = bytes(buf[start + 2:end])
+        # the device interrupted the frame with a HEX line
+        colon = body.find(b':')
+        while colon != -1:
+            newline = body.find(b'\n', colon)
+            if newline == -1:
+                break
+            if valid_hex_line(body[colon:newline + 1]):
+                self.hex_ok += 1
+                events.append((HEX, body[colon:newline + 1]))
+                colon = body.find(b':', newline)
+            else:
+                colon = body.find(b':', colon + 1)
+        if self.recover and self.last_good is not None:
+            fields = self.partial_fields(body)
+            if fields:
+                recovered = Recovered(self.last_good)
+                recovered.update(fields)
+                self.frames_recovered += 1
+                events.append((TEXT, recovered))
+
+    def partial_fields(self, body):
+        fields = {}
+        known = self.last_good
+        for line in body.split(b'\r\n'):
+            key, tab, value = line.partition(b'\t')
+            if not tab:
+                continue
+            key = key.decode('latin-1')
+            value = value.decode('latin-1')
+            if key in known and plausible_field(key, value):
+                fields[key] = value
+        return fields
+
+    def stats(self):
+        total = self.frames_ok + self.frames_bad
+        return {
+            'frames_ok': self.frames_ok,
+            'frames_bad': self.frames_bad,
+            'frames_recovered': self.frames_recovered,
+            'resyncs': self.resyncs,
+            'bytes_skipped': self.bytes_skipped,
+            'hex_ok': self.hex_ok,
+            'hex_bad': self.hex_bad,
+            'goodput': self.frames_ok / total if total else 0.0,
+        }
+
+    def reset(self):
+        super().reset()
+        self.synced = False
@@ -13,15 +13,15 @@ def print_data_callback(packet):
 if __name__ == '__main__':
     ve = Vedirect(PORT, TIMEOUT)
     # print(ve.read_data_callback(print_data_callback))
-    packet = ve.read_data_single()
-    print(packet)
+    frame = ve.read_frame()
+    print(frame)
     
-    # Extract values from packet, defaulting to 0 if not present
-    solar_power = float(packet.get('PPV', 0))  #  W
-    solar_voltage = float(packet.get('VPV', 0)) / 1000.0  # Convert from 0.001V to V
-    solar_current = float(packet.get('PPV', 0)) / solar_voltage  # Convert from 0.1W to W
-    battery_voltage = float(packet.get('V', 0)) / 1000.0  # Convert from 0.001V to V
-    battery_current = float(packet.get('I', 0)) / 1000.0  # Convert from 0.001A to A
+    # Scaled values, 0 if the field is not in the frame (panel current is 0 without panel voltage)
+    solar_power = frame.panel_power or 0  #  W
+    solar_voltage = frame.panel_voltage or 0.0  # V
+    solar_current = frame.panel_current or 0.0  # A, PPV / VPV
+    battery_voltage = frame.battery_voltage or 0.0  # V
+    battery_current = frame.battery_current or 0.0  # A
     
     print("Solar Power: %.2f W, Solar Voltage: %.2f V, Solar Current: %.2f A, Battery Voltage: %.2f V, Battery Current: %.2f A" % 
           (solar_power, solar_voltage, solar_current, battery_voltage, battery_current))
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Replay captured VE.Direct serial data without hardware.
+
+load_capture() reads the captures in the repo root:
+
+    serial dump-1.txt, serial dump.txt   raw bytes as received
+    raw serial dump.txt                  comma separated decimal bytes
+    *.csv                                logic analyser async serial export
+                                         (time [s], byte) as used by SITL's
+                                         logic_async_csv, keeps the timing
+    *.vdc                                capture_recorder.py recordings,
+                                         keep the timing
+
+ReplaySerial plays a capture through the serial.Serial interface (read,
+readinto, in_waiting, write) so Vedirect, SerialReader, HexClient and
+SolarHistory take it as an already open port:
+
+    ve = Vedirect(ReplaySerial(load_capture('serial dump-1.txt'), speed=10), 1)
+
+speed 1 replays in real time, N times faster and None as fast as the reader
+can take it. Real time is the capture timestamps when it has them, otherwise
+the bytes are paced at 19200 baud with one TEXT block per second.
+Writes are recorded in .written and otherwise ignored.
+
+PtyReplay does the same behind a pseudo terminal, for code that opens the
+port by name (ie SolarHistory.connect, fleet_poller, the lua script via SITL):
+
+    python3 vedirect_replay.py 'serial dump.txt' --pty --loop
+    python3 vedirect_replay.py 'serial dump-1.txt' -s 0      # parser throughput
+'''
+
+import argparse
+import bisect
+import csv
+import os
+import re
+import select
+import threading
+import time
+
+BAUDRATE = 19200
+BITS_PER_BYTE = 10      # 8N1
+FRAME_INTERVAL = 1.0    # TEXT blocks are sent once a second
+BLOCK_START = b'\r\nPID\t'
+
+
+class Capture:
+    '''
+    Recorded bytes and their timing. The timing is kept as anchors: byte
+    starts[k] is sent at times[k] seconds and the bytes after it follow
+    back to back at the baud rate until the next anchor.
+    '''
+
+    def __init__(self, data, starts=None, times=None, name='', baudrate=BAUDRATE):
+        self.data = bytes(data)
+        self.starts = starts or [0]
+        self.times = times or [0.0]
+        self.name = name
+        self.byte_time = BITS_PER_BYTE / baudrate
+
+    def __len__(self):
+        return len(self.data)
+
+    def duration(self):
+        return self.time_of(len(self.data))
+
+    def time_of(self, n):
+        '''Seconds from the start of the capture until byte n is sent.'''
+        k = bisect.bisect_right(self.starts, n) - 1
+        return self.times[k] + (n - self.starts[k]) * self.byte_time
+
+    def sent_by(self, t):
+        '''Number of bytes sent t seconds into the capture.'''
+        k = bisect.bisect_right(self.times, t) - 1
+        if k < 0:
+            return 0
+        n = self.starts[k] + int((t - self.times[k]) / self.byte_time) + 1
+        end = self.starts[k + 1] if k + 1 < len(self.starts) else len(self.data)
+        return min(n, end)
+
+
+def block_timing(data, interval=FRAME_INTERVAL, baudrate=BAUDRATE):
+    '''
+    Anchors for a capture without timestamps: each TEXT block starts
+    interval seconds after the previous one (or when the line is free again),
+    HEX traffic in between follows at the baud rate.
+    '''
+    byte_time = BITS_PER_BYTE / baudrate
+    starts, times = [0], [0.0]
+    block = data.find(BLOCK_START)
+    previous = None
+    while block != -1:
+        if block:
+            free = times[-1] + (block - starts[-1]) * byte_time
+            t = free if previous is None else max(free, previous + interval)
+            starts.append(block)
+            times.append(t)
+            previous = t
+        else:
+            previous = 0.0
+        block = data.find(BLOCK_START, block + 1)
+    return starts, times
+
+
+def load_capture(path, interval=FRAME_INTERVAL, baudrate=BAUDRATE):
+    if path.endswith('.vdc'):
+        from capture_recorder import CaptureFile
+        return CaptureFile(path).capture(baudrate=baudrate)
+    with open(path, 'rb') as f:
+        data = f.read()
+    name = os.path.basename(path)
+    if path.endswith('.csv'):
+        return load_csv_capture(data, name, baudrate)
+    if data and re.fullmatch(rb'[\d,\s]+', data):
+        data = bytes(int(n) for n in re.findall(rb'\d+', data))
+    starts, times = block_timing(data, interval, baudrate)
+    return Capture(data, starts, times, name, baudrate)
+
+
+def load_csv_capture(data, name='', baudrate=BAUDRATE):
+    '''Rows of time, value (decimal, 0x.. or a quoted character), a header row is skipped.'''
+    values = bytearray()
+    times = []
+    for row in csv.reader(data.decode('latin-1').splitlines()):
+        if len(row) < 2:
+            continue
+        try:
+            t = float(row[0])
+        except ValueError:
+            continue    # header
+        value = row[1].strip()
+        if value.lower().startswith('0x'):
+            byte = int(value, 16)
+        elif value.isdigit():
+            byte = int(value)
+        else:
+            value = value.strip('\'"')
+            byte = ord(value.encode('latin-1').decode('unicode_escape')) if value else 0
+        values.append(byte & 0xFF)
+        times.append(t)
+    start = times[0] if times else 0.0
+    return Capture(values, list(range(len(values))), [t - start for t in times], name, baudrate)
+
+
+class ReplaySerial:
+
+    def __init__(self, capture, speed=1.0, timeout=1.0, loop=False):
+        '''
+        capture:  Capture (or bytes, paced at the baud rate) to play
+        speed:    1 real time, N times faster, None (or 0) as fast as possible
+        timeout:  longest read() wait, like serial.Serial
+        loop:     start over at the end instead of going silent
+        '''
+        if not isinstance(capture, Capture):
+            capture = Capture(capture)
+        self.capture = capture
+        self.data = capture.data
+        self.speed = speed or None
+        self.timeout = timeout
+        self.loop = loop
+        self.port = capture.name
+        self.is_open = True
+        self.written = []
+        self.pos = 0
+        self.laps = 0
+        self.start = time.monotonic()
+
+    @property
+    def eof(self):
+        return not self.loop and self.pos >= len(self.data)
+
+    def lap(self):
+        return self.capture.duration() + self.capture.byte_time
+
+    def arrived(self, now=None):
+        '''Number of bytes the device has sent so far (all of them when not paced).'''
+        total = len(self.data)
+        if self.speed is None or not total:
+            return (self.laps + 1) * total if self.loop else total
+        elapsed = ((now or time.monotonic()) - self.start) * self.speed
+        if not self.loop:
+            return self.capture.sent_by(elapsed)
+        laps, elapsed = divmod(elapsed, self.lap())
+        return int(laps) * total + self.capture.sent_by(elapsed)
+
+    def time_of(self, n):
+        '''Monotonic time at which byte n (counted from the start) has arrived.'''
+        total = len(self.data)
+        if self.loop:
+            laps, n = divmod(n, total)
+            offset = laps * self.lap() + self.capture.time_of(n)
+        else:
+            offset = self.capture.time_of(min(n, total - 1))
+        return self.start + offset / self.speed
+
+    @property
+    def in_waiting(self):
+        return max(0, self.arrived() - self.pos)
+
+    def take(self, size):
+        total = len(self.data)
+        if self.loop and total:
+            out = bytearray()
+            while len(out) < size:
+                offset = self.pos % total
+                chunk = self.data[offset:offset + size - len(out)]
+                out += chunk
+                self.pos += len(chunk)
+                self.laps = self.pos // total
+            return bytes(out)
+        out = self.data[self.pos:self.pos + size]
+        self.pos += len(out)
+        return out
+
+    def read(self, size=1):
+        '''Up to size bytes, waiting up to timeout for them to "arrive".'''
+        if self.speed is not None:
+            deadline = time.monotonic() + (self.timeout if self.timeout is not None else 1e9)
+            while self.in_waiting < size and not self.eof:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake = min(self.time_of(self.pos + size - 1), deadline)
+                time.sleep(max(wake - now, 0.0005))
+        return self.take(min(size, self.in_waiting))
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.pos = self.arrived()
+
+    def rewind(self):
+        self.pos = 0
+        self.laps = 0
+        self.start = time.monotonic()
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyReplay:
+    '''
+    Plays a capture into the master side of a pty, .port is the slave device
+    name to open with serial.Serial / Vedirect / SolarHistory.
+    '''
+
+    def __init__(self, capture, speed=1.0, loop=False):
+        self.source = ReplaySerial(capture, speed, timeout=0.1, loop=loop)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.running = False
+        self.written = bytearray()
+
+    def start(self):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.source.rewind()
+        self.thread = threading.Thread(target=self.run, name='pty-replay', daemon=True)
+        self.thread.start()
+        return self.port
+
+    def run(self):
+        source = self.source
+        while self.running and not source.eof:
+            data = source.read(source.in_waiting or 1)
+            while data and self.running:
+                _, ready, _ = select.select([], [self.master], [], 0.1)
+                if ready:
+                    data = data[os.write(self.master, data):]
+            # keep whatever the client writes (GET requests) from filling the pty
+            while select.select([self.master], [], [], 0)[0]:
+                self.written += os.read(self.master, 4096)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    from vedirect import Vedirect
+
+    parser = argparse.ArgumentParser(description='Replay a VE.Direct capture')
+    parser.add_argument('capture', help="capture file, e.g. 'serial dump-1.txt'")
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help='1 real time, N times faster, 0 as fast as possible')
+    parser.add_argument('-l', '--loop', action='store_true', help='start over at the end')
+    parser.add_argument('--pty', action='store_true', help='serve the capture on a pty instead')
+    args = parser.parse_args()
+
+    capture = load_capture(args.capture)
+    print(f'{capture.name}: {len(capture)} bytes, {capture.duration():.1f} s at real time')
+
+    if args.pty:
+        with PtyReplay(capture, args.speed, args.loop) as replay:
+            print('serving on', replay.port)
+            try:
+                while replay.running:
+                    time.sleep(0.2)
+            except KeyboardInterrupt:
+                pass
+        print(f'client wrote {len(replay.written)} bytes')
+    else:
+        port = ReplaySerial(capture, args.speed, loop=args.loop)
+        ve = Vedirect(port, 1)
+        frames = 0
+        start = time.perf_counter()
+        try:
+            while not port.eof:
+                for packet in ve.packets(ve.reader.read()):
+                    frames += 1
+        except KeyboardInterrupt:
+            pass
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(f'{frames} frames, {ve.reader.bytes} bytes in {elapsed:.3f} s: '
+              f'{frames / elapsed:.0f} frames/s, {ve.reader.bytes / elapsed / 1e6:.2f} MB/s')
+        print('serial reads:', ve.reader.stats())
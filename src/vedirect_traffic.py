@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Synthetic VE.Direct traffic for benchmarks and replay.
+
+TrafficDevice is an MPPT whose values drift from second to second; every
+second it sends, like the device in 'serial dump-1.txt', a few ':A' async
+register updates and a TEXT block with a correct checksum, plus the ':7'
+reply to a history GET every history_every seconds:
+
+    device = TrafficDevice('HQ0000000001', seed=1)
+    data = device.stream(3600)                  # an hour of traffic, bytes
+    streams = generate(devices=8, frames=600, noise=1e-4)
+    # {'HQ0000000000': b'...', 'HQ0000000001': b'...', ...}
+
+noise is faults per byte (a byte changed, dropped or inserted, or a stray
+':'), see inject_faults(). Everything is seeded, the same arguments give
+the same bytes.
+
+python3 vedirect_traffic.py -n 4 -f 3600 --noise 1e-4 -o captures/
+'''
+
+import argparse
+import os
+import random
+
+from vedirect_hex import encode, register_payload, ASYNC, GET_RESPONSE, HISTORY_REGISTER, HISTORY_DAYS, HISTORY_STRUCT
+
+# async updates seen in the dumps: register, value size in bytes
+ASYNC_REGISTERS = (
+    (0xEDBC, 4),    # panel power, 0.01 W
+    (0xEDBB, 2),    # panel voltage, 0.01 V
+    (0xEDD5, 2),    # battery voltage, 0.01 V
+    (0xEDA9, 2),    # charger current, 0.1 A
+)
+
+
+def text_block(fields):
+    '''TEXT block bytes of {key: value} with the checksum byte that makes the sum 0.'''
+    body = b''.join(b'\r\n%s\t%s' % (key.encode('latin-1'), str(value).encode('latin-1'))
+                    for key, value in fields.items())
+    body += b'\r\nChecksum\t'
+    return body + bytes([-sum(body) & 0xFF])
+
+
+def inject_faults(data, rate, seed=1):
+    '''data with about rate * len(data) faults, returns (bytes, number of faults).'''
+    rng = random.Random(seed)
+    out = bytearray()
+    faults = 0
+    pos = 0
+    n = len(data)
+    while pos < n:
+        # distance to the next fault, geometric at rate
+        gap = int(rng.expovariate(rate)) if rate else n
+        out += data[pos:pos + gap]
+        pos += gap
+        if pos >= n:
+            break
+        faults += 1
+        kind = rng.randrange(4)
+        if kind == 0:
+            out.append(rng.randrange(256))
+            pos += 1
+        elif kind == 1:
+            pos += 1
+        elif kind == 2:
+            out.append(rng.randrange(256))
+        else:
+            out += b':'
+    return bytes(out), faults
+
+
+class TrafficDevice:
+
+    def __init__(self, serial='HQ2423N36NE', seed=None, day_sequence=85):
+        self.serial = serial
+        self.random = random.Random(serial if seed is None else seed)
+        self.day_sequence = day_sequence
+        self.battery_mv = 12800
+        self.panel_mv = 16050
+        self.panel_w = 12
+        self.load_ma = 0
+        self.yield_total = 781      # 0.01 kWh
+        self.yield_today = 10
+        self.max_power_today = 13
+        self.seconds = 0
+        self.next_day = 0
+
+    def step(self):
+        '''Advance the device by one second.'''
+        rng = self.random
+        self.seconds += 1
+        self.panel_w = max(0, min(400, self.panel_w + rng.randint(-5, 5)))
+        self.panel_mv = max(0, min(45000, self.panel_mv + rng.randint(-50, 50)))
+        self.battery_mv = max(11000, min(14600, self.battery_mv + rng.randint(-10, 10)))
+        self.load_ma = max(0, min(20000, self.load_ma + rng.randint(-100, 100)))
+        self.max_power_today = max(self.max_power_today, self.panel_w)
+        if self.seconds % 3600 == 0:
+            self.yield_today += self.panel_w // 10
+            self.yield_total += self.panel_w // 10
+
+    def fields(self):
+        charge_ma = self.panel_w * 1000000 // max(self.battery_mv, 1)
+        return {
+            'PID': '0xA060', 'FW': '164', 'SER#': self.serial,
+            'V': self.battery_mv, 'I': charge_ma - self.load_ma, 'VPV': self.panel_mv, 'PPV': self.panel_w,
+            'CS': 3 if self.panel_w else 0, 'MPPT': 2 if self.panel_w else 0, 'OR': '0x00000000',
+            'ERR': 0, 'LOAD': 'ON' if self.load_ma else 'OFF', 'IL': self.load_ma,
+            'H19': self.yield_total, 'H20': self.yield_today, 'H21': self.max_power_today,
+            'H22': 0, 'H23': 0, 'HSDS': self.day_sequence,
+        }
+
+    def text_block(self):
+        return text_block(self.fields())
+
+    def async_lines(self, count):
+        lines = []
+        for register, size in ASYNC_REGISTERS[:count]:
+            if register == 0xEDBC:
+                value = self.panel_w * 100
+            elif register == 0xEDBB:
+                value = self.panel_mv // 10
+            elif register == 0xEDD5:
+                value = self.battery_mv // 10
+            else:
+                value = self.load_ma // 100
+            lines.append(encode(ASYNC, register_payload(register, 0, value.to_bytes(size, 'little'))))
+        return lines
+
+    def history_record(self, day):
+        rng = random.Random('%s-%d' % (self.serial, self.day_sequence - day))
+        return HISTORY_STRUCT.pack(
+            0, rng.randint(0, 500), rng.randint(0, 200), rng.randint(1300, 1460), rng.randint(1100, 1250),
+            0, 0, 0, 0, 0, rng.randint(0, 600), rng.randint(0, 300), rng.randint(0, 600),
+            rng.randint(0, 400), rng.randint(0, 300), rng.randint(1500, 4500), self.day_sequence - day)
+
+    def history_reply(self, day):
+        '''The ':7' reply line to a GET of history day record day.'''
+        return encode(GET_RESPONSE, register_payload(HISTORY_REGISTER + day, 0, self.history_record(day)))
+
+    def stream(self, frames, async_lines=4, history_every=2, history_days=HISTORY_DAYS):
+        '''
+        frames seconds of traffic: HEX lines, then the TEXT block, each second.
+        The history replies go through days 0 .. history_days-1 in turn.
+        '''
+        out = bytearray()
+        for n in range(frames):
+            self.step()
+            if history_every and n % history_every == 0:
+                out += self.history_reply(self.next_day)
+                self.next_day = (self.next_day + 1) % history_days
+            for line in self.async_lines(async_lines):
+                out += line
+            out += self.text_block()
+        return bytes(out)
+
+
+def device_serial(n):
+    return 'HQ%010d' % n
+
+
+def generate(devices=1, frames=1000, noise=0.0, seed=1, async_lines=4, history_every=2):
+    '''{serial: stream bytes} for devices devices, frames seconds each.'''
+    streams = {}
+    for n in range(devices):
+        device = TrafficDevice(device_serial(n), seed=seed * 1000003 + n)
+        data = device.stream(frames, async_lines, history_every)
+        if noise:
+            data, _ = inject_faults(data, noise, seed + n)
+        streams[device.serial] = data
+    return streams
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic VE.Direct captures')
+    parser.add_argument('-n', '--devices', type=int, default=1)
+    parser.add_argument('-f', '--frames', type=int, default=3600, help='seconds (TEXT blocks) per device')
+    parser.add_argument('--noise', type=float, default=0.0, help='faults per byte')
+    parser.add_argument('-a', '--async-lines', type=int, default=4, help=':A lines per second')
+    parser.add_argument('--history-every', type=int, default=2, help='seconds between history replies, 0 for none')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='.', help='directory for <serial>.txt captures')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    streams = generate(args.devices, args.frames, args.noise, args.seed, args.async_lines, args.history_every)
+    for serial, data in streams.items():
+        path = os.path.join(args.output, serial + '.txt')
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f'{path}: {len(data)} bytes')
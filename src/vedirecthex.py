@@ -4,6 +4,8 @@
 ##################################
 import sys, getopt, serial
 
+from vedirect_hex import HexClient
+
 ver = "v1.3 04/15/2022"
 
 ####################################
@@ -32,21 +34,15 @@ def main ( argv ):
     print ( "vedirecthex")
     print ( ver )
     print ( "port: " + port )
-    ser = serial.Serial ( port, 19200, timeout=10 )
-    ser.close()
+    ser = serial.Serial ( port, 19200, timeout=0.1 )
+    client = HexClient ( ser, timeout=1.0 )
+
+    reply = client.product_id()        # get product ID
+    print ( "prod: " + ( reply.raw.decode().strip() if reply else "no reply" ))
 
-    ser.open()
-    ser.write ( str.encode ( ":451\n" ))        # get product ID
-    read_val = ser.read ( size = 16 )
-    print ( "prod: " + bytes.decode ( read_val ))
-    ser.close()
-    
-    ser.open()
     print ( " cmd: " + cmd )
-    # print('command: ', str.encode ( cmd + "\n" ))
-    ser.write ( str.encode ( cmd + "\n" ))
-    read_val = ser.read ( size = 128 )
-    print ( " res: " + bytes.decode ( read_val ))
+    reply = client.command ( cmd )
+    print ( " res: " + ( reply.raw.decode().strip() if reply else "no reply" ))
     ser.close()
 
 ####################################
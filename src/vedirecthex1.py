@@ -79,6 +79,8 @@ ED
 import sys, getopt, serial
 import argparse
 
+from vedirect_hex import HexClient
+
 ver = "v1.3 04/15/2022"
 
 ####################################
@@ -90,22 +92,22 @@ def main ( port, cmd ):
     print ( "vedirecthex")
     print ( ver )
     print ( "port: " + port )
-    ser = serial.Serial ( port, 19200, timeout=10 )
-    ser.close()
+    # replies are matched by HexClient, each one is back as soon as its '\n' arrives
+    ser = serial.Serial ( port, 19200, timeout=0.1 )
+    client = HexClient ( ser, timeout=1.0 )
+
+    reply = client.product_id()        # get product ID (:451)
+    print ( "prod: " + ( reply.raw.decode().strip() if reply else "no reply" ))
 
-    ser.open()
-    ser.write ( str.encode ( ":451\n" ))        # get product ID
-    read_val = ser.read ( size = 16 )
-    print ( "prod: " + bytes.decode ( read_val ))
-    ser.close()
-    
-    ser.open()
     print ( " cmd: " + cmd )
-    command = str.encode ( cmd + "\n" )
-    print('command: ', command)
-    ser.write ( str.encode ( cmd + "\n" ))
-    read_val = ser.read ( size = 256 )
-    print ( " res: " + bytes.decode ( read_val ))
+    try:
+        reply = client.command ( cmd )
+    except ValueError as e:
+        print ( " err: " + str ( e ))
+        ser.close()
+        return
+    print ( " res: " + ( reply.raw.decode().strip() if reply else "no reply" ))
+    print ( "latency: ", client.stats()['latency'] )
     ser.close()
 
 ####################################
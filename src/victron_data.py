@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 from vedirect import Vedirect
+from vedirect_parser import VedirectParser
+from vedirect_frame import VedirectFrame
+from serial_reader import SerialReader
 import serial
 import time
 
@@ -11,24 +14,24 @@ TIMEOUT = 1       # Timeout in seconds for serial communication
 def read_victron_data_loop():
     try:
         ser = serial.Serial(PORT, BAUDRATE, timeout=TIMEOUT)
+        reader = SerialReader(ser)
+        parser = VedirectParser()
         print("Reading Victron data. Press Ctrl+C to exit.")
         while True:
-            data = {}
+            data = VedirectFrame({})
             start_time = time.time()
             # Read for a short period to capture a full set of fields
             while time.time() - start_time < 2:
-                line = ser.readline().decode('ascii', errors='ignore').strip()
-                if line:
-                    try:
-                        key, value = line.split('\t')
-                        data[key] = value
-                    except ValueError:
-                        continue
+                frames = parser.frames(reader.read())
+                if frames:
+                    data = VedirectFrame(frames[-1])
+                    reader.frames += len(frames)
+                    break
             # Extract and convert relevant fields
-            solar_power = float(data.get('PPV', 0))  # Panel power in watts
-            solar_voltage = float(data.get('VPV', 0)) / 1000  # Panel voltage in mV, convert to V
-            battery_voltage = float(data.get('V', 0)) / 1000   # Battery voltage in mV, convert to V
-            battery_current = float(data.get('I', 0)) / 1000   # Battery current in mA, convert to A
+            solar_power = data.panel_power or 0  # Panel power in watts
+            solar_voltage = data.panel_voltage or 0.0  # Panel voltage in V
+            battery_voltage = data.battery_voltage or 0.0   # Battery voltage in V
+            battery_current = data.battery_current or 0.0   # Battery current in A
 
             time.sleep(1)
     except serial.SerialException as e: